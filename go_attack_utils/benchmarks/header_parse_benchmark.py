@@ -0,0 +1,107 @@
+"""Benchmarks SGF root-node extraction on real `.sgfs` directories.
+
+Compares the per-field regex scans that `parse_game_str_to_dict` used to run
+(one `extract_prop` search over the whole line per property) with the
+single-pass `parse_root_properties` tokenizer, and reports games/sec and MB/sec
+for both, as well as for the full `parse_game_str_to_dict`.
+
+Run:
+- `python benchmarks/header_parse_benchmark.py /path/to/victimplay/run`, from the
+  go_attack_utils directory.
+"""
+
+import argparse
+import pathlib
+import re
+import time
+
+from sgf_parser import game_info
+
+# Properties `parse_game_str_to_dict` looked up with one full-line scan each.
+# BR and WR were scanned twice (for the visits and again for the rank).
+LEGACY_SCANNED_PROPERTIES = [
+    "RU",
+    "C",
+    "SZ",
+    "PB",
+    "PW",
+    "RE",
+    "KM",
+    "BR",
+    "WR",
+    "BR",
+    "WR",
+    "HA",
+]
+semicolon_pattern = re.compile(";")
+
+
+def legacy_header(sgf_str: str):
+    props = {
+        name: game_info.extract_prop(name, sgf_str)
+        for name in LEGACY_SCANNED_PROPERTIES
+    }
+    return props, len(semicolon_pattern.findall(sgf_str)) - 1
+
+
+def tokenized_header(sgf_str: str):
+    properties = game_info.parse_root_properties(sgf_str)
+    props = {
+        name: game_info.root_prop(name, properties)
+        for name in LEGACY_SCANNED_PROPERTIES
+    }
+    return props, sgf_str.count(";") - 1
+
+
+def load_lines(roots, max_bytes):
+    lines = []
+    total_bytes = 0
+    for root in roots:
+        for path in game_info.find_sgf_files(pathlib.Path(root)):
+            with open(path, "r") as f:
+                for line in f:
+                    lines.append((str(path), line.strip()))
+                    total_bytes += len(line)
+                    if max_bytes and total_bytes >= max_bytes:
+                        return lines, total_bytes
+    return lines, total_bytes
+
+
+def report(name, num_games, num_bytes, seconds):
+    print(
+        f"{name:>24}: {num_games / seconds:12.1f} games/sec "
+        f"{num_bytes / seconds / 1e6:10.1f} MB/sec ({seconds:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks regex-per-field vs single-pass SGF header parsing.",
+    )
+    parser.add_argument("roots", nargs="+", help="directories containing sgfs")
+    parser.add_argument(
+        "--max_bytes",
+        type=int,
+        help="stop reading input after this many bytes (0 for no limit)",
+        default=2 * 10**9,
+    )
+    args = parser.parse_args()
+
+    lines, num_bytes = load_lines(args.roots, args.max_bytes)
+    print(f"Loaded {len(lines)} games ({num_bytes / 1e6:.1f} MB)")
+
+    start = time.perf_counter()
+    legacy = [legacy_header(line) for _, line in lines]
+    report("regex per field", len(lines), num_bytes, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tokenized = [tokenized_header(line) for _, line in lines]
+    report("single-pass tokenizer", len(lines), num_bytes, time.perf_counter() - start)
+
+    mismatches = sum(a != b for a, b in zip(legacy, tokenized))
+    print(f"Header mismatches: {mismatches}")
+
+    start = time.perf_counter()
+    for i, (path, line) in enumerate(lines):
+        game_info.parse_game_str_to_dict(path, i + 1, line, no_victim_okay=True)
+    report("parse_game_str_to_dict", len(lines), num_bytes, time.perf_counter() - start)
@@ -0,0 +1,293 @@
+"""Measures parser throughput and memory on a synthetic corpus.
+
+Generates a corpus with `synthetic_corpus` (or uses existing sgf directories),
+then measures games/sec, MB/sec and peak RSS for:
+- `parse_game_str_to_dict`, on lines already read into memory;
+- `read_and_parse_file`, one file after another;
+- `read_and_parse_all_files`, once for each number of processes.
+
+Each case runs in a fresh process, so that its peak RSS isn't inflated by
+earlier cases. Peak RSS is a high-water mark that also counts the interpreter
+and imports, so the increase in it over the case (`peak_rss_delta_mb`) is
+reported too; that is the memory the case itself needed. For
+`read_and_parse_all_files`, the peak RSS of the largest worker process is
+reported separately.
+
+Results are written as JSON lines, one per case, together with the parameters
+and machine they were measured with. Passing a previous results file as
+`--baseline` prints how each case changed and exits with an error if any got
+slower than `--max_slowdown` allows.
+
+Run:
+- `python benchmarks/parser_benchmark.py --output results.jsonl`, from the
+  go_attack_utils directory.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import synthetic_corpus
+
+from sgf_parser import game_info
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _time_parse_game_str_to_dict(paths, fast_parse, processes):
+    lines = []
+    for path in paths:
+        with open(path, "rb") as f:
+            lines += [(str(path), line.strip()) for line in f]
+    start = time.perf_counter()
+    for i, (path, line) in enumerate(lines):
+        game_info.parse_game_str_to_dict(
+            path, i + 1, line, fast_parse=fast_parse, no_victim_okay=True
+        )
+    return time.perf_counter() - start, len(lines)
+
+
+def _time_read_and_parse_file(paths, fast_parse, processes):
+    start = time.perf_counter()
+    num_games = sum(
+        len(
+            game_info.read_and_parse_file(
+                path, fast_parse=fast_parse, no_victim_okay=True
+            )
+        )
+        for path in paths
+    )
+    return time.perf_counter() - start, num_games
+
+
+def _time_read_and_parse_all_files(paths, fast_parse, processes):
+    start = time.perf_counter()
+    games = game_info.read_and_parse_all_files(
+        paths, fast_parse=fast_parse, processes=processes, no_victim_okay=True
+    )
+    return time.perf_counter() - start, len(games)
+
+
+BENCHMARKS = {
+    "parse_game_str_to_dict": _time_parse_game_str_to_dict,
+    "read_and_parse_file": _time_read_and_parse_file,
+    "read_and_parse_all_files": _time_read_and_parse_all_files,
+}
+
+
+def run_case(
+    name: str,
+    paths: Sequence[pathlib.Path],
+    fast_parse: bool,
+    processes: int,
+    repeats: int,
+) -> Dict[str, Any]:
+    """Time one case, keeping the best of `repeats` runs.
+
+    Must run in a fresh process (see `main`), since RSS high-water marks can't be
+    reset.
+    """
+    start_peak_rss_mb = _peak_rss_mb(resource.RUSAGE_SELF)
+    seconds, num_games = min(
+        BENCHMARKS[name](paths, fast_parse, processes) for _ in range(repeats)
+    )
+    num_bytes = sum(os.path.getsize(path) for path in paths)
+    return {
+        "benchmark": name,
+        "fast_parse": fast_parse,
+        "processes": processes,
+        "games": num_games,
+        "bytes": num_bytes,
+        "seconds": seconds,
+        "games_per_sec": num_games / seconds,
+        "mb_per_sec": num_bytes / seconds / 1e6,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        # How far the case raised the peak above where it stood after imports.
+        "peak_rss_delta_mb": _peak_rss_mb(resource.RUSAGE_SELF) - start_peak_rss_mb,
+        "worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def case_key(result: Dict[str, Any]) -> tuple:
+    return (result["benchmark"], result["fast_parse"], result["processes"])
+
+
+def environment_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=pathlib.Path(__file__).parent,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_to_baseline(
+    results: List[Dict[str, Any]], baseline_path: pathlib.Path, max_slowdown: float
+) -> bool:
+    """Print the change in games/sec of every case. Returns whether all passed."""
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in map(json.loads, f) if "benchmark" in r}
+    passed = True
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        ratio = result["games_per_sec"] / old["games_per_sec"]
+        regressed = ratio < 1 - max_slowdown
+        passed = passed and not regressed
+        print(
+            f"{'REGRESSION ' if regressed else ''}{case_key(result)}: "
+            f"{old['games_per_sec']:.1f} -> {result['games_per_sec']:.1f} games/sec "
+            f"({ratio:.2f}x), peak RSS increase "
+            f"{old.get('peak_rss_delta_mb', float('nan')):.0f} -> "
+            f"{result['peak_rss_delta_mb']:.0f} MB",
+            file=sys.stderr,
+        )
+    return passed
+
+
+def default_processes() -> List[int]:
+    """1, 2, 4, ... up to the number of CPUs."""
+    processes = [1]
+    while processes[-1] * 2 <= (os.cpu_count() or 1):
+        processes.append(processes[-1] * 2)
+    return processes
+
+
+def main(args: argparse.Namespace, corpus_dir: pathlib.Path) -> Optional[bool]:
+    if args.roots:
+        paths = [
+            path
+            for root in args.roots
+            for path in game_info.find_sgf_files(pathlib.Path(root))
+        ]
+        corpus = {"roots": args.roots}
+    else:
+        corpus = synthetic_corpus.corpus_kwargs(args)
+        paths = synthetic_corpus.generate_corpus(corpus_dir, **corpus)
+    num_bytes = sum(os.path.getsize(path) for path in paths)
+    print(
+        f"Benchmarking on {len(paths)} files ({num_bytes / 1e6:.1f} MB)",
+        file=sys.stderr,
+    )
+
+    cases = [
+        (name, fast_parse, 1)
+        for name in ("parse_game_str_to_dict", "read_and_parse_file")
+        for fast_parse in args.fast_parse
+    ] + [
+        ("read_and_parse_all_files", fast_parse, processes)
+        for fast_parse in args.fast_parse
+        for processes in args.processes or default_processes()
+    ]
+    common = {"corpus": corpus, "repeats": args.repeats, **environment_info()}
+    results = []
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for name, fast_parse, processes in cases:
+            # A fresh process per case, so that peak RSS is per case.
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = executor.submit(
+                    run_case, name, paths, fast_parse, processes, args.repeats
+                ).result()
+            results.append(result)
+            print(
+                f"{name:>24} fast_parse={fast_parse!s:5} processes={processes:3}: "
+                f"{result['games_per_sec']:10.1f} games/sec "
+                f"{result['mb_per_sec']:7.1f} MB/sec "
+                f"peak RSS {result['peak_rss_mb']:7.1f} MB "
+                f"(+{result['peak_rss_delta_mb']:.1f} MB over the case)",
+                file=sys.stderr,
+            )
+            output.write(json.dumps({**result, **common}) + "\n")
+            output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+    if args.baseline:
+        return compare_to_baseline(results, args.baseline, args.max_slowdown)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks sgf parsing throughput and peak memory.",
+    )
+    parser.add_argument(
+        "--roots",
+        nargs="*",
+        help="benchmark on the sgfs in these directories instead of a synthetic "
+        "corpus",
+    )
+    parser.add_argument(
+        "--corpus_dir",
+        help="where to write the synthetic corpus (default: a temporary directory)",
+    )
+    synthetic_corpus.add_corpus_arguments(parser)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        help="process counts for read_and_parse_all_files (default: 1, 2, 4, ... "
+        "up to the number of CPUs)",
+    )
+    parser.add_argument(
+        "--fast_parse",
+        type=lambda s: s.lower() in ("1", "true", "yes"),
+        nargs="+",
+        default=[False, True],
+    )
+    parser.add_argument(
+        "--repeats", type=int, help="report the best of this many runs", default=3
+    )
+    parser.add_argument(
+        "--output", help="file to write JSON lines results to (default: stdout)"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        help="results of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--max_slowdown",
+        type=float,
+        help="fraction by which games/sec may drop before a case counts as a "
+        "regression",
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    if args.corpus_dir:
+        passed = main(args, pathlib.Path(args.corpus_dir))
+    else:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            passed = main(args, pathlib.Path(corpus_dir))
+    if passed is False:
+        sys.exit(1)
@@ -0,0 +1,82 @@
+"""Benchmarks computing path-derived fields once per file instead of per game.
+
+For every `.sgfs` file with at least `--min_lines` lines, times
+`parse_game_str_to_dict` on all of its games, once recomputing `PathInfo` from
+the path for every game (as the parser used to) and once passing in a
+`PathInfo` computed once for the file (as `read_and_parse_file` now does).
+
+Run:
+- `python benchmarks/path_info_benchmark.py /path/to/victimplay/run`, from the
+  go_attack_utils directory.
+"""
+
+import argparse
+import pathlib
+import time
+
+from sgf_parser import game_info
+
+
+def load_large_files(roots, min_lines):
+    files = []
+    for root in roots:
+        for path in game_info.find_sgf_files(pathlib.Path(root)):
+            with open(path, "rb") as f:
+                lines = [line.strip() for line in f]
+            if len(lines) >= min_lines:
+                files.append((str(path), lines))
+    return files
+
+
+def time_parse(files, per_file_path_info):
+    start = time.perf_counter()
+    for path, lines in files:
+        path_info = game_info.parse_path_info(path) if per_file_path_info else None
+        for i, line in enumerate(lines):
+            game_info.parse_game_str_to_dict(
+                path,
+                i + 1,
+                line,
+                fast_parse=True,
+                no_victim_okay=True,
+                path_info=path_info,
+            )
+    return time.perf_counter() - start
+
+
+def report(name, num_games, seconds):
+    print(f"{name:>24}: {num_games / seconds:12.1f} games/sec ({seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks per-game vs per-file path metadata extraction.",
+    )
+    parser.add_argument("roots", nargs="+", help="directories containing sgfs")
+    parser.add_argument(
+        "--min_lines",
+        type=int,
+        help="only use files with at least this many games",
+        default=10000,
+    )
+    parser.add_argument(
+        "--repeats", type=int, help="report the best of this many runs", default=3
+    )
+    args = parser.parse_args()
+
+    files = load_large_files(args.roots, args.min_lines)
+    num_games = sum(len(lines) for _, lines in files)
+    print(f"Loaded {len(files)} files with {num_games} games")
+    if not files:
+        raise SystemExit(f"No files with at least {args.min_lines} games")
+
+    # Fill the player name caches so that both runs only differ in path work.
+    time_parse(files, per_file_path_info=True)
+    for name, per_file_path_info in [
+        ("path info per game", False),
+        ("path info per file", True),
+    ]:
+        seconds = min(
+            time_parse(files, per_file_path_info) for _ in range(args.repeats)
+        )
+        report(name, num_games, seconds)
@@ -0,0 +1,92 @@
+"""Benchmarks the fixed per-request cost of starting a worker pool.
+
+Simulates parsing server requests for a small directory: every request parses
+the same few synthetic files (see `synthetic_corpus`) into an empty cache
+directory with `read_and_parse_all_files_cached`, so that each one has to
+dispatch work to the workers. Requests are timed once starting a new
+`multiprocessing.Pool` per request (as the parsing server used to) and once
+reusing a single warm pool from `parse_cache.new_worker_pool` (as it does now).
+
+Run:
+- `python benchmarks/pool_overhead_benchmark.py`, from the go_attack_utils
+  directory.
+"""
+
+import argparse
+import contextlib
+import pathlib
+import statistics
+import tempfile
+import time
+
+import synthetic_corpus
+
+from sgf_parser import parse_cache
+
+
+def time_requests(paths, processes, num_requests, pool=None):
+    seconds = []
+    for _ in range(num_requests):
+        with tempfile.TemporaryDirectory() as cache_dir, contextlib.redirect_stdout(
+            None
+        ):
+            start = time.perf_counter()
+            parse_cache.read_and_parse_all_files_cached(
+                paths,
+                processes=processes,
+                no_victim_okay=True,
+                cache_dir=pathlib.Path(cache_dir),
+                pool=pool,
+            )
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def report(name, seconds):
+    print(
+        f"{name:>28}: median {statistics.median(seconds) * 1000:8.1f} ms "
+        f"min {min(seconds) * 1000:8.1f} ms per request"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks per-request pool startup vs a long-lived pool.",
+    )
+    parser.add_argument("--processes", type=int, default=32)
+    parser.add_argument("--num_requests", type=int, default=10)
+    parser.add_argument("--num_files", type=int, default=4)
+    parser.add_argument("--games_per_file", type=int, default=50)
+    parser.add_argument(
+        "--start_method",
+        help="start method of the long-lived pool",
+        default="forkserver",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        paths = synthetic_corpus.generate_corpus(
+            pathlib.Path(corpus_dir),
+            num_files=args.num_files,
+            games_per_file=args.games_per_file,
+        )
+        print(
+            f"{args.num_requests} requests for {len(paths)} files "
+            f"({args.num_files * args.games_per_file} games), "
+            f"{args.processes} processes"
+        )
+        report(
+            "new pool per request",
+            time_requests(paths, args.processes, args.num_requests),
+        )
+        start = time.perf_counter()
+        with parse_cache.new_worker_pool(
+            args.processes, start_method=args.start_method
+        ) as pool:
+            # Make sure every worker has started before timing requests.
+            pool.map(abs, range(args.processes))
+            print(f"Started long-lived pool in {time.perf_counter() - start:.2f}s")
+            report(
+                f"long-lived {args.start_method} pool",
+                time_requests(paths, args.processes, args.num_requests, pool=pool),
+            )
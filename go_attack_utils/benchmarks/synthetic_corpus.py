@@ -0,0 +1,185 @@
+"""Generates synthetic victimplay-like `.sgfs` files for benchmarking the parser.
+
+Games look like the ones KataGo writes during victimplay: one game per line, a
+root node with players, ranks, rules, result and a `startTurnIdx=...` comment,
+then moves (ending in passes), most of them followed by a search-info comment.
+Everything is drawn from a seeded random generator, so the same arguments always
+produce the same files.
+
+Run:
+- `python benchmarks/synthetic_corpus.py /tmp/sgf_corpus --num_files 8`, from
+  the go_attack_utils directory.
+"""
+
+import argparse
+import pathlib
+import random
+from typing import List, Sequence
+
+DEFAULT_BOARD_SIZES = (19,)
+DEFAULT_ADVERSARY_NAMES = (
+    "adv-s545065216-d136760487-v600",
+    "t0-s108263680-d27265989",
+    "cyclic-adv-s545m",
+)
+DEFAULT_VICTIM_NAMES = ("bot-cp505-v1", "bot-cp127-v1", "victim-s1m.bin.gz")
+DEFAULT_RULES = (
+    "koPOSITIONALscoreAREAtaxNONEsui1",
+    "koSITUATIONALscoreAREAtaxNONEsui1whb0",
+    "koPOSITIONALscoreAREAtaxALLsui1whbN-1fpok",
+    "koSIMPLEscoreTERRITORYtaxSEKIsui0button1",
+)
+GTYPES = ("normal", "handicap", "cleanup")
+
+
+def _coordinate(rng: random.Random, board_size: int) -> str:
+    return "".join(chr(ord("a") + rng.randrange(board_size)) for _ in range(2))
+
+
+def _search_comment(rng: random.Random) -> str:
+    winrate = rng.random()
+    return (
+        f"C[{winrate:.2f} {1 - winrate:.2f} 0.00 {rng.uniform(-30, 30):.1f} "
+        f"v={rng.choice((1, 600, 2048))} weight={rng.choice((0.75, 1))}]"
+    )
+
+
+def generate_game(
+    rng: random.Random,
+    board_sizes: Sequence[int] = DEFAULT_BOARD_SIZES,
+    comment_density: float = 0.9,
+    adversary_names: Sequence[str] = DEFAULT_ADVERSARY_NAMES,
+    victim_names: Sequence[str] = DEFAULT_VICTIM_NAMES,
+    rules: Sequence[str] = DEFAULT_RULES,
+    min_moves: int = 50,
+    max_moves: int = 400,
+) -> str:
+    """One synthetic game on a single line, without a trailing newline.
+
+    Args:
+        rng: Source of randomness.
+        board_sizes: Board sizes to choose from.
+        comment_density: Probability that a move is followed by a comment.
+        adversary_names: Adversary names to choose from.
+        victim_names: Victim names to choose from.
+        rules: KataGo rules strings (the RU property) to choose from.
+        min_moves: Minimum number of moves, including the final passes.
+        max_moves: Maximum number of moves, including the final passes.
+    """
+    board_size = rng.choice(board_sizes)
+    adversary = rng.choice(adversary_names)
+    victim = rng.choice(victim_names)
+    adv_is_black = rng.random() < 0.5
+    b_name, w_name = (adversary, victim) if adv_is_black else (victim, adversary)
+    winner = rng.choice("BW")
+    result = f"{winner}+R" if rng.random() < 0.3 else f"{winner}+{rng.randrange(60)}.5"
+    root = (
+        f"(;FF[4]GM[1]SZ[{board_size}]PB[{b_name}]PW[{w_name}]"
+        f"HA[{rng.choice((0, 0, 0, 2))}]KM[{rng.choice((6.5, 7, -3.5))}]"
+        f"RU[{rng.choice(rules)}]RE[{result}]"
+        f"BR[v{rng.randrange(1, 4096)}]WR[v=600, rsym=8, algo=MCTS]"
+        f"C[startTurnIdx={rng.randrange(5)},initTurnNum={rng.randrange(5)},"
+        f"usedInitialPosition={rng.randrange(2)},gameHash=AB,"
+        f"gtype={rng.choice(GTYPES)}]"
+    )
+    num_moves = rng.randint(min_moves, max_moves)
+    num_trailing_passes = min(num_moves, rng.choice((0, 1, 2, 2, 2)))
+    moves = []
+    for i in range(num_moves):
+        color = "BW"[i % 2]
+        is_pass = i >= num_moves - num_trailing_passes or rng.random() < 0.01
+        point = "" if is_pass else _coordinate(rng, board_size)
+        comment = _search_comment(rng) if rng.random() < comment_density else ""
+        moves.append(f";{color}[{point}]{comment}")
+    return root + "".join(moves) + ")"
+
+
+def generate_corpus(
+    root: pathlib.Path,
+    num_files: int = 4,
+    games_per_file: int = 2000,
+    seed: int = 0,
+    **kwargs,
+) -> List[pathlib.Path]:
+    """Write `num_files` files of synthetic games under `root`.
+
+    Files are laid out like a victimplay run
+    (`root/selfplay/<model>/sgfs/<n>.sgfs`), so that path-derived fields are
+    exercised too. Existing files with the same names are overwritten.
+
+    Args:
+        root: Directory to write to.
+        num_files: Number of `.sgfs` files.
+        games_per_file: Number of games in each file.
+        seed: Seed for the random generator.
+        kwargs: See `generate_game`.
+
+    Returns:
+        Paths of the files written.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(num_files):
+        sgf_dir = root / "selfplay" / f"t0-s{(i + 1) * 1000000}-d{i * 250000}" / "sgfs"
+        sgf_dir.mkdir(parents=True, exist_ok=True)
+        path = sgf_dir / f"{i:04d}.sgfs"
+        with open(path, "w") as f:
+            for _ in range(games_per_file):
+                f.write(generate_game(rng, **kwargs) + "\n")
+        paths.append(path)
+    return paths
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of `generate_corpus` to `parser`."""
+    parser.add_argument("--num_files", type=int, default=4)
+    parser.add_argument("--games_per_file", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--board_sizes", type=int, nargs="+", default=list(DEFAULT_BOARD_SIZES)
+    )
+    parser.add_argument(
+        "--comment_density",
+        type=float,
+        help="probability that a move has a search-info comment",
+        default=0.9,
+    )
+    parser.add_argument(
+        "--adversary_names", nargs="+", default=list(DEFAULT_ADVERSARY_NAMES)
+    )
+    parser.add_argument("--victim_names", nargs="+", default=list(DEFAULT_VICTIM_NAMES))
+    parser.add_argument("--rules", nargs="+", default=list(DEFAULT_RULES))
+    parser.add_argument("--min_moves", type=int, default=50)
+    parser.add_argument("--max_moves", type=int, default=400)
+
+
+def corpus_kwargs(args: argparse.Namespace) -> dict:
+    """The arguments added by `add_corpus_arguments`, for `generate_corpus`."""
+    return {
+        name: getattr(args, name)
+        for name in (
+            "num_files",
+            "games_per_file",
+            "seed",
+            "board_sizes",
+            "comment_density",
+            "adversary_names",
+            "victim_names",
+            "rules",
+            "min_moves",
+            "max_moves",
+        )
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Writes synthetic victimplay-like sgfs for benchmarking.",
+    )
+    parser.add_argument("root", help="directory to write the files to")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    paths = generate_corpus(pathlib.Path(args.root), **corpus_kwargs(args))
+    num_bytes = sum(path.stat().st_size for path in paths)
+    print(f"Wrote {len(paths)} files ({num_bytes / 1e6:.1f} MB) to {args.root}")
@@ -1,50 +1,56 @@
 import re
 import glob
+import pathlib
 import numpy as np
 import random
 import json
 
-random.seed(42)
+from sgf_parser import sampling
+
+rng = random.Random(42)
 
 adv_pattern = re.compile("adv-s[0-9]+")
 victim_list = ["cp39h-v1", "cp127h-v1", "cp505h-v1", "cp505h-v2048"]
+games_per_stratum = 5
+
+
+def player_names(game):
+    return f"{game.header['b_name']} {game.header['w_name']}"
 
 
-def get_victim(input_text_line):
+def get_adv_steps(game):
+    adv = adv_pattern.search(player_names(game))
+    return int(adv.group(0).split("s")[1])
+
+
+def get_victim(game):
+    names = player_names(game)
     for victim in victim_list:  # go through possible victims
-        if victim in input_text_line:
+        if victim in names:
             return victim
 
     # if none found, something is wrong
     raise Exception("Victim not identified")
 
 
-all_files = glob.glob(
-    "/nas/ucb/k8/go-attack/match/ttseng-hard-adv-checkpoint-sweep-497mil-221115/ttseng-hard-match-*/sgfs/*.sgfs"
+all_files = sorted(
+    map(
+        pathlib.Path,
+        glob.glob(
+            "/nas/ucb/k8/go-attack/match/ttseng-hard-adv-checkpoint-sweep-497mil-221115/ttseng-hard-match-*/sgfs/*.sgfs"
+        ),
+    )
 )
 
-results_dict = (
-    {}
-)  # structure will be {adv_train_steps : {victim : [(filename0, linenum0), (filename1, linenum1), ...]}}
-for filename in all_files:
-    with open(filename, "r") as f:
-        for line_num, line in enumerate(f.readlines()):
-            adv = adv_pattern.search(line)
-            num_steps = int(adv.group(0).split("s")[1])
-            victim = get_victim(line)
-            if num_steps in results_dict:
-                if victim in results_dict[num_steps]:
-                    results_dict[num_steps][victim].append(
-                        {"path": filename, "line": line_num + 1}
-                    )
-                else:
-                    results_dict[num_steps][victim] = [
-                        {"path": filename, "line": line_num + 1}
-                    ]
-            else:
-                results_dict[num_steps] = {
-                    victim: [{"path": filename, "line": line_num + 1}]
-                }
+# Only the root node of each game is read, and only the sampled games are kept.
+# structure will be {(adv_train_steps, victim) : [IndexedGame, ...]}
+results_dict = sampling.stratified_sample(
+    sampling.iter_index(all_files, fields=["b_name", "w_name"]),
+    by=lambda game: (get_adv_steps(game), get_victim(game)),
+    k=games_per_stratum,
+    rng=rng,
+)
+adv_train_steps = sorted({steps for steps, _ in results_dict})
 
 
 # we will use this to find the nearest match (for which games are available) to the exact decile of training steps
@@ -55,15 +61,15 @@ def find_nearest(array, value):
 
 
 last_step = np.max(
-    list(results_dict.keys())
+    adv_train_steps
 )  # last training step for adversary, i.e. "strongest" one
 
 
 for decile in range(1, 11):
     decile_steps = decile * last_step / 10
-    nearest_match = find_nearest(list(results_dict.keys()), decile_steps)
+    nearest_match = find_nearest(adv_train_steps, decile_steps)
     for victim in victim_list:
-        assert victim in results_dict[nearest_match]
+        assert (nearest_match, victim) in results_dict
 
         victim_name = victim.split("-v")[0]
         if victim_name == "cp505" or victim_name == "cp505h":
@@ -79,7 +85,13 @@ for decile in range(1, 11):
         else:
             victim_visits = f", {victim_visits} visits"
 
-        sample_games = random.sample(results_dict[nearest_match][victim], 5)
+        stratum_games = results_dict[(nearest_match, victim)]
+        if len(stratum_games) < games_per_stratum:
+            raise ValueError(
+                f"Only {len(stratum_games)} games of adv-s{nearest_match} vs. "
+                f"{victim}, fewer than {games_per_stratum}"
+            )
+        sample_games = [game.link_info() for game in stratum_games]
 
         rounded_steps = str(nearest_match)[
             :-6
@@ -92,7 +104,7 @@ for decile in range(1, 11):
         output_dict["server"] = "dqn.ist.berkeley.edu"
         output_dict["path_comment"] = "Sampled using sample_training_games.py"
         output_dict["paths_with_line_num"] = sample_games
-        output_dict["max_games"] = 5
+        output_dict["max_games"] = games_per_stratum
         output_dict["adversary"] = f"{rounded_steps} million training steps, 600 visits"
         output_dict["victim"] = victim_name + victim_visits
         output_dict["description"] = []
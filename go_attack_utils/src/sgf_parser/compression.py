@@ -0,0 +1,367 @@
+"""Reads compressed SGF files (`.sgfs.gz`, `.sgfs.zst`, `.sgfs.xz`).
+
+Byte offsets into a compressed file (line offsets, parse chunk boundaries,
+resume points) always refer to the decompressed contents.
+
+A compressed file is treated as a list of independently decompressible blocks,
+so that a range of games can be read without decompressing everything before
+it, and so that different parts of a file can be parsed by different worker
+processes. Blocks are found without decompressing anything in:
+- zstd files in the seekable format (one frame per block, listed in a seek
+  table at the end of the file), as written by `write_seekable` or by
+  `zstd --seekable`-style tools.
+- gzip files with a `.gzi` index next to them (as written by `write_seekable`
+  or `bgzip -i`), or in the BGZF format (as written by `bgzip`).
+Any other compressed file is a single block: it can still be parsed, but only
+as a whole, and looking up a single game means decompressing the file up to it.
+`write_seekable` recompresses such files into a randomly accessible form.
+
+zstd support requires the `zstandard` package.
+"""
+
+import functools
+import gzip
+import io
+import lzma
+import os
+import pathlib
+import struct
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, TextIO, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_SUFFIX = ".gz"
+ZSTD_SUFFIX = ".zst"
+XZ_SUFFIX = ".xz"
+COMPRESSED_SUFFIXES = (GZIP_SUFFIX, ZSTD_SUFFIX, XZ_SUFFIX)
+GZIP_INDEX_SUFFIX = ".gzi"
+# Uncompressed size of the blocks written by `write_seekable`.
+DEFAULT_BLOCK_BYTES = 2**20
+# Bytes decompressed at a time when reading a range of a file without blocks.
+STREAM_READ_BYTES = 2**20
+BLOCK_INDEX_CACHE_SIZE = 1024
+
+_ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+_ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+_ZSTD_SEEKABLE_FOOTER_SIZE = 9
+_GZIP_HEADER_SIZE = 10
+_FEXTRA = 4
+_BGZF_SUBFIELD_ID = b"BC"
+
+PathLike = Union[str, pathlib.Path]
+
+
+class Block(NamedTuple):
+    """An independently decompressible part of a compressed file."""
+
+    compressed_offset: int
+    compressed_size: int
+    # Offset and size of the block's contents once decompressed. `size` is None
+    # if unknown, which only happens when the whole file is a single block.
+    offset: int
+    size: Optional[int]
+
+
+def is_compressed(path: PathLike) -> bool:
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError("Reading .zst files requires the zstandard package")
+
+
+def _blocks_from_sizes(sizes: List[Tuple[int, int]]) -> List[Block]:
+    """Blocks from (compressed_size, size) pairs of consecutive blocks."""
+    blocks = []
+    compressed_offset = offset = 0
+    for compressed_size, size in sizes:
+        blocks.append(Block(compressed_offset, compressed_size, offset, size))
+        compressed_offset += compressed_size
+        offset += size
+    return blocks
+
+
+def _zstd_seek_table(f: BinaryIO, file_size: int) -> Optional[List[Block]]:
+    """Blocks listed in the seek table of a seekable zstd file, if it has one."""
+    if file_size < _ZSTD_SEEKABLE_FOOTER_SIZE:
+        return None
+    f.seek(file_size - _ZSTD_SEEKABLE_FOOTER_SIZE)
+    num_frames, descriptor, magic = struct.unpack("<IBI", f.read(9))
+    if magic != _ZSTD_SEEKABLE_MAGIC:
+        return None
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = num_frames * entry_size + _ZSTD_SEEKABLE_FOOTER_SIZE
+    f.seek(file_size - table_size)
+    table = f.read(num_frames * entry_size)
+    return _blocks_from_sizes(
+        [struct.unpack_from("<II", table, i * entry_size) for i in range(num_frames)]
+    )
+
+
+def _gzip_index(path: PathLike, file_size: int) -> Optional[List[Block]]:
+    """Blocks listed in the `.gzi` index next to `path`, if there is one.
+
+    The index holds the number of blocks after the first, then the compressed
+    and decompressed offset of each of them, all as little-endian uint64.
+    """
+    index_path = str(path) + GZIP_INDEX_SUFFIX
+    try:
+        if os.path.getmtime(index_path) < os.path.getmtime(path):
+            return None
+        with open(index_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    (num_entries,) = struct.unpack_from("<Q", data)
+    starts = [(0, 0)] + [
+        struct.unpack_from("<QQ", data, 8 + 16 * i) for i in range(num_entries)
+    ]
+    with open(path, "rb") as f:
+        # The ISIZE field of the last gzip member is its decompressed size.
+        f.seek(file_size - 4)
+        (last_size,) = struct.unpack("<I", f.read(4))
+    ends = starts[1:] + [(file_size, starts[-1][1] + last_size)]
+    return [
+        Block(
+            compressed_offset,
+            next_compressed_offset - compressed_offset,
+            offset,
+            next_offset - offset,
+        )
+        for (compressed_offset, offset), (next_compressed_offset, next_offset) in zip(
+            starts, ends
+        )
+    ]
+
+
+def _bgzf_blocks(f: BinaryIO, file_size: int) -> Optional[List[Block]]:
+    """Blocks of a BGZF file, found by walking the sizes in the member headers.
+
+    Returns None if the file isn't BGZF.
+    """
+    sizes = []
+    pos = 0
+    while pos < file_size:
+        f.seek(pos)
+        header = f.read(_GZIP_HEADER_SIZE + 2)
+        if len(header) < _GZIP_HEADER_SIZE + 2 or not header[3] & _FEXTRA:
+            return None
+        (extra_length,) = struct.unpack_from("<H", header, _GZIP_HEADER_SIZE)
+        extra = f.read(extra_length)
+        compressed_size = None
+        i = 0
+        while i + 4 <= len(extra):
+            subfield_id, subfield_length = struct.unpack_from("<2sH", extra, i)
+            if subfield_id == _BGZF_SUBFIELD_ID and subfield_length == 2:
+                compressed_size = struct.unpack_from("<H", extra, i + 4)[0] + 1
+            i += 4 + subfield_length
+        if compressed_size is None:
+            return None
+        f.seek(pos + compressed_size - 4)
+        (size,) = struct.unpack("<I", f.read(4))
+        sizes.append((compressed_size, size))
+        pos += compressed_size
+    return _blocks_from_sizes(sizes)
+
+
+@functools.lru_cache(maxsize=BLOCK_INDEX_CACHE_SIZE)
+def _cached_block_index(path: str, file_size: int, mtime_ns: int) -> List[Block]:
+    if file_size == 0:
+        return []
+    with open(path, "rb") as f:
+        blocks = None
+        if path.endswith(ZSTD_SUFFIX):
+            blocks = _zstd_seek_table(f, file_size)
+        elif path.endswith(GZIP_SUFFIX):
+            blocks = _gzip_index(path, file_size) or _bgzf_blocks(f, file_size)
+    if blocks is None:
+        blocks = [Block(0, file_size, 0, None)]
+    # Drop empty blocks, such as the end-of-file marker of BGZF.
+    return [block for block in blocks if block.size != 0]
+
+
+def block_index(path: PathLike) -> List[Block]:
+    """The independently decompressible blocks of a compressed file, in order."""
+    stat = os.stat(path)
+    return _cached_block_index(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def decompressed_size(path: PathLike) -> Optional[int]:
+    """Size of the contents of a compressed file, or None if not known cheaply."""
+    blocks = block_index(path)
+    if not blocks:
+        return 0
+    if blocks[-1].size is None:
+        return None
+    return blocks[-1].offset + blocks[-1].size
+
+
+def _decompress(path: str, data: bytes, size: Optional[int]) -> bytes:
+    """Decompress one block, or a whole file if `size` is None."""
+    if path.endswith(GZIP_SUFFIX):
+        return gzip.decompress(data)
+    if path.endswith(XZ_SUFFIX):
+        return lzma.decompress(data)
+    _require_zstandard()
+    if size is None:
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True
+        )
+        return reader.read()
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+
+
+def _read_stream_range(
+    path: PathLike, start_offset: int, stop_offset: Optional[int]
+) -> bytes:
+    """`read_range` for a file that is a single block: decompress it as a stream,
+    dropping what comes before `start_offset` and stopping once the lines
+    starting before `stop_offset` are complete."""
+    with open_binary(path) as f:
+        skipped = 0
+        while skipped < start_offset:
+            skip = len(f.read(min(STREAM_READ_BYTES, start_offset - skipped)))
+            if not skip:
+                return b""
+            skipped += skip
+        if stop_offset is None:
+            return f.read()
+        data = bytearray()
+        last_needed = max(stop_offset - 1 - start_offset, 0)
+        while True:
+            chunk = f.read(STREAM_READ_BYTES)
+            if not chunk:
+                break
+            search_from = max(last_needed, len(data))
+            data += chunk
+            if data.find(b"\n", search_from) >= 0:
+                break
+        return bytes(data)
+
+
+def read_range(
+    path: PathLike, start_offset: int = 0, stop_offset: Optional[int] = None
+) -> Tuple[bytes, int]:
+    """Decompress the blocks of `path` needed to read the lines in a range.
+
+    Files without a block index are decompressed as a stream from the start, but
+    only the part holding the range is kept.
+
+    Args:
+        path: A compressed file.
+        start_offset: Offset in the decompressed contents to read from.
+        stop_offset: If set, lines starting at or after this offset are not
+            needed. Lines starting before it are always read in full.
+
+    Returns:
+        Decompressed contents starting at some offset at or before
+        `start_offset`, and that offset.
+    """
+    path = str(path)
+    blocks = block_index(path)
+    if len(blocks) == 1 and blocks[0].size is None:
+        return _read_stream_range(path, start_offset, stop_offset), start_offset
+    first = 0
+    while (
+        first + 1 < len(blocks)
+        and blocks[first].size is not None
+        and blocks[first + 1].offset <= start_offset
+    ):
+        first += 1
+    data = bytearray()
+    with open(path, "rb") as f:
+        for block in blocks[first:]:
+            f.seek(block.compressed_offset)
+            data += _decompress(path, f.read(block.compressed_size), block.size)
+            if stop_offset is None:
+                continue
+            # Stop once the line starting at `stop_offset - 1` (if any) is
+            # complete.
+            last_needed = max(stop_offset - 1 - blocks[first].offset, 0)
+            if len(data) > last_needed and data.find(b"\n", last_needed) >= 0:
+                break
+    return bytes(data), blocks[first].offset if blocks else 0
+
+
+def open_binary(path: PathLike) -> BinaryIO:
+    """Open a compressed file for reading, decompressing as it's read."""
+    if str(path).endswith(GZIP_SUFFIX):
+        return gzip.open(path, "rb")
+    if str(path).endswith(XZ_SUFFIX):
+        return lzma.open(path, "rb")
+    _require_zstandard()
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        open(path, "rb"), read_across_frames=True, closefd=True
+    )
+    return io.BufferedReader(reader)
+
+
+def open_text(path: PathLike) -> TextIO:
+    """Like `open_binary`, but decodes the contents as UTF-8."""
+    return io.TextIOWrapper(open_binary(path), encoding="utf-8")
+
+
+def _iter_line_aligned_blocks(f: BinaryIO, block_bytes: int) -> Iterator[bytes]:
+    """Read `f` in pieces of about `block_bytes` that end at a newline."""
+    pending = b""
+    while True:
+        data = f.read(block_bytes)
+        if not data:
+            break
+        pending += data
+        end = pending.rfind(b"\n") + 1
+        if end:
+            yield pending[:end]
+            pending = pending[end:]
+    if pending:
+        yield pending
+
+
+def write_seekable(
+    src: PathLike, dest: PathLike, block_bytes: int = DEFAULT_BLOCK_BYTES
+) -> None:
+    """Compress `src` to `dest` so that games can be read back at random.
+
+    The format is chosen by the suffix of `dest`: `.zst` writes a seekable zstd
+    file, and `.gz` writes a multi-member gzip file plus a `.gzi` index next to
+    it. Either way, `dest` can still be decompressed by the standard tools.
+    Blocks end at line boundaries, so no game is split between blocks.
+
+    Args:
+        src: Uncompressed (or compressed) sgf file to read.
+        dest: File to write.
+        block_bytes: Approximate uncompressed size of each block.
+    """
+    dest = str(dest)
+    if not dest.endswith((GZIP_SUFFIX, ZSTD_SUFFIX)):
+        raise ValueError(f"Can only write seekable .gz or .zst files, not {dest}")
+    if dest.endswith(ZSTD_SUFFIX):
+        _require_zstandard()
+        compressor = zstandard.ZstdCompressor()
+    sizes = []
+    src_file = open_binary(src) if is_compressed(src) else open(src, "rb")
+    with src_file, open(dest, "wb") as out:
+        for data in _iter_line_aligned_blocks(src_file, block_bytes):
+            if dest.endswith(ZSTD_SUFFIX):
+                compressed = compressor.compress(data)
+            else:
+                compressed = gzip.compress(data, mtime=0)
+            out.write(compressed)
+            sizes.append((len(compressed), len(data)))
+        if dest.endswith(ZSTD_SUFFIX):
+            entries = b"".join(struct.pack("<II", *size) for size in sizes)
+            footer = struct.pack("<IBI", len(sizes), 0, _ZSTD_SEEKABLE_MAGIC)
+            out.write(
+                struct.pack("<II", _ZSTD_SKIPPABLE_MAGIC, len(entries) + len(footer))
+            )
+            out.write(entries + footer)
+    if dest.endswith(GZIP_SUFFIX):
+        blocks = _blocks_from_sizes(sizes)[1:]
+        with open(dest + GZIP_INDEX_SUFFIX, "wb") as f:
+            f.write(struct.pack("<Q", len(blocks)))
+            for block in blocks:
+                f.write(struct.pack("<QQ", block.compressed_offset, block.offset))
@@ -0,0 +1,176 @@
+"""Finds SGF files in large (often NFS-mounted) directory trees.
+
+Directories are listed with `os.scandir` from a thread pool, one level of the
+tree at a time, so that slow network round trips overlap. Subtrees that never
+hold games (model checkpoints, TensorBoard logs) are skipped. Compressed SGF
+files (see `compression`) are found too, except .zst files when the optional
+`zstandard` package, needed to read them, is not installed.
+
+Listings are cached in-process, keyed by each directory's mtime, link count
+and size. A directory's mtime changes whenever an entry is added, removed or
+renamed in it, so an unchanged mtime means the cached listing is still right
+and the directory does not need to be read again. Files inside it can still
+have grown, so they are always re-stat'ed.
+
+NFS mtimes can be coarse, so two changes within one tick leave the mtime
+unchanged. A listing is therefore only cached once its directory's mtime is
+`LISTING_CACHE_MIN_AGE` seconds old. A directory that was changed more
+recently than that is read again on every scan.
+"""
+
+import concurrent.futures
+import fnmatch
+import os
+import pathlib
+import threading
+import time
+import warnings
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sgf_parser import compression
+
+SGF_SUFFIXES = tuple(
+    suffix + compressed_suffix
+    for suffix in (".sgfs", ".sgf")
+    for compressed_suffix in ("",) + compression.COMPRESSED_SUFFIXES
+    if compressed_suffix != compression.ZSTD_SUFFIX or compression.zstandard is not None
+)
+# Directory names (fnmatch patterns) that are never searched.
+DEFAULT_PRUNED_DIR_PATTERNS = ("models", "*tfevents*")
+DEFAULT_MAX_WORKERS = 32
+# Listings of directories changed less than this many seconds ago aren't cached.
+LISTING_CACHE_MIN_AGE = 5.0
+
+
+class SgfFile(NamedTuple):
+    """An SGF file found by `scan_sgf_files`, with its size and mtime."""
+
+    path: pathlib.Path
+    size: int
+    mtime_ns: int
+
+
+class _Listing(NamedTuple):
+    # (st_mtime_ns, st_nlink, st_size) of the directory when it was listed.
+    dir_state: Tuple[int, int, int]
+    subdirs: List[str]
+    sgf_names: List[str]
+
+
+# Keyed by (directory, pruned_dir_patterns).
+_listing_cache: Dict[Tuple[str, Tuple[str, ...]], _Listing] = {}
+_listing_cache_lock = threading.Lock()
+
+
+def clear_listing_cache() -> None:
+    """Forget all cached directory listings."""
+    with _listing_cache_lock:
+        _listing_cache.clear()
+
+
+def _is_pruned(name: str, pruned_dir_patterns: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in pruned_dir_patterns)
+
+
+def _list_dir(directory: str, pruned_dir_patterns: Sequence[str]) -> _Listing:
+    """List the subdirectories and SGF files of `directory`.
+
+    Like `os.walk`, symlinks to directories are not followed, and directories
+    that can't be read are treated as empty.
+    """
+    try:
+        stat = os.stat(directory)
+    except OSError:
+        return _Listing((0, 0, 0), [], [])
+    dir_state = (stat.st_mtime_ns, stat.st_nlink, stat.st_size)
+    cache_key = (directory, tuple(pruned_dir_patterns))
+    with _listing_cache_lock:
+        cached = _listing_cache.get(cache_key)
+    if cached is not None and cached.dir_state == dir_state:
+        return cached
+
+    subdirs = []
+    sgf_names = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not _is_pruned(entry.name, pruned_dir_patterns):
+                            subdirs.append(entry.name)
+                    elif entry.name.endswith(SGF_SUFFIXES):
+                        sgf_names.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        return _Listing(dir_state, [], [])
+    listing = _Listing(dir_state, subdirs, sgf_names)
+    # The mtime may not have ticked yet for changes made right after it.
+    if time.time_ns() - stat.st_mtime_ns >= LISTING_CACHE_MIN_AGE * 1e9:
+        with _listing_cache_lock:
+            _listing_cache[cache_key] = listing
+    return listing
+
+
+def _scan_dir(
+    directory: str, pruned_dir_patterns: Sequence[str]
+) -> Tuple[List[str], List[SgfFile]]:
+    """Returns the subdirectories to search and the SGF files in `directory`."""
+    listing = _list_dir(directory, pruned_dir_patterns)
+    sgf_files = []
+    for name in listing.sgf_names:
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Deleted since the directory was listed.
+            continue
+        sgf_files.append(SgfFile(pathlib.Path(path), stat.st_size, stat.st_mtime_ns))
+    return [os.path.join(directory, name) for name in listing.subdirs], sgf_files
+
+
+def scan_sgf_files(
+    root: pathlib.Path,
+    pruned_dir_patterns: Sequence[str] = DEFAULT_PRUNED_DIR_PATTERNS,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    max_scan_length: Optional[int] = None,
+) -> List[SgfFile]:
+    """Finds all SGF files in `root` (recursively), with their sizes and mtimes.
+
+    Args:
+        root: The root directory to search.
+        pruned_dir_patterns: Directories whose name matches one of these fnmatch
+            patterns are not searched.
+        max_workers: Number of threads listing directories concurrently.
+        max_scan_length: If set, stop after searching this many directories.
+
+    Returns:
+        The SGF files found, sorted by path.
+    """
+    sgf_files: List[SgfFile] = []
+    level = [os.fspath(root)]
+    directories_scanned = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while level:
+            truncated = (
+                max_scan_length is not None
+                and directories_scanned + len(level) > max_scan_length
+            )
+            if truncated:
+                level = level[: max_scan_length - directories_scanned]
+            directories_scanned += len(level)
+            next_level: List[str] = []
+            for subdirs, files in executor.map(
+                lambda d: _scan_dir(d, pruned_dir_patterns), level
+            ):
+                next_level += subdirs
+                sgf_files += files
+            if truncated:
+                warnings.warn(
+                    f"Reached max_scan_length, {max_scan_length}, while "
+                    f"scanning subdirectories in {root}. SGF files already "
+                    "found will be returned."
+                )
+                break
+            level = next_level
+    return sorted(sgf_files, key=lambda f: f.path)
@@ -1,21 +1,76 @@
 """Module to extract game information from SGF files."""
 
+import contextlib
+import mmap
 import os
 import pathlib
 import re
-from typing import Any, Dict, Sequence, Union, Optional
+from typing import (
+    Any,
+    BinaryIO,
+    Collection,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+    Optional,
+)
 from itertools import chain
 import multiprocessing
-import warnings
+import multiprocessing.pool
 import functools
 
+from sgf_parser import compression, file_scan
+
 DEFAULT_ADVERSARY_SUBSTRINGS = ["adv"]
 DEFAULT_VICTIM_SUBSTRINGS = ["victim", "bot"]
+# Bump whenever the output of `parse_game_str_to_dict` changes, so that cached
+# parse results (see `parse_cache`) are invalidated.
+PARSER_VERSION = 2
+# Smallest byte range of a file that `read_and_parse_all_files` hands to a worker.
+MIN_CHUNK_BYTES = 16 * 2**20
+# Fields of `parse_game_str_to_dict` that are skipped when a caller passes
+# `columns` without any of them.
+RULE_COLUMNS = (
+    "ko_rule",
+    "score_rule",
+    "tax_rule",
+    "sui_legal",
+    "has_button",
+    "whb",
+    "fpok",
+)
+COMMENT_COLUMNS = ("start_turn_idx", "init_turn_num", "used_initial_position", "gtype")
+PASS_COLUMNS = ("num_b_pass", "num_w_pass", "num_adv_pass", "num_victim_pass")
+MOVE_STATS_COLUMNS = (
+    "num_b_moves",
+    "num_w_moves",
+    "first_pass_turn",
+    "num_trailing_passes",
+    "num_adv_moves",
+    "num_victim_moves",
+)
+
 
+def get_game_str(
+    path: pathlib.Path, line_num: int, offsets: Optional[Sequence[int]] = None
+):
+    """Return the string at a given path and line number.
 
-def get_game_str(path: pathlib.Path, line_num: int):
-    """Return the string at a given path and line number."""
-    with open(path, "r") as f:
+    If `offsets` (byte offsets of the start of each line, see `line_offsets`) is
+    given, seek straight to the line instead of reading the file up to it.
+    """
+    if offsets is not None:
+        if 1 <= line_num <= len(offsets):
+            return get_game_str_at(path, int(offsets[line_num - 1]))
+        return None
+    opener = compression.open_text if compression.is_compressed(path) else open
+    with opener(path) as f:
         for i, line in enumerate(f):
             if i + 1 == line_num:
                 return line
@@ -40,65 +95,367 @@ def get_viz_link(
 
 
 def find_sgf_files(
-    root: pathlib.Path, max_scan_length: int = 10000
+    root: pathlib.Path, max_scan_length: Optional[int] = None
 ) -> Sequence[pathlib.Path]:
     """Finds all SGF files in `root` (recursively).
 
+    See `file_scan.scan_sgf_files`, which also returns file sizes and mtimes.
+
     Args:
         root: The root directory to search.
-        max_scan_length: The maximum number of directories to search.
+        max_scan_length: If set, the maximum number of directories to search.
 
     Returns:
-        List of sgf paths.
+        List of sgf paths, sorted.
     """
-    sgf_paths = []
-    directories_scanned = 0
-    for dirpath, _, filenames in os.walk(root):
-        sgf_filenames = [
-            x for x in filenames if x.endswith(".sgfs") or x.endswith(".sgf")
-        ]
-        sgf_paths += [pathlib.Path(dirpath) / x for x in sgf_filenames]
-        directories_scanned += 1
-        if directories_scanned >= max_scan_length:
-            warnings.warn(
-                f"Reached max_scan_length, {max_scan_length}, while \
-                scanning subdirectories in {root}. SGF files already found \
-                will be returned."
-            )
-            break
-    return sgf_paths
+    return [
+        sgf_file.path
+        for sgf_file in file_scan.scan_sgf_files(root, max_scan_length=max_scan_length)
+    ]
 
 
-def read_and_parse_file(
+def _mmap_file(f: BinaryIO) -> ContextManager[Union[mmap.mmap, bytes]]:
+    """Memory-map an open file for reading (mmap can't map empty files)."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return contextlib.nullcontext(b"")
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextlib.contextmanager
+def _open_range(
+    path: pathlib.Path, start_offset: int = 0, stop_offset: Optional[int] = None
+) -> Iterator[Tuple[Union[mmap.mmap, bytes], int]]:
+    """The contents of `path` needed to read the lines in a byte range.
+
+    Plain files are memory-mapped whole. For compressed files, only the blocks
+    holding the range are decompressed (see `compression.read_range`).
+
+    Yields:
+        The contents and the offset in the file of its first byte.
+    """
+    if compression.is_compressed(path):
+        yield compression.read_range(path, start_offset, stop_offset)
+        return
+    with open(path, "rb") as f, _mmap_file(f) as buf:
+        yield buf, 0
+
+
+def iter_line_spans(
+    buf: Union[mmap.mmap, bytes],
+    start_offset: int = 0,
+    stop_offset: Optional[int] = None,
+) -> Iterator[Tuple[int, int, bool]]:
+    """Find the lines in `buf` without copying or decoding them.
+
+    Args:
+        buf: Contents of an sgf file, typically memory-mapped.
+        start_offset: Byte offset of the first line.
+        stop_offset: If set, stop at the first line starting at or after it.
+
+    Yields:
+        (start, end, is_terminated) for each line, where `buf[start:end]` is the
+        line without its newline and `is_terminated` is False only for a final
+        line that isn't followed by a newline.
+    """
+    size = len(buf)
+    if stop_offset is None or stop_offset > size:
+        stop_offset = size
+    pos = start_offset
+    while pos < stop_offset:
+        newline = buf.find(b"\n", pos)
+        if newline < 0:
+            yield pos, size, False
+            return
+        yield pos, newline, True
+        pos = newline + 1
+
+
+def line_offsets(path: pathlib.Path) -> List[int]:
+    """Byte offsets of the start of every line in `path`.
+
+    Together with `get_game_str_at` this gives random access to single games.
+    """
+    with _open_range(path) as (buf, base):
+        return [base + start for start, _, _ in iter_line_spans(buf)]
+
+
+def get_game_str_at(path: pathlib.Path, offset: int) -> str:
+    """Return the line starting at byte `offset` of `path`."""
+    if compression.is_compressed(path):
+        with _open_range(path, offset, offset + 1) as (buf, base):
+            start = offset - base
+            end = buf.find(b"\n", start) + 1 or len(buf)
+            return buf[start:end].decode("utf-8")
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.readline().decode("utf-8")
+
+
+class GameFilter(NamedTuple):
+    """Cheap conditions on the root node of a game, checked before parsing it.
+
+    Games that fail any condition are dropped by `parse_game_str_to_dict` right
+    after the root node is tokenized, before any other work. Conditions left as
+    None always pass.
+    """
+
+    # Allowed values of the SZ property, typed like `root_prop` (e.g. 19, or
+    # "19:13" for rectangular boards).
+    board_size: Optional[Collection[Union[int, str]]] = None
+    # Allowed values of the gtype parameter in the root comment.
+    gtype: Optional[Collection[str]] = None
+    # Keep only games where PB or PW contains one of these (case-insensitively).
+    player_substrings: Optional[Collection[str]] = None
+
+    def matches(self, root_properties: Dict[str, str]) -> bool:
+        """Whether a game with these root properties passes the filter."""
+        if (
+            self.board_size is not None
+            and root_prop("SZ", root_properties) not in self.board_size
+        ):
+            return False
+        if (
+            self.gtype is not None
+            and extract_param("gtype", root_prop("C", root_properties))
+            not in self.gtype
+        ):
+            return False
+        if self.player_substrings is not None:
+            names = (
+                root_properties.get("PB", "") + "\n" + root_properties.get("PW", "")
+            ).lower()
+            if not any(x.lower() in names for x in self.player_substrings):
+                return False
+        return True
+
+
+class ParsedLines(NamedTuple):
+    """Games parsed from part of an sgf file by `read_and_parse_lines`."""
+
+    games: List[Dict[str, Any]]
+    # Byte offset just past the last newline-terminated line that was parsed.
+    end_offset: int
+    # Number of newline-terminated lines parsed, including lines whose game was
+    # dropped by a `GameFilter`.
+    num_lines: int
+    # Byte offset of the start of every line parsed.
+    line_offsets: List[int]
+    # Number of games (0 or 1) at the end of `games` that come from a complete
+    # game at the end of the file that is not (yet) followed by a newline.
+    num_trailing_games: int = 0
+
+
+def read_and_parse_lines(
     path: pathlib.Path,
+    start_offset: int = 0,
+    start_line: int = 1,
+    stop_offset: Optional[int] = None,
     fast_parse: bool = False,
     victim_color: Optional[str] = None,
     no_victim_okay: bool = False,
     adversary_substrings: Optional[Sequence[str]] = None,
     victim_substrings: Optional[Sequence[str]] = None,
-) -> Sequence[Dict[str, Any]]:
-    """Parse all lines of an sgf file to a list of dictionaries with game info."""
+    include_move_stats: bool = False,
+    columns: Optional[Collection[str]] = None,
+    game_filter: Optional[GameFilter] = None,
+) -> ParsedLines:
+    """Parse the lines of an sgf file starting at byte `start_offset`.
+
+    Files can be appended to while we read them (e.g. by a running victimplay
+    job), so the last line may be only partially written. A final line without a
+    trailing newline is parsed only if it looks like a complete game, and it is
+    never counted in `end_offset` or `num_lines`, so that parsing can resume
+    from there once more data has been written.
+
+    Args:
+        path: The sgf file to read.
+        start_offset: Byte offset to start reading at. Must be the start of a line.
+        start_line: Line number of the line starting at `start_offset`.
+        stop_offset: If set, lines starting at or after this byte offset are not
+            parsed. Lines starting before it are parsed in full.
+        Other args: See `parse_game_str_to_dict`.
+
+    Returns:
+        The parsed games along with how far into the file parsing got.
+    """
     if adversary_substrings is None:
         adversary_substrings = DEFAULT_ADVERSARY_SUBSTRINGS
     if victim_substrings is None:
         victim_substrings = DEFAULT_VICTIM_SUBSTRINGS
 
+    path_str = str(path)
+    path_info = parse_path_info(path_str)
     parsed_games = []
-    with open(path, "r") as f:
-        for i, line in enumerate(f):
-            parsed_games.append(
-                parse_game_str_to_dict(
-                    str(path),
-                    i + 1,
-                    line.strip(),
-                    fast_parse=fast_parse,
-                    victim_color=victim_color,
-                    no_victim_okay=no_victim_okay,
-                    adversary_substrings=adversary_substrings,
-                    victim_substrings=victim_substrings,
-                )
+    parsed_line_offsets = []
+    end_offset = start_offset
+    num_lines = 0
+    num_trailing_games = 0
+    with _open_range(path, start_offset, stop_offset) as (buf, base):
+        for line_start, line_end, is_terminated in iter_line_spans(
+            buf,
+            start_offset - base,
+            None if stop_offset is None else stop_offset - base,
+        ):
+            line = buf[line_start:line_end].strip()
+            if not is_terminated and not line.endswith(b")"):
+                break
+            game = parse_game_str_to_dict(
+                path_str,
+                start_line + num_lines,
+                line,
+                path_info=path_info,
+                fast_parse=fast_parse,
+                victim_color=victim_color,
+                no_victim_okay=no_victim_okay,
+                adversary_substrings=adversary_substrings,
+                victim_substrings=victim_substrings,
+                include_move_stats=include_move_stats,
+                columns=columns,
+                game_filter=game_filter,
             )
-    return parsed_games
+            if game is not None:
+                parsed_games.append(game)
+            parsed_line_offsets.append(base + line_start)
+            if is_terminated:
+                end_offset = base + line_end + 1
+                num_lines += 1
+            elif game is not None:
+                num_trailing_games = 1
+    return ParsedLines(
+        parsed_games, end_offset, num_lines, parsed_line_offsets, num_trailing_games
+    )
+
+
+def read_and_parse_file(
+    path: pathlib.Path,
+    fast_parse: bool = False,
+    victim_color: Optional[str] = None,
+    no_victim_okay: bool = False,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    include_move_stats: bool = False,
+    columns: Optional[Collection[str]] = None,
+    game_filter: Optional[GameFilter] = None,
+) -> Sequence[Dict[str, Any]]:
+    """Parse all lines of an sgf file to a list of dictionaries with game info."""
+    return read_and_parse_lines(
+        path,
+        fast_parse=fast_parse,
+        victim_color=victim_color,
+        no_victim_okay=no_victim_okay,
+        adversary_substrings=adversary_substrings,
+        victim_substrings=victim_substrings,
+        include_move_stats=include_move_stats,
+        columns=columns,
+        game_filter=game_filter,
+    ).games
+
+
+def read_and_parse_chunk(
+    path: pathlib.Path,
+    start_offset: int,
+    stop_offset: Optional[int],
+    **kwargs,
+) -> ParsedLines:
+    """Parse the lines of an sgf file that start in [start_offset, stop_offset).
+
+    `start_offset` need not be the start of a line; a line that starts before it
+    belongs to the previous chunk. Since the number of lines before the chunk is
+    unknown, `sgf_line` numbers are relative to the chunk (its first line is
+    line 1) and must be shifted by the caller.
+
+    Args:
+        path: The sgf file to read.
+        start_offset: Byte offset where the chunk starts.
+        stop_offset: Byte offset where the chunk ends, or None for the end of
+            the file.
+        kwargs: See `read_and_parse_lines`.
+    """
+    if start_offset > 0:
+        # Skip to the start of the first line beginning at or after
+        # `start_offset`.
+        with _open_range(path, start_offset - 1, start_offset) as (buf, base):
+            newline = buf.find(b"\n", start_offset - 1 - base)
+            start_offset = base + (newline + 1 if newline >= 0 else len(buf))
+    try:
+        return read_and_parse_lines(
+            path, start_offset=start_offset, stop_offset=stop_offset, **kwargs
+        )
+    except AssertionError as e:
+        raise AssertionError(
+            f"{e} (line numbers counted from byte offset {start_offset})"
+        ) from e
+
+
+def _split_compressed_file(
+    path: pathlib.Path, chunk_bytes: int
+) -> List[Tuple[pathlib.Path, int, Optional[int]]]:
+    """Split a compressed file into ranges of whole compression blocks.
+
+    Ranges cover at least `chunk_bytes` bytes (except for the last), so that no
+    block has to be decompressed by more than one worker.
+    """
+    chunks = []
+    start = 0
+    for block in compression.block_index(path):
+        if block.size is None:
+            break
+        end = block.offset + block.size
+        if end - start >= chunk_bytes:
+            chunks.append((path, start, end))
+            start = end
+    size = compression.decompressed_size(path)
+    if size is None or start < size or not chunks:
+        chunks.append((path, start, size))
+    return chunks
+
+
+def split_into_chunks(
+    paths: Sequence[pathlib.Path], chunk_bytes: int
+) -> List[Tuple[pathlib.Path, int, Optional[int]]]:
+    """Split `paths` into (path, start_offset, stop_offset) byte ranges.
+
+    Each range covers at most `chunk_bytes` bytes, and every file gets at least
+    one range, even if it is empty. Compressed files are instead split at the
+    boundaries of their compression blocks (see `compression`), and
+    `stop_offset` is None for a range that runs to the end of a compressed file
+    of unknown size.
+    """
+    chunks = []
+    for path in paths:
+        if compression.is_compressed(path):
+            chunks += _split_compressed_file(path, chunk_bytes)
+            continue
+        size = os.path.getsize(path)
+        chunks += [
+            (path, start, min(start + chunk_bytes, size))
+            for start in range(0, max(size, 1), chunk_bytes)
+        ]
+    return chunks
+
+
+def default_chunk_bytes(paths: Sequence[pathlib.Path], processes: int) -> int:
+    """About four byte ranges per process, but at least `MIN_CHUNK_BYTES`."""
+    total_bytes = sum(
+        (compression.is_compressed(path) and compression.decompressed_size(path))
+        or os.path.getsize(path)
+        for path in paths
+    )
+    return max(MIN_CHUNK_BYTES, total_bytes // (4 * processes))
+
+
+def borrow_pool(
+    pool: Optional[multiprocessing.pool.Pool], processes: int
+) -> ContextManager[multiprocessing.pool.Pool]:
+    """Use `pool` if given and leave it running, or else a new, temporary pool.
+
+    Starting a pool of many processes takes a while, so callers that parse
+    repeatedly (like the parsing server) should create one pool and pass it to
+    every call.
+    """
+    if pool is not None:
+        return contextlib.nullcontext(pool)
+    return multiprocessing.Pool(processes=processes)
 
 
 def read_and_parse_all_files(
@@ -108,8 +465,25 @@ def read_and_parse_all_files(
     no_victim_okay: bool = False,
     adversary_substrings: Optional[Sequence[str]] = None,
     victim_substrings: Optional[Sequence[str]] = None,
+    chunk_bytes: Optional[int] = None,
+    include_move_stats: bool = False,
+    columns: Optional[Collection[str]] = None,
+    game_filter: Optional[GameFilter] = None,
+    pool: Optional[multiprocessing.pool.Pool] = None,
 ) -> Sequence[Dict[str, Any]]:
-    """Returns concatenated contents of all files in `paths`."""
+    """Returns concatenated contents of all files in `paths`.
+
+    Work is split into byte ranges of the files rather than whole files, so
+    that a single huge file doesn't keep one worker busy long after the others
+    have finished.
+
+    Args:
+        chunk_bytes: Size of the byte ranges handed to workers. Defaults to
+            `default_chunk_bytes(paths, processes)`.
+        pool: If set, parse in this pool instead of starting a new one of
+            `processes` workers. See `borrow_pool`.
+        Other args: See `read_and_parse_file`.
+    """
     if adversary_substrings is None:
         adversary_substrings = DEFAULT_ADVERSARY_SUBSTRINGS
     if victim_substrings is None:
@@ -117,19 +491,40 @@ def read_and_parse_all_files(
 
     if not processes:
         processes = min(128, len(paths) // 2)
-    read_and_parse_file_partial = functools.partial(
-        read_and_parse_file,
+    processes = max(processes, 1)
+    if chunk_bytes is None:
+        chunk_bytes = default_chunk_bytes(paths, processes)
+    chunks = split_into_chunks(paths, chunk_bytes)
+    read_and_parse_chunk_partial = functools.partial(
+        read_and_parse_chunk,
         fast_parse=fast_parse,
         no_victim_okay=no_victim_okay,
         adversary_substrings=adversary_substrings,
         victim_substrings=victim_substrings,
+        include_move_stats=include_move_stats,
+        columns=columns,
+        game_filter=game_filter,
     )
-    with multiprocessing.Pool(processes=max(processes, 1)) as pool:
-        parsed_games = pool.map(read_and_parse_file_partial, paths)
-    return list(chain.from_iterable(parsed_games))
+    with borrow_pool(pool, processes) as pool:
+        parsed_chunks = pool.starmap(read_and_parse_chunk_partial, chunks)
+
+    # Shift line numbers from being relative to each chunk to being relative to
+    # the start of the file.
+    has_sgf_line = columns is None or "sgf_line" in columns
+    lines_before_chunk = 0
+    for (_, start_offset, _), parsed_chunk in zip(chunks, parsed_chunks):
+        if start_offset == 0:
+            lines_before_chunk = 0
+        if lines_before_chunk and has_sgf_line:
+            for game in parsed_chunk.games:
+                game["sgf_line"] += lines_before_chunk
+        lines_before_chunk += parsed_chunk.num_lines
+    return list(chain.from_iterable(chunk.games for chunk in parsed_chunks))
 
 
-def extract_re(pattern: str, subject: Union[str, int]) -> Union[str, int, None]:
+def extract_re(
+    pattern: Union[str, Pattern[str]], subject: Union[str, int]
+) -> Union[str, int, None]:
     """Extract first group matching `pattern` from `subject`."""
     match = re.search(pattern, str(subject))
     if match is not None:
@@ -148,28 +543,264 @@ def extract_param(
     return extract_re(f"{property_name}=([^,\\]]+)", sgf_str)
 
 
-num_b_pass_pattern = re.compile("B\\[]")
-num_w_pass_pattern = re.compile("W\\[]")
-semicolon_pattern = re.compile(";")
+# A root property identifier followed by its first value. Values may contain
+# escaped closing brackets ("\]").
+_root_property_pattern = re.compile(r"\s*([A-Z]+)\s*\[((?:[^\]\\]|\\.)*)\]", re.DOTALL)
+_root_property_bytes_pattern = re.compile(
+    _root_property_pattern.pattern.encode(), re.DOTALL
+)
+# Additional values of a multi-valued property, e.g. the second value in AB[aa][bb].
+_extra_value_pattern = re.compile(r"\s*\[(?:[^\]\\]|\\.)*\]", re.DOTALL)
+_extra_value_bytes_pattern = re.compile(
+    _extra_value_pattern.pattern.encode(), re.DOTALL
+)
+
+
+def tokenize_root(sgf_str: Union[str, bytes]) -> Tuple[Dict[str, str], int]:
+    """Tokenize the root node of `sgf_str` in a single pass.
+
+    Walks the properties following the first ";" and stops at the first move
+    node, so the cost is independent of the number of moves and comments in the
+    game. `sgf_str` may also be UTF-8 bytes, in which case only the values of
+    the root properties are decoded.
+
+    Returns:
+        Dictionary mapping each property identifier to its first (raw) value,
+        and the position in `sgf_str` where the root node ends.
+    """
+    if isinstance(sgf_str, str):
+        property_pattern = _root_property_pattern
+        extra_value_pattern = _extra_value_pattern
+        pos = sgf_str.find(";")
+    else:
+        property_pattern = _root_property_bytes_pattern
+        extra_value_pattern = _extra_value_bytes_pattern
+        pos = sgf_str.find(b";")
+    properties: Dict[str, str] = {}
+    if pos < 0:
+        return properties, len(sgf_str)
+    pos += 1
+    while True:
+        match = property_pattern.match(sgf_str, pos)
+        if match is None:
+            break
+        properties.setdefault(match.group(1), match.group(2))
+        pos = match.end()
+        extra_value = extra_value_pattern.match(sgf_str, pos)
+        while extra_value is not None:
+            pos = extra_value.end()
+            extra_value = extra_value_pattern.match(sgf_str, pos)
+    if isinstance(sgf_str, str):
+        return properties, pos
+    decoded = {
+        name.decode(): value.decode("utf-8") for name, value in properties.items()
+    }
+    return decoded, pos
+
+
+def parse_root_properties(sgf_str: Union[str, bytes]) -> Dict[str, str]:
+    """Properties of the root node of `sgf_str`. See `tokenize_root`."""
+    return tokenize_root(sgf_str)[0]
+
+
+def _count(sgf_str: Union[str, bytes], substring: str, start: int = 0) -> int:
+    """Count non-overlapping occurrences of `substring` in a string or bytes."""
+    if isinstance(sgf_str, str):
+        return sgf_str.count(substring, start)
+    return sgf_str.count(substring.encode(), start)
+
+
+def count_passes(
+    sgf_str: Union[str, bytes], moves_start: int, board_size: Any
+) -> Tuple[int, int]:
+    """Count the passes by black and white in the move section of `sgf_str`.
+
+    Each count is a single C-level substring scan starting at `moves_start`
+    (see `tokenize_root`), which is much cheaper than a regex scan over the
+    game. "tt" is also a pass on boards up to 19x19.
+    """
+    tt_is_pass = isinstance(board_size, int) and board_size <= 19
+    num_b_pass = _count(sgf_str, "B[]", moves_start)
+    num_w_pass = _count(sgf_str, "W[]", moves_start)
+    if tt_is_pass:
+        num_b_pass += _count(sgf_str, "B[tt]", moves_start)
+        num_w_pass += _count(sgf_str, "W[tt]", moves_start)
+    return num_b_pass, num_w_pass
+
+
+_move_pattern = re.compile(r";\s*([BW])\[([^\]]*)\]")
+_move_bytes_pattern = re.compile(_move_pattern.pattern.encode())
+
+
+def move_stats(
+    sgf_str: Union[str, bytes], moves_start: int, board_size: Any
+) -> Dict[str, Any]:
+    """Per-game move statistics from one regex scan over the move section.
+
+    Returns:
+        Dictionary with the number of black and white moves (passes included),
+        the 0-based index of the first pass among the moves (None if nobody
+        passed), and the number of consecutive passes that end the game.
+    """
+    if isinstance(sgf_str, str):
+        moves = _move_pattern.findall(sgf_str, moves_start)
+        black, tt = "B", "tt"
+    else:
+        moves = _move_bytes_pattern.findall(sgf_str, moves_start)
+        black, tt = b"B", b"tt"
+    tt_is_pass = isinstance(board_size, int) and board_size <= 19
+    is_pass = [not vertex or (tt_is_pass and vertex == tt) for _, vertex in moves]
+    num_b_moves = sum(color == black for color, _ in moves)
+    num_trailing_passes = 0
+    for move_is_pass in reversed(is_pass):
+        if not move_is_pass:
+            break
+        num_trailing_passes += 1
+    return {
+        "num_b_moves": num_b_moves,
+        "num_w_moves": len(moves) - num_b_moves,
+        "first_pass_turn": is_pass.index(True) if True in is_pass else None,
+        "num_trailing_passes": num_trailing_passes,
+    }
+
+
+def root_prop(property_name: str, properties: Dict[str, str]) -> Union[str, int, None]:
+    """Look up a property from `parse_root_properties`, typed like `extract_prop`."""
+    value = properties.get(property_name)
+    if not value:
+        return None
+    return int(value) if value.isdecimal() else value
+
+
+# Player names and ranks repeat across millions of games, so everything derived
+# from them alone is computed once per distinct value.
+NAME_CACHE_SIZE = 2**16
+# Victims named without a step count.
+_VICTIM_STEPS_BY_NAME = {
+    "bot-cp127-v1": 5303129600,
+    "bot-cp505-v2": 11840935168,
+    "bot-cp505-v1": 11840935168,
+}
+# Step count after "-s" in the name, allowing step count to end with "m" (for
+# millions). After "-s<number>" we expect "-" or "." (for names like t0-s0-d0
+# and victim-s1m.bin.gz) or the end of the string.
+_victim_steps_pattern = re.compile(r"-s(\d+m?)(?:[-.]|$)")
+_victim_path_steps_pattern = re.compile(r"kata[^_]+?\-s([0-9]+)\-")
+_adv_steps_pattern = re.compile(r"\-s([0-9]+)\-")
+_adv_path_steps_pattern = re.compile(r"t0\-s([0-9]+)\-")
+_adv_samples_pattern = re.compile(r"\-d([0-9]+)")
+_visits_patterns = (re.compile(r"v([0-9]+)"), re.compile(r"v=([0-9]+)"))
+_rsym_pattern = re.compile(r"rsym=([^,\]]+)")
+_algo_pattern = re.compile(r"algo=([^,\]]+)")
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def player_roles(
+    name: str,
+    adversary_substrings: Tuple[str, ...],
+    victim_substrings: Tuple[str, ...],
+) -> Tuple[bool, bool]:
+    """Whether `name` (case-insensitively) marks a victim and an adversary."""
+    lower_name = name.lower()
+    return (
+        any(x in lower_name for x in victim_substrings),
+        any(x in lower_name for x in adversary_substrings),
+    )
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def victim_steps_from_name(name: Union[str, int]) -> Union[str, int, None]:
+    """Training steps of a victim, from its name. May be e.g. "1m"."""
+    if name in _VICTIM_STEPS_BY_NAME:
+        return _VICTIM_STEPS_BY_NAME[name]
+    return extract_re(_victim_steps_pattern, name)
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def adv_steps_from_name(name: Union[str, int]) -> Union[str, int, None]:
+    """Training steps of an adversary, from its name."""
+    return extract_re(_adv_steps_pattern, name)
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def adv_samples_from_name(name: Union[str, int]) -> Union[str, int, None]:
+    """Training samples of an adversary, from its name."""
+    return extract_re(_adv_samples_pattern, name)
+
+
+class RankInfo(NamedTuple):
+    """Fields KataGo encodes in the BR/WR ("rank") property of a player."""
+
+    visits: Union[str, int]
+    rsym: Union[str, int, None]
+    algo: Union[str, int, None]
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def parse_rank(rank: Union[str, int]) -> RankInfo:
+    """Parse a non-empty BR/WR property value."""
+    return RankInfo(
+        visits=(
+            extract_re(_visits_patterns[0], rank)
+            or extract_re(_visits_patterns[1], rank)
+            or "-1"
+        ),
+        rsym=extract_re(_rsym_pattern, rank),
+        algo=extract_re(_algo_pattern, rank),
+    )
+
+
+class PathInfo(NamedTuple):
+    """Game fields that depend only on the path of the file holding the game."""
+
+    # "train", "eval" or "gating", depending on which KataGo output directory
+    # the file is in.
+    train_status: Optional[str]
+    # Fallback step counts for players whose names don't include one, taken from
+    # the last three components of the path.
+    victim_steps: Union[str, int, None]
+    adv_steps: Union[str, int, None]
+
+
+def parse_path_info(path: Union[str, pathlib.Path]) -> PathInfo:
+    """Compute the fields of `PathInfo` for a file at `path`."""
+    parts = pathlib.Path(path).parts
+    training = None
+    if "eval" in parts:
+        training = "eval"
+    elif "selfplay" in parts:
+        training = "train"
+    elif "gatekeepersgf" in parts:
+        training = "gating"
+    last_parts = "/".join(parts[-3:])
+    return PathInfo(
+        train_status=training,
+        victim_steps=extract_re(_victim_path_steps_pattern, last_parts),
+        adv_steps=extract_re(_adv_path_steps_pattern, last_parts),
+    )
 
 
 def parse_game_str_to_dict(
     path: str,
     line_number: int,
-    sgf_str: str,
+    sgf_str: Union[str, bytes],
     fast_parse: bool = False,
     victim_color: Optional[str] = None,
     no_victim_okay: bool = False,
     adversary_substrings: Optional[Sequence[str]] = None,
     victim_substrings: Optional[Sequence[str]] = None,
-) -> Dict[str, Any]:
+    include_move_stats: bool = False,
+    path_info: Optional[PathInfo] = None,
+    columns: Optional[Collection[str]] = None,
+    game_filter: Optional[GameFilter] = None,
+) -> Optional[Dict[str, Any]]:
     """Parse an sgf string to a dictionary containing game_info.
 
     Args:
         path: Path where this string was read from. We want to keep this
             information so that we can later retrieve the original string.
         line_number: Line number in the above path.
-        sgf_str: The string to parse.
+        sgf_str: The string to parse, or its UTF-8 encoding.
         fast_parse: Include additional fields that are slower to extract
             or generally less useful.
         victim_color: Which color is the victim (for SGFs whose PB and PW fields
@@ -179,25 +810,44 @@ def parse_game_str_to_dict(
         adversary_substrings: Substrings that indicate the adversary in PB or
             PW.
         victim_substrings: Substrings that indicate the victim in PB or PW.
+        include_move_stats: Also include the fields from `move_stats`, plus the
+            number of moves by the adversary and the victim.
+        path_info: `parse_path_info(path)`, if already computed. Callers parsing
+            many games from the same file should pass it.
+        columns: If set, only return these fields, in this order, and skip the
+            work for fields that aren't needed. Any field can be requested,
+            including the pass counts and move stats regardless of
+            `fast_parse` and `include_move_stats`.
+        game_filter: If set, games that don't match it aren't parsed.
 
     Returns:
-        Dictionary containing game_info.
+        Dictionary containing game_info, or None if the game doesn't match
+        `game_filter`.
     """
     if adversary_substrings is None:
         adversary_substrings = DEFAULT_ADVERSARY_SUBSTRINGS
     if victim_substrings is None:
         victim_substrings = DEFAULT_VICTIM_SUBSTRINGS
 
-    rule_str = extract_prop("RU", sgf_str)
-    comment_str = extract_prop("C", sgf_str)
-    board_size = extract_prop("SZ", sgf_str)
-    whb = "0"
-    if rule_str and "whb" in rule_str:
-        whb = extract_re(r"whb([A-Z0-9\-]+)", rule_str)
-    b_name = extract_prop("PB", sgf_str)
-    w_name = extract_prop("PW", sgf_str)
-    result = extract_prop("RE", sgf_str)
-    komi = extract_prop("KM", sgf_str)
+    if columns is None:
+        wants_rules = wants_comment = wants_num_moves = True
+        wants_passes = not fast_parse
+    else:
+        wanted = set(columns)
+        wants_rules = not wanted.isdisjoint(RULE_COLUMNS)
+        wants_comment = not wanted.isdisjoint(COMMENT_COLUMNS)
+        wants_num_moves = "num_moves" in wanted
+        wants_passes = not wanted.isdisjoint(PASS_COLUMNS)
+        include_move_stats = not wanted.isdisjoint(MOVE_STATS_COLUMNS)
+
+    root_properties, moves_start = tokenize_root(sgf_str)
+    if game_filter is not None and not game_filter.matches(root_properties):
+        return None
+    board_size = root_prop("SZ", root_properties)
+    b_name = root_prop("PB", root_properties)
+    w_name = root_prop("PW", root_properties)
+    result = root_prop("RE", root_properties)
+    komi = root_prop("KM", root_properties)
     komi = float(komi) if komi else komi
     win_color = result[0].lower() if result else None
     is_resignation = False
@@ -215,33 +865,25 @@ def parse_game_str_to_dict(
         else:
             win_score = float(win_score_str)
 
-    b_meta = extract_prop("BR", sgf_str)
-    w_meta = extract_prop("WR", sgf_str)
-    b_visits = (
-        extract_re(r"v([0-9]+)", b_meta) or extract_re(r"v=([0-9]+)", b_meta) or "-1"
-        if b_meta
-        else None
-    )
-    w_visits = (
-        extract_re(r"v([0-9]+)", w_meta) or extract_re(r"v=([0-9]+)", w_meta) or "-1"
-        if w_meta
-        else None
-    )
+    b_meta = root_prop("BR", root_properties)
+    w_meta = root_prop("WR", root_properties)
+    b_rank_info = parse_rank(b_meta) if b_meta else None
+    w_rank_info = parse_rank(w_meta) if w_meta else None
+    b_visits = b_rank_info.visits if b_rank_info else None
+    w_visits = w_rank_info.visits if w_rank_info else None
 
-    parts = pathlib.Path(path).parts
-    training = None
-    if "eval" in parts:
-        training = "eval"
-    elif "selfplay" in parts:
-        training = "train"
-    elif "gatekeepersgf" in parts:
-        training = "gating"
+    if path_info is None:
+        path_info = parse_path_info(path)
 
     if victim_color is None:
-        b_name_has_victim = any(x in b_name.lower() for x in victim_substrings)
-        w_name_has_victim = any(x in w_name.lower() for x in victim_substrings)
-        b_name_has_adversary = any(x in b_name.lower() for x in adversary_substrings)
-        w_name_has_adversary = any(x in w_name.lower() for x in adversary_substrings)
+        adversary_substrings = tuple(adversary_substrings)
+        victim_substrings = tuple(victim_substrings)
+        b_name_has_victim, b_name_has_adversary = player_roles(
+            b_name, adversary_substrings, victim_substrings
+        )
+        w_name_has_victim, w_name_has_adversary = player_roles(
+            w_name, adversary_substrings, victim_substrings
+        )
         victim_is_black = b_name_has_victim or w_name_has_adversary
         victim_is_white = w_name_has_victim or b_name_has_adversary
         if victim_is_black != victim_is_white:
@@ -253,11 +895,12 @@ def parse_game_str_to_dict(
     victim_name = None
     victim_steps = None
     victim_rank = None
+    victim_rank_info = None
     victim_visits = None
     adv_color = None
     adv_name = None
     adv_steps = None
-    adv_rank = None
+    adv_rank_info = None
     adv_visits = None
     adv_komi = None
     adv_samples = None
@@ -267,45 +910,48 @@ def parse_game_str_to_dict(
         victim_name = {"b": b_name, "w": w_name}[victim_color]
         adv_color = {"b": "w", "w": "b"}[victim_color]
         adv_name = {"b": b_name, "w": w_name}[adv_color]
-        if victim_name in ["bot-cp127-v1", "bot-cp505-v2", "bot-cp505-v1"]:
-            victim_steps = {
-                "bot-cp127-v1": 5303129600,
-                "bot-cp505-v2": 11840935168,
-                "bot-cp505-v1": 11840935168,
-            }[victim_name]
-        else:
-            victim_steps = (
-                # Extract step count after "-s" in the name, allowing step count to end
-                # with "m" (for millions). After "-s<number>" we expect "-" or "."
-                # (for names like t0-s0-d0 and victim-s1m.bin.gz) or the end of the
-                # string.
-                extract_re("-s(\d+m?)(?:[-.]|$)", victim_name)
-                or extract_re("kata[^_]+?\-s([0-9]+)\-", "/".join(parts[-3:]))
-                or 0
-            )
-        adv_rank = (
-            extract_prop("BR", sgf_str)
-            if adv_color == "b"
-            else extract_prop("WR", sgf_str)
-        )
-        victim_rank = (
-            extract_prop("BR", sgf_str)
-            if adv_color == "w"
-            else extract_prop("WR", sgf_str)
+        victim_steps = (
+            victim_steps_from_name(victim_name) or path_info.victim_steps or 0
         )
+        victim_rank = b_meta if adv_color == "w" else w_meta
+        adv_rank_info = b_rank_info if adv_color == "b" else w_rank_info
+        victim_rank_info = b_rank_info if adv_color == "w" else w_rank_info
         victim_visits = {"b": b_visits, "w": w_visits}[victim_color]
         adv_visits = {"b": b_visits, "w": w_visits}[adv_color]
         adv_komi = None if adv_color is None else komi * {"w": 1, "b": -1}[adv_color]
-        adv_steps = (
-            extract_re(r"\-s([0-9]+)\-", adv_name)
-            or extract_re(r"t0\-s([0-9]+)\-", "/".join(parts[-3:]))
-            or 0
-        )
-        adv_samples = extract_re(r"\-d([0-9]+)", adv_name) or 0
+        adv_steps = adv_steps_from_name(adv_name) or path_info.adv_steps or 0
+        adv_samples = adv_samples_from_name(adv_name) or 0
         if win_score is not None:
             adv_minus_victim_score = win_score if adv_color == win_color else -win_score
             adv_minus_victim_score_wo_komi = adv_minus_victim_score - adv_komi
 
+    rule_fields: Dict[str, Any] = dict.fromkeys(RULE_COLUMNS)
+    if wants_rules:
+        rule_str = root_prop("RU", root_properties)
+        whb = "0"
+        if rule_str and "whb" in rule_str:
+            whb = extract_re(r"whb([A-Z0-9\-]+)", rule_str)
+        rule_fields = {
+            "ko_rule": extract_re(r"ko([A-Z]+)", rule_str),
+            "score_rule": extract_re(r"score([A-Z]+)", rule_str),
+            "tax_rule": extract_re(r"tax([A-Z]+)", rule_str),
+            "sui_legal": extract_re(r"sui([0-9])", rule_str) == 1,
+            "has_button": "button1" in rule_str if rule_str else False,
+            "whb": whb,
+            "fpok": "fpok" in rule_str if rule_str else False,
+        }
+    comment_fields: Dict[str, Any] = dict.fromkeys(COMMENT_COLUMNS)
+    if wants_comment:
+        comment_str = root_prop("C", root_properties)
+        comment_fields = {
+            "start_turn_idx": extract_param("startTurnIdx", comment_str),
+            "init_turn_num": extract_param("initTurnNum", comment_str),
+            "used_initial_position": (
+                extract_param("usedInitialPosition", comment_str) == 1
+            ),
+            "gtype": extract_param("gtype", comment_str),
+        }
+
     parsed_info = {
         "b_name": b_name,
         "w_name": w_name,
@@ -322,16 +968,16 @@ def parse_game_str_to_dict(
             else 1
         ),
         "victim_steps": victim_steps,
-        "victim_rsym": extract_param("rsym", victim_rank),
-        "victim_algo": extract_param("algo", victim_rank),
+        "victim_rsym": victim_rank_info.rsym if victim_rank_info else None,
+        "victim_algo": victim_rank_info.algo if victim_rank_info else None,
         # Adversary info
         "adv_color": adv_color,
         "adv_name": adv_name,
         "adv_visits": adv_visits,
         "adv_steps": adv_steps,
         "adv_samples": adv_samples,
-        "adv_rsym": extract_param("rsym", adv_rank),
-        "adv_algo": extract_param("algo", adv_rank),
+        "adv_rsym": adv_rank_info.rsym if adv_rank_info else None,
+        "adv_algo": adv_rank_info.algo if adv_rank_info else None,
         # Scoring info
         "win_color": win_color,
         "win_name": b_name if win_color == "b" else w_name,
@@ -342,21 +988,15 @@ def parse_game_str_to_dict(
         "adv_minus_victim_score": adv_minus_victim_score,
         "adv_minus_victim_score_wo_komi": adv_minus_victim_score_wo_komi,
         # Other info
-        "train_status": training,
+        "train_status": path_info.train_status,
         "board_size": board_size,
-        "start_turn_idx": extract_param("startTurnIdx", comment_str),
-        "handicap": extract_prop("HA", sgf_str),
-        "num_moves": len(semicolon_pattern.findall(sgf_str)) - 1,
-        "ko_rule": extract_re(r"ko([A-Z]+)", rule_str),
-        "score_rule": extract_re(r"score([A-Z]+)", rule_str),
-        "tax_rule": extract_re(r"tax([A-Z]+)", rule_str),
-        "sui_legal": extract_re(r"sui([0-9])", rule_str) == 1,
-        "has_button": "button1" in rule_str if rule_str else False,
-        "whb": whb,
-        "fpok": "fpok" in rule_str if rule_str else False,
-        "init_turn_num": extract_param("initTurnNum", comment_str),
-        "used_initial_position": extract_param("usedInitialPosition", comment_str) == 1,
-        "gtype": extract_param("gtype", comment_str),
+        "start_turn_idx": comment_fields["start_turn_idx"],
+        "handicap": root_prop("HA", root_properties),
+        "num_moves": _count(sgf_str, ";") - 1 if wants_num_moves else None,
+        **rule_fields,
+        "init_turn_num": comment_fields["init_turn_num"],
+        "used_initial_position": comment_fields["used_initial_position"],
+        "gtype": comment_fields["gtype"],
         "is_continuation": False,
         "is_resignation": is_resignation,
         # Parsing metadata
@@ -364,27 +1004,23 @@ def parse_game_str_to_dict(
         "sgf_line": line_number,
     }
 
-    if not fast_parse:
-        # findall() is much slower than extracting a single regex
-        num_b_pass = (
-            len(num_b_pass_pattern.findall(sgf_str))
-            + (
-                len(re.findall("B\\[tt]", sgf_str))
-                if isinstance(board_size, int) and board_size <= 19
-                else 0
-            ),
-        )
-        num_w_pass = (
-            len(num_w_pass_pattern.findall(sgf_str))
-            + (
-                len(re.findall("W\\[tt]", sgf_str))
-                if isinstance(board_size, int) and board_size <= 19
-                else 0
-            ),
-        )
+    if wants_passes:
+        num_b_pass, num_w_pass = count_passes(sgf_str, moves_start, board_size)
         parsed_info["num_b_pass"] = num_b_pass
         parsed_info["num_w_pass"] = num_w_pass
         parsed_info["num_adv_pass"] = num_b_pass if adv_color == "b" else num_w_pass
         parsed_info["num_victim_pass"] = num_w_pass if adv_color == "b" else num_b_pass
 
+    if include_move_stats:
+        stats = move_stats(sgf_str, moves_start, board_size)
+        parsed_info.update(stats)
+        parsed_info["num_adv_moves"] = (
+            stats[f"num_{adv_color}_moves"] if adv_color else None
+        )
+        parsed_info["num_victim_moves"] = (
+            stats[f"num_{victim_color}_moves"] if victim_color else None
+        )
+
+    if columns is not None:
+        return {name: parsed_info[name] for name in columns}
     return parsed_info
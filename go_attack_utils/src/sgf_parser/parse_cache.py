@@ -0,0 +1,612 @@
+"""Persistent on-disk cache of parsed SGF files, stored as Parquet.
+
+Each `.sgfs` file gets one Parquet file in the cache directory, holding the
+output of `game_info.read_and_parse_file` for it. An entry is reused only if the
+source file's size and mtime, the parser version and the parse arguments all
+match, so re-opening a directory only parses new or changed files. Entries are
+shared between column projections (including fast and full parses): an entry
+always holds every column of a full parse, and projections are read from it.
+Projections that ask for move stats, which take another scan over the moves,
+get entries of their own holding every column. So in the cache, a projection
+saves reading and converting columns but not parsing them: each file is parsed
+in full once, and then serves every projection without being parsed again.
+`game_info.read_and_parse_all_files` parses only the columns asked for, but
+caches nothing. Entries also record how far
+into the file they got, so that files that have only been appended to (e.g. by
+a running victimplay job) are parsed from where the entry left off.
+
+`read_and_parse_all_files_cached` returns everything as one DataFrame.
+Alternatively, `update_cache` brings the entries up to date and
+`iter_cached_batches` streams them as Arrow record batches, which can be sent on
+while later files are still being parsed.
+
+Next to each entry, the cache keeps an index of the byte offset of every line
+in the file, so that `get_game_str` can seek straight to a game.
+
+Requires pyarrow and pandas, which `game_info` itself does not depend on.
+"""
+
+import collections
+import functools
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import pathlib
+import threading
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sgf_parser import compression, game_info, tables
+
+DEFAULT_CACHE_DIR = pathlib.Path(
+    os.environ.get("SGF_PARSER_CACHE_DIR", "~/.cache/sgf_parser")
+).expanduser()
+# Bump when the on-disk layout below changes.
+CACHE_FORMAT_VERSION = 6
+METADATA_KEY = b"sgf_parser_cache"
+# How many bytes before the end of the cached part of a file must be unchanged
+# for the file to count as appended to rather than rewritten.
+TAIL_FINGERPRINT_BYTES = 4096
+# Seconds between checks of the `cancel_event` of a parse.
+CANCEL_POLL_INTERVAL = 0.2
+# Imported by the workers of `new_worker_pool` before they take any tasks.
+WORKER_PRELOAD_MODULES = ["sgf_parser.game_info", "sgf_parser.parse_cache"]
+WORKER_MAX_TASKS_PER_CHILD = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _entry_columns(columns: Sequence[str]) -> List[str]:
+    """Columns of the cache entries that hold `columns`.
+
+    Entries hold one of two fixed column sets, so that every writer of an entry
+    writes the same columns and none can drop another's. The price is that
+    parsing an entry does the work for all of its columns, however few were
+    asked for.
+    """
+    if set(columns) <= tables.FULL_PARSE_COLUMNS.keys():
+        return list(tables.FULL_PARSE_COLUMNS)
+    return list(tables.ALL_COLUMNS)
+
+
+def _parse_params(
+    no_victim_okay: bool,
+    adversary_substrings: Sequence[str],
+    victim_substrings: Sequence[str],
+    game_filter: Optional[game_info.GameFilter],
+    columns: Sequence[str],
+) -> Dict[str, Any]:
+    if game_filter is not None:
+        # As JSON, so that it can be part of the cache key.
+        game_filter = {
+            name: None if values is None else sorted(values, key=str)
+            for name, values in game_filter._asdict().items()
+        }
+    return {
+        "cache_format_version": CACHE_FORMAT_VERSION,
+        "parser_version": game_info.PARSER_VERSION,
+        "no_victim_okay": no_victim_okay,
+        "adversary_substrings": list(adversary_substrings),
+        "victim_substrings": list(victim_substrings),
+        "game_filter": game_filter,
+        "columns": _entry_columns(columns),
+    }
+
+
+def cache_path(
+    path: pathlib.Path, cache_dir: pathlib.Path, params: Dict[str, Any]
+) -> pathlib.Path:
+    """Location of the cache entry for `path` parsed with `params`."""
+    key = json.dumps(
+        {"path": str(pathlib.Path(path).resolve()), **params}, sort_keys=True
+    )
+    return cache_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.parquet"
+
+
+def _file_state(path: pathlib.Path) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _read_entry_metadata(entry_path: pathlib.Path) -> Optional[Dict[str, Any]]:
+    try:
+        metadata = pq.read_schema(entry_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[METADATA_KEY])
+
+
+def is_cache_entry_valid(
+    path: pathlib.Path, cache_dir: pathlib.Path, params: Dict[str, Any]
+) -> bool:
+    """Whether the cache holds an up-to-date entry for `path`."""
+    metadata = _read_entry_metadata(cache_path(path, cache_dir, params))
+    return metadata is not None and metadata["file_state"] == _file_state(path)
+
+
+def _tail_fingerprint(path: pathlib.Path, end_offset: int) -> str:
+    """Hash of the bytes just before `end_offset`.
+
+    Used to check that a file has only been appended to since it was cached.
+    """
+    with open(path, "rb") as f:
+        start = max(0, end_offset - TAIL_FINGERPRINT_BYTES)
+        f.seek(start)
+        return hashlib.sha1(f.read(end_offset - start)).hexdigest()
+
+
+def _can_resume(path: pathlib.Path, metadata: Dict[str, Any]) -> bool:
+    """Whether `path` only has new lines appended since `metadata` was written."""
+    if compression.is_compressed(path):
+        # Offsets are into the decompressed contents, and compressed (archived)
+        # files aren't appended to anyway.
+        return False
+    end_offset = metadata["end_offset"]
+    return (
+        os.stat(path).st_size >= end_offset
+        and _tail_fingerprint(path, end_offset) == metadata["tail_fingerprint"]
+    )
+
+
+def offsets_index_path(path: pathlib.Path, cache_dir: pathlib.Path) -> pathlib.Path:
+    """Location of the line offset index for `path`."""
+    key = str(pathlib.Path(path).resolve())
+    return cache_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.offsets.npz"
+
+
+def _read_offsets_index(
+    path: pathlib.Path, cache_dir: pathlib.Path
+) -> Optional[Tuple[np.ndarray, Dict[str, int]]]:
+    try:
+        with np.load(offsets_index_path(path, cache_dir)) as index:
+            size, mtime_ns = index["file_state"].tolist()
+            return index["offsets"], {"size": size, "mtime_ns": mtime_ns}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_offsets_index(
+    path: pathlib.Path,
+    cache_dir: pathlib.Path,
+    offsets: Sequence[int],
+    file_state: Dict[str, int],
+) -> None:
+    index_path = offsets_index_path(path, cache_dir)
+    tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            offsets=np.asarray(offsets, dtype=np.uint64),
+            file_state=np.array(
+                [file_state["size"], file_state["mtime_ns"]], dtype=np.int64
+            ),
+        )
+    os.replace(tmp_path, index_path)
+
+
+def load_line_offsets(
+    path: pathlib.Path, cache_dir: Optional[pathlib.Path] = None
+) -> np.ndarray:
+    """Byte offsets of the start of every line in `path`.
+
+    Uses the index written while parsing `path` if it is up to date, and
+    otherwise rebuilds it by scanning the file for newlines.
+    """
+    cache_dir = pathlib.Path(cache_dir or DEFAULT_CACHE_DIR)
+    file_state = _file_state(path)
+    index = _read_offsets_index(path, cache_dir)
+    if index is not None and index[1] == file_state:
+        return index[0]
+    offsets = np.asarray(game_info.line_offsets(path), dtype=np.uint64)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _write_offsets_index(path, cache_dir, offsets, file_state)
+    return offsets
+
+
+def get_game_str(
+    path: pathlib.Path, line_num: int, cache_dir: Optional[pathlib.Path] = None
+) -> Optional[str]:
+    """Like `game_info.get_game_str`, but seeks using the line offset index."""
+    return game_info.get_game_str(
+        path, line_num, offsets=load_line_offsets(path, cache_dir)
+    )
+
+
+def _parse_and_cache_file(
+    path: pathlib.Path, cache_dir: pathlib.Path, params: Dict[str, Any]
+) -> pathlib.Path:
+    """Parse `path` and write its cache entry. Returns the entry's location.
+
+    If the existing entry was written before more games were appended to the
+    file, only the new lines are parsed.
+    """
+    # Stat before reading, so that a file that is appended to while we parse it
+    # looks modified on the next lookup.
+    file_state = _file_state(path)
+    entry_path = cache_path(path, cache_dir, params)
+    metadata = _read_entry_metadata(entry_path)
+    parse_columns = params["columns"]
+    if metadata is not None and _can_resume(path, metadata):
+        cached_table = pq.read_table(entry_path).replace_schema_metadata()
+        # Drop the games from a trailing unterminated line; they are reparsed.
+        cached_table = cached_table.slice(
+            0, cached_table.num_rows - metadata["trailing_rows"]
+        )
+        start_offset = metadata["end_offset"]
+        start_line = metadata["num_lines"] + 1
+    else:
+        cached_table = None
+        start_offset = 0
+        start_line = 1
+
+    parsed = game_info.read_and_parse_lines(
+        path,
+        start_offset=start_offset,
+        start_line=start_line,
+        no_victim_okay=params["no_victim_okay"],
+        adversary_substrings=params["adversary_substrings"],
+        victim_substrings=params["victim_substrings"],
+        columns=parse_columns,
+        game_filter=(
+            game_info.GameFilter(**params["game_filter"])
+            if params["game_filter"] is not None
+            else None
+        ),
+    )
+    table = tables.records_to_table(parsed.games, columns=parse_columns)
+    offsets = parsed.line_offsets
+    if cached_table is not None:
+        table = tables.concat_tables([cached_table, table])
+        index = _read_offsets_index(path, cache_dir)
+        if index is not None and len(index[0]) >= start_line - 1:
+            offsets = np.concatenate(
+                [index[0][: start_line - 1], np.asarray(offsets, dtype=np.uint64)]
+            )
+        else:
+            offsets = game_info.line_offsets(path)[
+                : start_line - 1 + len(parsed.line_offsets)
+            ]
+    num_lines = start_line - 1 + parsed.num_lines
+    metadata = {
+        "path": str(path),
+        "file_state": file_state,
+        "end_offset": parsed.end_offset,
+        "num_lines": num_lines,
+        "trailing_rows": parsed.num_trailing_games,
+        "tail_fingerprint": _tail_fingerprint(path, parsed.end_offset),
+        **params,
+    }
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata)})
+
+    # Write to a temporary file first so that concurrent readers never see a
+    # partially written entry.
+    tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, entry_path)
+    _write_offsets_index(path, cache_dir, offsets, file_state)
+    return entry_path
+
+
+def _preload_modules() -> None:
+    for module in WORKER_PRELOAD_MODULES:
+        importlib.import_module(module)
+
+
+def new_worker_pool(
+    processes: int,
+    start_method: str = "forkserver",
+    max_tasks_per_child: Optional[int] = WORKER_MAX_TASKS_PER_CHILD,
+) -> multiprocessing.pool.Pool:
+    """A pool to keep around and pass as `pool` to the parsing functions.
+
+    Workers import the parser (including pandas and pyarrow) once, when the
+    pool starts, rather than on every call. With the default "forkserver" start
+    method the imports happen only once, in the fork server, and workers are
+    forked from it, which is also safe in a parent process that runs threads
+    (unlike "fork").
+
+    Args:
+        processes: Number of worker processes.
+        start_method: See `multiprocessing.get_context`.
+        max_tasks_per_child: Replace each worker after this many tasks, to bound
+            the memory a long-lived pool can accumulate. None keeps workers
+            forever.
+    """
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+    return context.Pool(
+        processes=processes,
+        initializer=_preload_modules,
+        maxtasksperchild=max_tasks_per_child,
+    )
+
+
+class ParseCancelled(Exception):
+    """Raised when a parse is cancelled through its `cancel_event`."""
+
+
+def _map_cancellable(
+    pool: multiprocessing.pool.Pool,
+    func: Callable[[pathlib.Path], Any],
+    paths: Sequence[pathlib.Path],
+    cancel_event: Optional[threading.Event],
+    processes: int,
+    on_done: Optional[Callable[[pathlib.Path], None]] = None,
+) -> None:
+    """Call `func` on every path in `pool`, checking `cancel_event` as we go.
+
+    Only about two tasks per worker (of the `processes` in `pool`) are queued at
+    a time, so that the pool can be shared with other callers and so that a
+    cancelled call leaves at most that many tasks behind. `on_done` is called
+    with each path, in order, once `func` has returned for it.
+    """
+    max_in_flight = 2 * processes
+    in_flight: Deque[
+        Tuple[pathlib.Path, multiprocessing.pool.AsyncResult]
+    ] = collections.deque()
+    remaining = iter(paths)
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise ParseCancelled()
+        for path in itertools.islice(remaining, max_in_flight - len(in_flight)):
+            in_flight.append((path, pool.apply_async(func, (path,))))
+        if not in_flight:
+            return
+        in_flight[0][1].wait(CANCEL_POLL_INTERVAL)
+        while in_flight and in_flight[0][1].ready():
+            path, result = in_flight.popleft()
+            # Re-raises any error from the worker.
+            result.get()
+            if on_done is not None:
+                on_done(path)
+
+
+def _cache_args(
+    fast_parse: bool,
+    no_victim_okay: bool,
+    adversary_substrings: Optional[Sequence[str]],
+    victim_substrings: Optional[Sequence[str]],
+    cache_dir: Optional[pathlib.Path],
+    columns: Optional[Sequence[str]],
+    game_filter: Optional[game_info.GameFilter],
+) -> Tuple[pathlib.Path, Dict[str, Any], List[str]]:
+    """Fill in defaults. Returns the cache directory, parse params and columns."""
+    if adversary_substrings is None:
+        adversary_substrings = game_info.DEFAULT_ADVERSARY_SUBSTRINGS
+    if victim_substrings is None:
+        victim_substrings = game_info.DEFAULT_VICTIM_SUBSTRINGS
+    cache_dir = pathlib.Path(cache_dir or DEFAULT_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    columns = tables.table_schema(fast_parse, columns).names
+    params = _parse_params(
+        no_victim_okay, adversary_substrings, victim_substrings, game_filter, columns
+    )
+    return cache_dir, params, columns
+
+
+def update_cache(
+    paths: Sequence[pathlib.Path],
+    fast_parse: bool = False,
+    processes: Optional[int] = 128,
+    no_victim_okay: bool = False,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+    columns: Optional[Sequence[str]] = None,
+    game_filter: Optional[game_info.GameFilter] = None,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    cancel_event: Optional[threading.Event] = None,
+    on_updated: Optional[Callable[[pathlib.Path], None]] = None,
+) -> None:
+    """Parse the files in `paths` that lack an up-to-date cache entry.
+
+    Args:
+        on_updated: Called with each path once its entry is up to date:
+            straight away for files that were already cached, then for the
+            others as they are parsed.
+        Other args: See `read_and_parse_all_files_cached`.
+    """
+    cache_dir, params, columns = _cache_args(
+        fast_parse,
+        no_victim_okay,
+        adversary_substrings,
+        victim_substrings,
+        cache_dir,
+        columns,
+        game_filter,
+    )
+    stale_paths = []
+    for path in paths:
+        if not is_cache_entry_valid(path, cache_dir, params):
+            stale_paths.append(path)
+        elif on_updated is not None:
+            on_updated(path)
+    logger.info(
+        "Parsing %d of %d SGF files not in the cache", len(stale_paths), len(paths)
+    )
+    if stale_paths:
+        parse_and_cache_partial = functools.partial(
+            _parse_and_cache_file, cache_dir=cache_dir, params=params
+        )
+        if not processes:
+            processes = min(128, len(stale_paths) // 2)
+        processes = max(processes, 1)
+        with game_info.borrow_pool(pool, processes) as pool:
+            _map_cancellable(
+                pool,
+                parse_and_cache_partial,
+                stale_paths,
+                cancel_event,
+                processes,
+                on_updated,
+            )
+
+
+def _read_cached_table(
+    path: pathlib.Path,
+    cache_dir: pathlib.Path,
+    params: Dict[str, Any],
+    columns: Sequence[str],
+) -> pa.Table:
+    return pq.read_table(
+        cache_path(path, cache_dir, params), columns=columns, memory_map=True
+    ).replace_schema_metadata()
+
+
+def _iter_cached_tables(
+    path: pathlib.Path,
+    cache_dir: pathlib.Path,
+    params: Dict[str, Any],
+    columns: Sequence[str],
+    batch_size: int,
+) -> Iterator[pa.Table]:
+    """The entry for `path`, `batch_size` games at a time, reading only `columns`."""
+    entry = pq.ParquetFile(cache_path(path, cache_dir, params), memory_map=True)
+    for batch in entry.iter_batches(batch_size=batch_size, columns=columns):
+        yield pa.Table.from_batches([batch]).replace_schema_metadata()
+
+
+def iter_cached_batches(
+    paths: Sequence[pathlib.Path],
+    fast_parse: bool = False,
+    no_victim_okay: bool = False,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+    columns: Optional[Sequence[str]] = None,
+    game_filter: Optional[game_info.GameFilter] = None,
+    batch_size: int = 65536,
+    wait_for: Optional[Callable[[pathlib.Path], None]] = None,
+) -> Iterator[pa.RecordBatch]:
+    """Yield the cached games of `paths` as record batches, in the order of `paths`.
+
+    Entries are read a batch at a time, so only about one batch is held in
+    memory.
+    Every file must have a cache entry by the time it is read; see
+    `update_cache`.
+
+    Args:
+        batch_size: Number of games per batch. Only the last batch may be
+            smaller.
+        wait_for: If set, called with each path before its entry is read, e.g.
+            to wait for an `update_cache` running in another thread to get to
+            it. This lets batches be sent on while later files are still being
+            parsed.
+        Other args: See `read_and_parse_all_files_cached`.
+
+    Yields:
+        Record batches with schema `tables.table_schema(fast_parse, columns)`.
+    """
+    cache_dir, params, columns = _cache_args(
+        fast_parse,
+        no_victim_okay,
+        adversary_substrings,
+        victim_substrings,
+        cache_dir,
+        columns,
+        game_filter,
+    )
+
+    def read_tables() -> Iterator[pa.Table]:
+        for path in paths:
+            if wait_for is not None:
+                wait_for(path)
+            yield from _iter_cached_tables(path, cache_dir, params, columns, batch_size)
+
+    yield from tables.rebatch(
+        read_tables(), tables.table_schema(fast_parse, columns), batch_size
+    )
+
+
+def read_and_parse_all_files_cached(
+    paths: Sequence[pathlib.Path],
+    fast_parse: bool = False,
+    processes: Optional[int] = 128,
+    no_victim_okay: bool = False,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+    columns: Optional[Sequence[str]] = None,
+    game_filter: Optional[game_info.GameFilter] = None,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> pd.DataFrame:
+    """Like `game_info.read_and_parse_all_files`, but reuses cached results.
+
+    Only files without an up-to-date cache entry are parsed (in parallel, with
+    each worker writing its own entry). The cached tables are then memory-mapped
+    and concatenated without copying before the final conversion to pandas.
+
+    Args:
+        paths: Paths of the sgf files to parse.
+        fast_parse: See `game_info.parse_game_str_to_dict`.
+        processes: Number of worker processes used for parsing uncached files.
+        no_victim_okay: See `game_info.parse_game_str_to_dict`.
+        adversary_substrings: See `game_info.parse_game_str_to_dict`.
+        victim_substrings: See `game_info.parse_game_str_to_dict`.
+        cache_dir: Directory holding the cache. Defaults to `DEFAULT_CACHE_DIR`.
+        columns: See `game_info.parse_game_str_to_dict`. Only these columns
+            are read from the cache, but files missing from it are parsed with
+            every column (see `_entry_columns`).
+        game_filter: See `game_info.parse_game_str_to_dict`. Entries for
+            different filters are cached separately.
+        pool: If set, parse in this (possibly shared) pool instead of starting
+            one. `processes` should then be its number of workers, which
+            bounds how many tasks are queued on it. See `new_worker_pool`.
+        cancel_event: If set, stop parsing and raise `ParseCancelled` soon after
+            it is set. Files that were already parsed stay cached.
+
+    Returns:
+        DataFrame with one row per game.
+    """
+    update_cache(
+        paths,
+        fast_parse=fast_parse,
+        processes=processes,
+        no_victim_okay=no_victim_okay,
+        adversary_substrings=adversary_substrings,
+        victim_substrings=victim_substrings,
+        cache_dir=cache_dir,
+        columns=columns,
+        game_filter=game_filter,
+        pool=pool,
+        cancel_event=cancel_event,
+    )
+    cache_dir, params, columns = _cache_args(
+        fast_parse,
+        no_victim_okay,
+        adversary_substrings,
+        victim_substrings,
+        cache_dir,
+        columns,
+        game_filter,
+    )
+    cached_tables: List[pa.Table] = [
+        _read_cached_table(path, cache_dir, params, columns) for path in paths
+    ]
+    if not cached_tables:
+        return pd.DataFrame()
+    table = tables.concat_tables(cached_tables)
+    return tables.table_to_dataframe(table, fast_parse=fast_parse)
@@ -0,0 +1,227 @@
+"""Filter, group and aggregate parsed games without holding them all in memory.
+
+A `Query` is a small, picklable description of what to compute, e.g. adversary
+win rates by training steps. `run_query` works through the games one frame or
+record batch at a time, keeping only per-group partial sums, so the parsing
+server can answer a query from its cache and send back only the aggregated
+frame.
+
+Requires pyarrow and pandas, which `game_info` itself does not depend on.
+"""
+
+import statistics
+from typing import (
+    Any,
+    Collection,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from sgf_parser import tables
+
+# Aggregates a `Query` can ask for, and the columns of the result they produce
+# for a column `c`. "wilson" is the Wilson score interval of the mean of a 0/1
+# (or bool) column, e.g. a win rate.
+AGGREGATES = {
+    "count": ("{}_count",),
+    "sum": ("{}_sum",),
+    "mean": ("{}_mean",),
+    "wilson": ("{}_ci_low", "{}_ci_high"),
+}
+# Column of the result holding the number of games in each group.
+NUM_GAMES = "num_games"
+
+
+class Query(NamedTuple):
+    """Filters, group keys and aggregates to compute over a set of games.
+
+    For example, adversary win rates on 19x19 by training steps, with 95%
+    confidence intervals:
+
+        Query(
+            filters={"board_size": [19]},
+            ranges={"adv_steps": (None, None)},
+            group_by=["adv_steps"],
+            aggregates=[("adv_win", "mean"), ("adv_win", "wilson")],
+        )
+    """
+
+    # Keep only games whose value in each column is one of the given values.
+    # None among the values matches missing values.
+    filters: Optional[Mapping[str, Collection[Any]]] = None
+    # Keep only games whose value in each column is between the given bounds
+    # (inclusive); a bound of None is open. Missing values are never in range,
+    # so (None, None) drops the games where the column is missing.
+    ranges: Optional[Mapping[str, Tuple[Optional[float], Optional[float]]]] = None
+    # Columns to group by. Missing values form their own group. With no
+    # columns, all games that pass the filters form a single group.
+    group_by: Sequence[str] = ()
+    # (column, aggregate) pairs, with aggregates from `AGGREGATES`. Missing
+    # values are left out of every aggregate.
+    aggregates: Sequence[Tuple[str, str]] = ()
+    # Confidence level of "wilson" intervals.
+    confidence: float = 0.95
+
+    def columns(self) -> List[str]:
+        """The columns of the games the query reads, without duplicates."""
+        names = [
+            *(self.filters or {}),
+            *(self.ranges or {}),
+            *self.group_by,
+            *(column for column, _ in self.aggregates),
+        ]
+        return list(dict.fromkeys(names))
+
+    def result_columns(self) -> List[str]:
+        """The columns of `run_query`'s result, other than the group keys."""
+        return [NUM_GAMES] + [
+            name.format(column)
+            for column, aggregate in self.aggregates
+            for name in AGGREGATES[aggregate]
+        ]
+
+    def check(self, available_columns: Collection[str]) -> None:
+        """Raise ValueError unless the query can run on these columns."""
+        unknown_aggregates = {a for _, a in self.aggregates} - set(AGGREGATES)
+        if unknown_aggregates:
+            raise ValueError(f"Unknown aggregates: {sorted(unknown_aggregates)}")
+        missing = [c for c in self.columns() if c not in available_columns]
+        if missing:
+            raise ValueError(f"Columns not available to query: {missing}")
+        if not 0 < self.confidence < 1:
+            raise ValueError(f"Confidence must be in (0, 1): {self.confidence}")
+
+
+def _filter(frame: pd.DataFrame, query: Query) -> pd.DataFrame:
+    keep = pd.Series(True, index=frame.index)
+    for column, values in (query.filters or {}).items():
+        values = list(values)
+        matches = frame[column].isin([v for v in values if v is not None])
+        if None in values:
+            matches |= frame[column].isna()
+        keep &= matches.fillna(False).astype(bool)
+    for column, (low, high) in (query.ranges or {}).items():
+        values = frame[column]
+        in_range = values.notna()
+        if low is not None:
+            in_range &= (values >= low).fillna(False).astype(bool)
+        if high is not None:
+            in_range &= (values <= high).fillna(False).astype(bool)
+        keep &= in_range
+    return frame[keep.to_numpy()]
+
+
+def _summed_columns(query: Query) -> List[str]:
+    return list(
+        dict.fromkeys(c for c, a in query.aggregates if a in ("sum", "mean", "wilson"))
+    )
+
+
+def _partial_sums(frame: pd.DataFrame, query: Query) -> pd.DataFrame:
+    """Per group of `frame`: the number of games, and counts and sums of the
+    aggregated columns, with the group keys as columns."""
+    frame = _filter(frame, query)
+    sums = {NUM_GAMES: np.ones(len(frame), dtype=np.int64)}
+    for column in dict.fromkeys(c for c, _ in query.aggregates):
+        sums[f"{column}_count"] = frame[column].notna().to_numpy(dtype=np.int64)
+    for column in _summed_columns(query):
+        sums[f"{column}_sum"] = frame[column].astype(float).to_numpy()
+    sums = pd.DataFrame(sums)
+    # Categoricals become objects, so that partial sums from frames with
+    # different categories can be combined.
+    for column in query.group_by:
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        sums[column] = values.array
+    return _combine(sums, query)
+
+
+def _combine(sums: pd.DataFrame, query: Query) -> pd.DataFrame:
+    if not query.group_by:
+        return sums.sum().to_frame().T
+    return (
+        sums.groupby(list(query.group_by), dropna=False, sort=False).sum().reset_index()
+    )
+
+
+def _finish(sums: pd.DataFrame, query: Query) -> pd.DataFrame:
+    """Compute the requested aggregates from combined partial sums."""
+    result = pd.DataFrame({NUM_GAMES: sums[NUM_GAMES].astype(np.int64)})
+    z = statistics.NormalDist().inv_cdf((1 + query.confidence) / 2)
+    for column, aggregate in query.aggregates:
+        count = sums[f"{column}_count"].astype(np.int64)
+        if aggregate == "count":
+            result[f"{column}_count"] = count
+            continue
+        total = sums[f"{column}_sum"]
+        if aggregate == "sum":
+            result[f"{column}_sum"] = total
+            continue
+        mean = total / count.where(count > 0)
+        if aggregate == "mean":
+            result[f"{column}_mean"] = mean
+        else:
+            n = count.where(count > 0)
+            center = (mean + z**2 / (2 * n)) / (1 + z**2 / n)
+            half_width = (
+                z
+                / (1 + z**2 / n)
+                * np.sqrt(mean * (1 - mean) / n + z**2 / (4 * n**2))
+            )
+            result[f"{column}_ci_low"] = center - half_width
+            result[f"{column}_ci_high"] = center + half_width
+    if query.group_by:
+        keys = sums[list(query.group_by)]
+        result.index = (
+            pd.MultiIndex.from_frame(keys)
+            if len(query.group_by) > 1
+            else pd.Index(keys.iloc[:, 0])
+        )
+        try:
+            result = result.sort_index()
+        except TypeError:
+            # Keys of mixed types, e.g. "19:13" among board sizes.
+            pass
+    return result
+
+
+def run_query(
+    games: Iterable[Union[pd.DataFrame, pa.RecordBatch]], query: Query
+) -> pd.DataFrame:
+    """Run `query` over games given as a sequence of frames or record batches.
+
+    Only the partial sums of each group are kept between frames, so memory use
+    is bounded by the largest frame rather than the number of games.
+
+    Args:
+        games: DataFrames as returned by `game_info.read_and_parse_all_files`
+            and friends, or record batches such as those from
+            `parse_cache.iter_cached_batches`. They need only have the columns
+            in `query.columns()`.
+        query: What to compute.
+
+    Returns:
+        DataFrame indexed by the values of `query.group_by`, with the columns
+        in `query.result_columns()`. Groups with no games are left out.
+    """
+    total = None
+    for frame in games:
+        if isinstance(frame, pa.RecordBatch):
+            frame = tables.table_to_dataframe(pa.Table.from_batches([frame]))
+        query.check(frame.columns)
+        sums = _partial_sums(frame, query)
+        total = sums if total is None else _combine(pd.concat([total, sums]), query)
+    if total is None:
+        total = _partial_sums(pd.DataFrame(columns=query.columns()), query)
+    return _finish(total, query)
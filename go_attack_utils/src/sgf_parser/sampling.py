@@ -0,0 +1,251 @@
+"""Samples games from large SGF directories without parsing every game in full.
+
+`iter_index` makes one streaming pass over the files and yields an
+`IndexedGame` (path, line number, byte offset and a few header fields) per game.
+Only the root node of each game is tokenized, so this is much cheaper than a
+full parse, and the index never has to fit in memory: `reservoir_sample` and
+`stratified_sample` consume it as it is produced. Passing `cache_dir` reuses
+(and fills) the `parse_cache` entries and line offset indexes instead.
+
+The game itself is only read, by seeking to its offset, once it is sampled:
+
+    games = sampling.iter_index(paths, fields=["adv_steps", "victim_name"])
+    sample = sampling.stratified_sample(games, ["adv_steps", "victim_name"], 5)
+    sgf_str = sample[(1000000, "victim-cp127")][0].game_str()
+"""
+
+import functools
+import multiprocessing
+import pathlib
+import random
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from sgf_parser import game_info
+
+DEFAULT_INDEX_FIELDS = ("adv_steps", "victim_name")
+# Games read from the parse cache at a time by `iter_index`.
+INDEX_BATCH_SIZE = 65536
+
+T = TypeVar("T")
+
+
+class IndexedGame(NamedTuple):
+    """Where to find a game, plus the header fields it was indexed by."""
+
+    path: pathlib.Path
+    line_num: int
+    offset: int
+    # Values of the indexed fields, keyed by `parse_game_str_to_dict` field name.
+    header: Dict[str, Any]
+
+    def game_str(self) -> str:
+        """Read the game from its file."""
+        return game_info.get_game_str_at(self.path, self.offset)
+
+    def link_info(self) -> Dict[str, Any]:
+        """The game's location in the form used by the website's content.ts."""
+        return {"path": str(self.path), "line": self.line_num}
+
+
+def index_file(
+    path: pathlib.Path,
+    fields: Sequence[str] = DEFAULT_INDEX_FIELDS,
+    **kwargs,
+) -> List[IndexedGame]:
+    """Index the games in one file.
+
+    Args:
+        path: The sgf file to read.
+        fields: Fields of `game_info.parse_game_str_to_dict` to keep for each
+            game. Fields derived from the root node alone (player names, steps,
+            board size, result, ...) are cheap; move counts need a scan of the
+            moves.
+        kwargs: See `game_info.read_and_parse_lines`.
+    """
+    parsed = game_info.read_and_parse_lines(
+        path, columns=["sgf_line", *fields], **kwargs
+    )
+    indexed = []
+    for game in parsed.games:
+        line_num = game.pop("sgf_line")
+        indexed.append(
+            IndexedGame(path, line_num, parsed.line_offsets[line_num - 1], game)
+        )
+    return indexed
+
+
+def _iter_cached_index(
+    paths: Sequence[pathlib.Path],
+    fields: Sequence[str],
+    cache_dir: pathlib.Path,
+    processes: Optional[int],
+    **kwargs,
+) -> Iterator[IndexedGame]:
+    # Imported here so that indexing without a cache doesn't need pandas and
+    # pyarrow.
+    import pandas as pd
+    import pyarrow as pa
+
+    from sgf_parser import parse_cache, tables
+
+    columns = ["sgf_path", "sgf_line", *fields]
+    parse_cache.update_cache(
+        paths, columns=columns, cache_dir=cache_dir, processes=processes, **kwargs
+    )
+    offsets = {}
+    # Only the indexed columns are read, a batch at a time.
+    for batch in parse_cache.iter_cached_batches(
+        paths,
+        columns=columns,
+        cache_dir=cache_dir,
+        batch_size=INDEX_BATCH_SIZE,
+        **kwargs,
+    ):
+        df = tables.table_to_dataframe(pa.Table.from_batches([batch]))
+        values = {
+            field: [None if pd.isna(v) else v for v in df[field].astype(object)]
+            for field in fields
+        }
+        path_strs = df["sgf_path"].astype(object).tolist()
+        line_nums = df["sgf_line"].astype(int).tolist()
+        for i, (path_str, line_num) in enumerate(zip(path_strs, line_nums)):
+            if path_str not in offsets:
+                offsets[path_str] = parse_cache.load_line_offsets(
+                    pathlib.Path(path_str), cache_dir
+                )
+            yield IndexedGame(
+                pathlib.Path(path_str),
+                line_num,
+                int(offsets[path_str][line_num - 1]),
+                {field: column[i] for field, column in values.items()},
+            )
+
+
+def iter_index(
+    paths: Sequence[pathlib.Path],
+    fields: Sequence[str] = DEFAULT_INDEX_FIELDS,
+    processes: Optional[int] = 16,
+    no_victim_okay: bool = True,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    game_filter: Optional[game_info.GameFilter] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+) -> Iterator[IndexedGame]:
+    """Index every game in `paths`, in order, one file at a time.
+
+    Args:
+        paths: Paths of the sgf files to index.
+        fields: See `index_file`.
+        processes: Number of worker processes indexing files concurrently.
+        cache_dir: If set, index through `parse_cache` with this cache
+            directory: files that are already cached with `fields` aren't read
+            at all. Cached field values are typed like the columns of
+            `parse_cache.read_and_parse_all_files_cached` (e.g. steps such as
+            "1m" are normalized to integers).
+        Other args: See `game_info.parse_game_str_to_dict`.
+    """
+    kwargs = dict(
+        no_victim_okay=no_victim_okay,
+        adversary_substrings=adversary_substrings,
+        victim_substrings=victim_substrings,
+        game_filter=game_filter,
+    )
+    if cache_dir is not None:
+        yield from _iter_cached_index(paths, fields, cache_dir, processes, **kwargs)
+        return
+
+    if not processes:
+        processes = min(16, len(paths) // 2)
+    index_file_partial = functools.partial(index_file, fields=fields, **kwargs)
+    with multiprocessing.Pool(processes=max(processes, 1)) as pool:
+        for indexed in pool.imap(index_file_partial, paths):
+            yield from indexed
+
+
+def reservoir_sample(
+    items: Iterable[T], k: int, rng: Optional[random.Random] = None
+) -> List[T]:
+    """Uniformly sample `k` items (or all, if fewer) in a single pass.
+
+    Memory use is O(k) however many items there are. The sample is in the
+    order the items were seen.
+    """
+    rng = rng or random.Random()
+    reservoir: List[T] = []
+    positions: List[int] = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+            positions.append(i)
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                reservoir[j] = item
+                positions[j] = i
+    return [item for _, item in sorted(zip(positions, reservoir), key=lambda x: x[0])]
+
+
+def _stratum_key(
+    by: Union[str, Sequence[str], Callable[[IndexedGame], Hashable]]
+) -> Callable[[IndexedGame], Hashable]:
+    if callable(by):
+        return by
+    if isinstance(by, str):
+        return lambda game: game.header[by]
+    fields = tuple(by)
+    return lambda game: tuple(game.header[field] for field in fields)
+
+
+def stratified_sample(
+    games: Iterable[IndexedGame],
+    by: Union[str, Sequence[str], Callable[[IndexedGame], Hashable]],
+    k: int,
+    rng: Optional[random.Random] = None,
+) -> Dict[Hashable, List[IndexedGame]]:
+    """Uniformly sample `k` games from every stratum in a single pass.
+
+    Args:
+        games: Games to sample from, e.g. from `iter_index`.
+        by: What defines a stratum: an indexed field, a sequence of fields (the
+            stratum is then the tuple of their values), or a function of the
+            game. Games for which the function returns None are skipped.
+        k: Number of games to sample per stratum. Strata with fewer games are
+            returned in full.
+        rng: Source of randomness, for reproducible samples.
+
+    Returns:
+        The sample of each stratum, in the order the games were seen.
+    """
+    rng = rng or random.Random()
+    key = _stratum_key(by)
+    seen: Dict[Hashable, int] = {}
+    reservoirs: Dict[Hashable, List[IndexedGame]] = {}
+    for game in games:
+        stratum = key(game)
+        if stratum is None:
+            continue
+        i = seen.get(stratum, 0)
+        seen[stratum] = i + 1
+        if i < k:
+            reservoirs.setdefault(stratum, []).append(game)
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                reservoirs[stratum][j] = game
+    return {
+        stratum: sorted(reservoir, key=lambda game: (game.path, game.line_num))
+        for stratum, reservoir in reservoirs.items()
+    }
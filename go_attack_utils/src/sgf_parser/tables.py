@@ -0,0 +1,373 @@
+"""Columnar (Arrow) representation of parsed games.
+
+Requires pyarrow and pandas, which `game_info` itself does not depend on.
+"""
+
+import contextlib
+import functools
+import multiprocessing
+import multiprocessing.pool
+import os
+import pathlib
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from sgf_parser import game_info
+
+# Strings with few distinct values (names, colors, rules, paths), stored
+# dictionary-encoded so that each distinct value is stored (and pickled) once.
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+# Columns that `parse_game_str_to_dict` fills with values from `extract_re` and
+# friends, which are ints when the matched text is decimal and strings
+# otherwise. They are stored as strings and converted back when loaded.
+STR_OR_INT = "str_or_int"
+
+# Arrow type (or STR_OR_INT) of every column `parse_game_str_to_dict` returns,
+# in the order it returns them. Values of int64 columns are converted with
+# `to_int`.
+FAST_PARSE_COLUMNS: Dict[str, Any] = {
+    "b_name": CATEGORY,
+    "w_name": CATEGORY,
+    "b_visits": pa.int64(),
+    "w_visits": pa.int64(),
+    "victim_color": CATEGORY,
+    "victim_name": CATEGORY,
+    "victim_visits": pa.int64(),
+    "victim_steps": pa.int64(),
+    "victim_rsym": pa.int64(),
+    "victim_algo": CATEGORY,
+    "adv_color": CATEGORY,
+    "adv_name": CATEGORY,
+    "adv_visits": pa.int64(),
+    "adv_steps": pa.int64(),
+    "adv_samples": pa.int64(),
+    "adv_rsym": pa.int64(),
+    "adv_algo": CATEGORY,
+    "win_color": CATEGORY,
+    "win_name": CATEGORY,
+    "lose_name": CATEGORY,
+    "adv_win": pa.bool_(),
+    "komi": pa.float64(),
+    "adv_komi": pa.float64(),
+    "adv_minus_victim_score": pa.float64(),
+    "adv_minus_victim_score_wo_komi": pa.float64(),
+    "train_status": CATEGORY,
+    # Usually an int, but "19:13" for rectangular boards.
+    "board_size": STR_OR_INT,
+    "start_turn_idx": pa.int64(),
+    "handicap": pa.int64(),
+    "num_moves": pa.int64(),
+    "ko_rule": CATEGORY,
+    "score_rule": CATEGORY,
+    "tax_rule": CATEGORY,
+    "sui_legal": pa.bool_(),
+    "has_button": pa.bool_(),
+    # Either the default "0" or the text following "whb" in the rules.
+    "whb": CATEGORY,
+    "fpok": pa.bool_(),
+    "init_turn_num": pa.int64(),
+    "used_initial_position": pa.bool_(),
+    "gtype": CATEGORY,
+    "is_continuation": pa.bool_(),
+    "is_resignation": pa.bool_(),
+    "sgf_path": CATEGORY,
+    "sgf_line": pa.int64(),
+}
+FULL_PARSE_COLUMNS: Dict[str, Any] = {
+    **FAST_PARSE_COLUMNS,
+    "num_b_pass": pa.int64(),
+    "num_w_pass": pa.int64(),
+    "num_adv_pass": pa.int64(),
+    "num_victim_pass": pa.int64(),
+}
+# Returned by `parse_game_str_to_dict` with `include_move_stats`, and only part
+# of tables when asked for through `columns`.
+MOVE_STATS_COLUMNS: Dict[str, Any] = {
+    "num_b_moves": pa.int64(),
+    "num_w_moves": pa.int64(),
+    "first_pass_turn": pa.int64(),
+    "num_trailing_passes": pa.int64(),
+    "num_adv_moves": pa.int64(),
+    "num_victim_moves": pa.int64(),
+}
+# Every column a table can have.
+ALL_COLUMNS: Dict[str, Any] = {**FULL_PARSE_COLUMNS, **MOVE_STATS_COLUMNS}
+
+
+def _columns(
+    fast_parse: bool, columns: Optional[Sequence[str]] = None
+) -> Dict[str, Any]:
+    """Types of the columns of tables parsed with these arguments, by name.
+
+    See `game_info.parse_game_str_to_dict` for `columns`.
+    """
+    if columns is None:
+        return FAST_PARSE_COLUMNS if fast_parse else FULL_PARSE_COLUMNS
+    unknown = [name for name in columns if name not in ALL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+    return {name: ALL_COLUMNS[name] for name in columns}
+
+
+def _stored_type(column_type: Any) -> pa.DataType:
+    return pa.string() if column_type is STR_OR_INT else column_type
+
+
+def table_schema(
+    fast_parse: bool, columns: Optional[Sequence[str]] = None
+) -> pa.Schema:
+    """Arrow schema of tables of parsed games."""
+    return pa.schema(
+        [
+            (name, _stored_type(column_type))
+            for name, column_type in _columns(fast_parse, columns).items()
+        ]
+    )
+
+
+def to_int(value: Union[str, int, None]) -> Optional[int]:
+    """Convert a count such as a number of steps or visits to an int.
+
+    Accepts ints, decimal strings like "-1" (the default visits) and counts of
+    millions like "1m" (from victim names such as victim-s1m.bin.gz). Anything
+    else becomes None.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if value.endswith("m") and value[:-1].isdecimal():
+        return int(value[:-1]) * 1_000_000
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def records_to_table(
+    records: Sequence[Dict[str, Any]],
+    fast_parse: bool = False,
+    columns: Optional[Sequence[str]] = None,
+) -> pa.Table:
+    """Convert the output of `read_and_parse_file` to an Arrow table."""
+    arrays = []
+    for name, column_type in _columns(fast_parse, columns).items():
+        values = [record[name] for record in records]
+        if column_type == pa.int64():
+            arrays.append(pa.array([to_int(x) for x in values], type=pa.int64()))
+        elif column_type is STR_OR_INT or column_type == CATEGORY:
+            array = pa.array(
+                [None if x is None else str(x) for x in values], type=pa.string()
+            )
+            if column_type == CATEGORY:
+                array = array.dictionary_encode()
+            arrays.append(array)
+        else:
+            arrays.append(pa.array(values, type=column_type))
+    return pa.Table.from_arrays(arrays, schema=table_schema(fast_parse, columns))
+
+
+def _str_or_int_to_pandas(column: pa.ChunkedArray) -> pd.Series:
+    """Undo the stringification of a STR_OR_INT column.
+
+    Mirrors `extract_re`: decimal strings become ints, anything else stays a
+    string. Columns without any non-decimal string become numeric columns.
+    """
+    # See `_int_to_pandas`.
+    column = column.combine_chunks()
+    is_decimal = pc.utf8_is_decimal(column)
+    if pc.all(pc.fill_null(is_decimal, True)).as_py():
+        return column.cast(pa.int64()).to_pandas()
+    values = column.to_numpy(zero_copy_only=False)
+    mask = pc.fill_null(is_decimal, False).to_numpy(zero_copy_only=False)
+    if mask.any():
+        values[mask] = [int(x) for x in values[mask]]
+    return pd.Series(values, dtype=object)
+
+
+def _int_to_pandas(column: pa.ChunkedArray) -> pd.Series:
+    """Convert an int64 column to a nullable Int64 Series, without going through
+    floats (which would round large step counts)."""
+    # ChunkedArray.to_numpy takes no arguments in older pyarrow (e.g. 9.0).
+    column = column.combine_chunks()
+    values = pc.fill_null(column, 0).to_numpy()
+    mask = column.is_null().to_numpy(zero_copy_only=False)
+    return pd.Series(pd.arrays.IntegerArray(values, mask))
+
+
+def _column_to_pandas(column: pa.ChunkedArray, column_type: Any) -> pd.Series:
+    if column_type is STR_OR_INT:
+        return _str_or_int_to_pandas(column)
+    if column_type == CATEGORY:
+        # Dictionary arrays become pandas categoricals.
+        return column.to_pandas()
+    if column_type == pa.int64():
+        return _int_to_pandas(column)
+    if column_type == pa.float64():
+        # Komi and scores are multiples of 0.5, which float32 holds exactly.
+        return pc.cast(column, pa.float32()).to_pandas()
+    return column.to_pandas()
+
+
+def table_to_dataframe(table: pa.Table, fast_parse: bool = False) -> pd.DataFrame:
+    """Convert a table of parsed games to a DataFrame.
+
+    CATEGORY columns become categoricals, int64 columns become nullable Int64,
+    float columns become float32, and bool columns stay bool.
+    """
+    return pd.DataFrame(
+        {
+            name: _column_to_pandas(table.column(name), ALL_COLUMNS[name])
+            for name in table.column_names
+        }
+    )
+
+
+def concat_tables(tables: Sequence[pa.Table]) -> pa.Table:
+    """Concatenate tables of parsed games without copying.
+
+    Each table keeps its own dictionaries for CATEGORY columns; they are only
+    unified when the result is combined into contiguous arrays.
+    """
+    return pa.concat_tables(tables)
+
+
+def _combine(table: pa.Table) -> pa.Table:
+    """Copy `table` into a single chunk, unifying CATEGORY dictionaries."""
+    return table.unify_dictionaries().combine_chunks()
+
+
+# Workers hand their tables to the parent as Arrow IPC files in this directory
+# rather than pickling them through the pool's pipes. A RAM-backed filesystem
+# means neither side ever touches the disk.
+DEFAULT_TRANSPORT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+@contextlib.contextmanager
+def _transport_dir() -> Iterator[str]:
+    with tempfile.TemporaryDirectory(
+        prefix="sgf_parser_", dir=DEFAULT_TRANSPORT_DIR
+    ) as directory:
+        yield directory
+
+
+def _write_ipc(table: pa.Table, directory: str) -> str:
+    """Write `table` to a new Arrow IPC file in `directory` and return its path."""
+    fd, ipc_path = tempfile.mkstemp(suffix=".arrow", dir=directory)
+    with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, table.schema) as writer:
+        writer.write_table(table)
+    return ipc_path
+
+
+def _read_ipc(ipc_path: str) -> pa.Table:
+    """Memory-map a table written by `_write_ipc`, then delete the file.
+
+    The table's buffers point into the mapping, which outlives the file name, so
+    nothing is copied and the memory is freed once the table is dropped.
+    """
+    with pa.memory_map(ipc_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    os.unlink(ipc_path)
+    return table
+
+
+def _read_and_parse_file_to_ipc(
+    path: pathlib.Path, transport_dir: str, **kwargs
+) -> str:
+    table = records_to_table(
+        game_info.read_and_parse_file(path, **kwargs),
+        fast_parse=kwargs["fast_parse"],
+        columns=kwargs["columns"],
+    )
+    return _write_ipc(table, transport_dir)
+
+
+def iter_parsed_batches(
+    paths: Sequence[pathlib.Path],
+    batch_size: int = 65536,
+    fast_parse: bool = False,
+    processes: Optional[int] = 128,
+    no_victim_okay: bool = False,
+    adversary_substrings: Optional[Sequence[str]] = None,
+    victim_substrings: Optional[Sequence[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    game_filter: Optional[game_info.GameFilter] = None,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+) -> Iterator[pa.RecordBatch]:
+    """Parse all files in `paths`, yielding the games as Arrow record batches.
+
+    Unlike `game_info.read_and_parse_all_files`, the games are never held as one
+    big list of dicts: each worker converts its file to a compact Arrow table,
+    written to an Arrow IPC file in shared memory that the parent memory-maps
+    without copying or unpickling any games, and the tables are re-chunked into
+    batches as files finish. Batches come out in the order files finish parsing,
+    not in the order of `paths`.
+
+    Args:
+        paths: Paths of the sgf files to parse.
+        batch_size: Number of games per batch. Only the last batch may be
+            smaller.
+        processes: Number of worker processes.
+        pool: See `game_info.read_and_parse_all_files`.
+        Other args: See `game_info.parse_game_str_to_dict`.
+
+    Yields:
+        Record batches with schema `table_schema(fast_parse, columns)`.
+    """
+    if adversary_substrings is None:
+        adversary_substrings = game_info.DEFAULT_ADVERSARY_SUBSTRINGS
+    if victim_substrings is None:
+        victim_substrings = game_info.DEFAULT_VICTIM_SUBSTRINGS
+
+    if not processes:
+        processes = min(128, len(paths) // 2)
+    with _transport_dir() as transport_dir, game_info.borrow_pool(
+        pool, max(processes, 1)
+    ) as pool:
+        read_and_parse_file_partial = functools.partial(
+            _read_and_parse_file_to_ipc,
+            transport_dir=transport_dir,
+            fast_parse=fast_parse,
+            no_victim_okay=no_victim_okay,
+            adversary_substrings=adversary_substrings,
+            victim_substrings=victim_substrings,
+            columns=columns,
+            game_filter=game_filter,
+        )
+        yield from rebatch(
+            map(
+                _read_ipc,
+                pool.imap_unordered(read_and_parse_file_partial, paths),
+            ),
+            table_schema(fast_parse, columns),
+            batch_size,
+        )
+
+
+def rebatch(
+    tables: Iterable[pa.Table], schema: pa.Schema, batch_size: int = 65536
+) -> Iterator[pa.RecordBatch]:
+    """Re-chunk a stream of tables into record batches of `batch_size` games.
+
+    Tables are consumed lazily, so only about one batch's worth of games is held
+    at a time. Only the last batch may be smaller than `batch_size`.
+    """
+    pending = pa.Table.from_batches([], schema=schema)
+    for table in tables:
+        pending = concat_tables([pending, table])
+        while pending.num_rows >= batch_size:
+            yield from _combine(pending.slice(0, batch_size)).to_batches()
+            pending = pending.slice(batch_size)
+    if pending.num_rows > 0:
+        yield from _combine(pending).to_batches()
+
+
+def batches_to_dataframe(
+    batches: Sequence[pa.RecordBatch], fast_parse: bool = False
+) -> pd.DataFrame:
+    """Convert batches from `iter_parsed_batches` to a single DataFrame."""
+    if not batches:
+        return pd.DataFrame()
+    return table_to_dataframe(pa.Table.from_batches(batches), fast_parse=fast_parse)
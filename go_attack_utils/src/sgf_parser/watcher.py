@@ -0,0 +1,314 @@
+"""Tracks which SGF files under a directory are new or have grown.
+
+`SgfWatcher` keeps the size and mtime of every SGF file under a root (as found
+by `file_scan.scan_sgf_files`) and tells subscribers when files are created,
+appended to, rewritten or deleted, so they can pick up new games without
+rescanning and reparsing the whole tree.
+
+Where the `watchdog` package is installed and the filesystem supports it
+(inotify on Linux), changes are picked up as soon as they happen. Otherwise, for
+example over NFS where inotify never fires for writes made on other machines,
+the tree is polled every `poll_interval` seconds; the directory listing cache
+in `file_scan` keeps each poll cheap. A full poll also runs at that interval
+when inotify is in use, in case events were missed.
+"""
+
+import fnmatch
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+from sgf_parser import file_scan
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+CREATED = "created"
+APPENDED = "appended"
+REWRITTEN = "rewritten"
+DELETED = "deleted"
+
+logger = logging.getLogger(__name__)
+
+
+class SgfChange(NamedTuple):
+    """A change to an SGF file. `size` is 0 for deleted files."""
+
+    path: pathlib.Path
+    kind: str
+    old_size: int
+    size: int
+
+
+class _FileState(NamedTuple):
+    size: int
+    mtime_ns: int
+
+
+def _classify(old: Optional[_FileState], new: Optional[_FileState]) -> Optional[str]:
+    if old == new:
+        return None
+    if old is None:
+        return CREATED
+    if new is None:
+        return DELETED
+    # Shrinking or rewriting in place can't be told apart from appending by
+    # size and mtime alone, so only growth counts as appending.
+    return APPENDED if new.size > old.size else REWRITTEN
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Forwards watchdog events for SGF files and directories to a watcher."""
+
+    def __init__(self, watcher: "SgfWatcher"):
+        super().__init__()
+        self._watcher = watcher
+
+    def on_any_event(self, event) -> None:
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self._watcher._mark_dirty(os.fsdecode(path), event.is_directory)
+
+
+class SgfWatcher:
+    """Watches a directory tree for new and growing SGF files.
+
+    Usage:
+        with SgfWatcher(root) as watcher:
+            watcher.subscribe(lambda changes: print(changes))
+            ...
+            sgf_paths = watcher.paths()
+    """
+
+    def __init__(
+        self,
+        root: pathlib.Path,
+        poll_interval: float = 30.0,
+        use_inotify: Optional[bool] = None,
+        pruned_dir_patterns: Sequence[str] = file_scan.DEFAULT_PRUNED_DIR_PATTERNS,
+        debounce: float = 1.0,
+    ):
+        """Constructs a watcher. Nothing is scanned until `start` or `poll`.
+
+        Args:
+            root: Directory to watch (recursively).
+            poll_interval: Seconds between full rescans of the tree.
+            use_inotify: Whether to listen for filesystem events with watchdog.
+                Defaults to whether watchdog is installed.
+            pruned_dir_patterns: See `file_scan.scan_sgf_files`.
+            debounce: Seconds to wait after a filesystem event for more events
+                before handling them, so that a burst of appends to one file is
+                reported once.
+        """
+        if use_inotify is None:
+            use_inotify = Observer is not None
+        if use_inotify and Observer is None:
+            raise ImportError("use_inotify=True requires the watchdog package")
+        self.root = pathlib.Path(root)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.pruned_dir_patterns = pruned_dir_patterns
+        self.debounce = debounce
+
+        self._files: Dict[pathlib.Path, _FileState] = {}
+        self._subscribers: List[Callable[[List[SgfChange]], None]] = []
+        self._lock = threading.Lock()
+        self._dirty_files: Set[str] = set()
+        self._dirty_dirs: Set[str] = set()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+
+    def __enter__(self) -> "SgfWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def subscribe(
+        self, callback: Callable[[List[SgfChange]], None]
+    ) -> Callable[[], None]:
+        """Call `callback` with each non-empty batch of changes.
+
+        Callbacks run on the watcher's thread and must not block for long.
+
+        Returns:
+            A function that unsubscribes `callback`.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def files(self) -> Dict[pathlib.Path, int]:
+        """Sizes of the SGF files currently known to exist, by path."""
+        with self._lock:
+            return {path: state.size for path, state in self._files.items()}
+
+    def paths(self) -> List[pathlib.Path]:
+        """Sorted paths of the SGF files currently known to exist."""
+        with self._lock:
+            return sorted(self._files)
+
+    def start(self) -> None:
+        """Scan the tree once, then keep watching it on a background thread."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        if self.use_inotify:
+            # Start listening before the initial scan so nothing falls in
+            # between.
+            self._observer = Observer()
+            self._observer.schedule(
+                _EventHandler(self), os.fspath(self.root), recursive=True
+            )
+            self._observer.start()
+        self.poll()
+        self._thread = threading.Thread(
+            target=self._run, name=f"SgfWatcher({self.root})", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching. Known files are kept."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self) -> List[SgfChange]:
+        """Rescan the whole tree now and notify subscribers of any changes."""
+        found = file_scan.scan_sgf_files(
+            self.root, pruned_dir_patterns=self.pruned_dir_patterns
+        )
+        current = {f.path: _FileState(f.size, f.mtime_ns) for f in found}
+        with self._lock:
+            paths = set(self._files) | set(current)
+        return self._update(paths, current)
+
+    def _is_pruned(self, path: str) -> bool:
+        relative_parts = pathlib.Path(path).relative_to(self.root).parts
+        return any(
+            fnmatch.fnmatchcase(part, pattern)
+            for part in relative_parts[:-1]
+            for pattern in self.pruned_dir_patterns
+        )
+
+    def _mark_dirty(self, path: str, is_directory: bool) -> None:
+        """Called from the watchdog thread for every filesystem event."""
+        try:
+            if self._is_pruned(path):
+                return
+        except ValueError:
+            return
+        if is_directory:
+            with self._lock:
+                self._dirty_dirs.add(path)
+        elif path.endswith(file_scan.SGF_SUFFIXES):
+            with self._lock:
+                self._dirty_files.add(path)
+        else:
+            return
+        self._wakeup.set()
+
+    def _handle_dirty(self) -> List[SgfChange]:
+        """Re-stat the files and rescan the directories events were seen for."""
+        with self._lock:
+            dirty_files, self._dirty_files = self._dirty_files, set()
+            dirty_dirs, self._dirty_dirs = self._dirty_dirs, set()
+        paths = {pathlib.Path(path) for path in dirty_files}
+        current: Dict[pathlib.Path, _FileState] = {}
+        for directory in map(pathlib.Path, dirty_dirs):
+            # A directory that was created, moved in or deleted: compare every
+            # file known or found under it.
+            with self._lock:
+                paths.update(p for p in self._files if directory in p.parents)
+            for f in file_scan.scan_sgf_files(
+                directory, pruned_dir_patterns=self.pruned_dir_patterns
+            ):
+                current[f.path] = _FileState(f.size, f.mtime_ns)
+                paths.add(f.path)
+        for path in paths - set(current):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = _FileState(stat.st_size, stat.st_mtime_ns)
+        return self._update(paths, current)
+
+    def _update(
+        self, paths: Set[pathlib.Path], current: Dict[pathlib.Path, _FileState]
+    ) -> List[SgfChange]:
+        """Diff the known state of `paths` against `current` and notify.
+
+        Paths in `paths` that are missing from `current` no longer exist.
+        """
+        changes = []
+        with self._lock:
+            for path in sorted(paths):
+                old = self._files.get(path)
+                new = current.get(path)
+                kind = _classify(old, new)
+                if kind is None:
+                    continue
+                changes.append(
+                    SgfChange(
+                        path,
+                        kind,
+                        old.size if old else 0,
+                        new.size if new else 0,
+                    )
+                )
+                if new is None:
+                    del self._files[path]
+                else:
+                    self._files[path] = new
+            subscribers = list(self._subscribers)
+        if changes:
+            for callback in subscribers:
+                callback(changes)
+        return changes
+
+    def _run(self) -> None:
+        last_poll = time.monotonic()
+        while not self._stopping.is_set():
+            # Events keep coming while files are being written, so wait no
+            # longer than until the next poll is due.
+            woken = self._wakeup.wait(
+                max(0.0, last_poll + self.poll_interval - time.monotonic())
+            )
+            if self._stopping.is_set():
+                break
+            try:
+                if woken:
+                    self._wakeup.clear()
+                    # Let a burst of events settle before handling it.
+                    self._stopping.wait(self.debounce)
+                    self._handle_dirty()
+                if time.monotonic() - last_poll >= self.poll_interval:
+                    # Before polling, so that a failing poll isn't retried
+                    # straight away.
+                    last_poll = time.monotonic()
+                    self.poll()
+            except Exception:
+                # Keep watching; the next poll picks up anything missed.
+                logger.exception("Failed to check for changes under %s", self.root)
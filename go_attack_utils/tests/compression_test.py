@@ -0,0 +1,25 @@
+import pytest
+from sgf_parser import compression
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_read_range_of_seekable_file(tmp_path, write_games, suffix):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    src = write_games("games.sgfs", 100)
+    contents = src.read_bytes()
+    dest = tmp_path / f"games.sgfs{suffix}"
+    compression.write_seekable(src, dest, block_bytes=1000)
+    blocks = compression.block_index(dest)
+    assert len(blocks) > 5
+    assert all(block.size is not None for block in blocks)
+
+    for start, stop in [(0, 1), (2500, 2600), (len(contents) - 10, None)]:
+        data, base = compression.read_range(dest, start, stop)
+        assert base <= start
+        end = base + len(data)
+        assert data == contents[base:end]
+        # Every line starting in the range is read in full.
+        stop_or_end = len(contents) if stop is None else stop
+        last_needed = contents.index(b"\n", stop_or_end - 1) + 1
+        assert end >= last_needed
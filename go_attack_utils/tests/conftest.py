@@ -0,0 +1,33 @@
+import pytest
+
+
+def _game_line(adv_steps):
+    """A short but complete game on one line, without the trailing newline.
+
+    The adversary's name holds `adv_steps`, so that each game can be told apart
+    after parsing.
+    """
+    return (
+        f"(;FF[4]GM[1]SZ[19]PB[adv-s{adv_steps}-v600]PW[bot-cp505-v1]HA[0]KM[7]"
+        "RU[koPOSITIONALscoreAREAtaxNONEsui1]RE[B+R]C[startTurnIdx=0]"
+        ";B[dd];W[pp];B[];W[])"
+    )
+
+
+@pytest.fixture
+def game_line():
+    return _game_line
+
+
+@pytest.fixture
+def write_games(tmp_path):
+    """Returns a function writing one game per line, numbered from `first`."""
+
+    def write(name, num_games, first=1):
+        path = tmp_path / name
+        path.write_text(
+            "".join(_game_line(i) + "\n" for i in range(first, first + num_games))
+        )
+        return path
+
+    return write
@@ -0,0 +1,30 @@
+from sgf_parser import compression, game_info
+
+
+def test_chunked_parse_numbers_lines_per_file(tmp_path, write_games):
+    first = write_games("first.sgfs", 60)
+    second = write_games("second.sgfs", 45, first=1000)
+    compressed = tmp_path / "third.sgfs.gz"
+    compression.write_seekable(
+        write_games("third.sgfs", 50, first=2000), compressed, block_bytes=1000
+    )
+    paths = [first, second, compressed]
+    # Several chunks per file, most of them starting in the middle of a line.
+    chunks = game_info.split_into_chunks(paths, 1000)
+    assert len(chunks) > 3 * len(paths)
+
+    games = game_info.read_and_parse_all_files(paths, processes=2, chunk_bytes=1000)
+
+    assert [(g["sgf_path"], g["sgf_line"], g["adv_steps"]) for g in games] == (
+        [(str(first), i, i) for i in range(1, 61)]
+        + [(str(second), i, 999 + i) for i in range(1, 46)]
+        + [(str(compressed), i, 1999 + i) for i in range(1, 51)]
+    )
+
+
+def test_get_game_str_with_offsets(write_games, game_line):
+    path = write_games("games.sgfs", 5)
+    offsets = game_info.line_offsets(path)
+
+    assert game_info.get_game_str(path, 4, offsets=offsets) == game_line(4) + "\n"
+    assert game_info.get_game_str(path, 6, offsets=offsets) is None
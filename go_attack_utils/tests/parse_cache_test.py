@@ -0,0 +1,44 @@
+from sgf_parser import parse_cache
+
+COLUMNS = ["sgf_line", "adv_steps"]
+
+
+def parse_cached(path, cache_dir):
+    df = parse_cache.read_and_parse_all_files_cached(
+        [path], processes=1, cache_dir=cache_dir, columns=COLUMNS
+    )
+    return list(zip(df.sgf_line.tolist(), df.adv_steps.tolist()))
+
+
+def test_resume_from_partial_trailing_line(tmp_path, write_games, game_line):
+    cache_dir = tmp_path / "cache"
+    path = write_games("games.sgfs", 2)
+    line = game_line(3)
+    # A game that is still being written is left for later.
+    with open(path, "a") as f:
+        f.write(line[:40])
+    assert parse_cached(path, cache_dir) == [(1, 1), (2, 2)]
+
+    # A complete game without its newline is parsed, but parsed again on resume.
+    with open(path, "a") as f:
+        f.write(line[40:])
+    assert parse_cached(path, cache_dir) == [(1, 1), (2, 2), (3, 3)]
+
+    with open(path, "a") as f:
+        f.write("\n" + game_line(4) + "\n")
+    assert parse_cached(path, cache_dir) == [(1, 1), (2, 2), (3, 3), (4, 4)]
+
+
+def test_get_game_str_from_offsets_index(tmp_path, write_games, game_line):
+    cache_dir = tmp_path / "cache"
+    path = write_games("games.sgfs", 3)
+    parse_cached(path, cache_dir)
+    assert parse_cache.offsets_index_path(path, cache_dir).exists()
+    assert parse_cache.get_game_str(path, 2, cache_dir) == game_line(2) + "\n"
+
+    # The index grows with the file when parsing resumes.
+    with open(path, "a") as f:
+        f.write(game_line(4) + "\n")
+    parse_cached(path, cache_dir)
+    assert parse_cache.get_game_str(path, 4, cache_dir) == game_line(4) + "\n"
+    assert parse_cache.get_game_str(path, 5, cache_dir) is None
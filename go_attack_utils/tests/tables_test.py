@@ -0,0 +1,57 @@
+import pyarrow as pa
+from sgf_parser import tables
+
+# Run with `pytest` from go_attack_utils, with the package installed (`pip
+# install -e .`) next to the pyarrow and pandas pinned in
+# streamlit_app/requirements.txt: the conversions must not rely on ChunkedArray
+# methods or arguments that only newer versions have.
+COLUMNS = ["adv_steps", "board_size", "victim_name", "komi", "adv_win"]
+
+
+def chunked_table(*record_lists):
+    """A table with one chunk per list of records, like the concatenation of
+    several cache entries."""
+    table = tables.concat_tables(
+        [tables.records_to_table(records, columns=COLUMNS) for records in record_lists]
+    )
+    assert table.column("adv_steps").num_chunks == len(record_lists)
+    return table
+
+
+def game(adv_steps, board_size):
+    return {
+        "adv_steps": adv_steps,
+        "board_size": board_size,
+        "victim_name": "bot-cp505-v1",
+        "komi": 6.5,
+        "adv_win": True,
+    }
+
+
+def test_int_columns_from_several_chunks():
+    table = chunked_table([game(1, 19), game(None, 19)], [game(2**60 + 1, 19)])
+    df = tables.table_to_dataframe(table)
+    assert str(df.adv_steps.dtype) == "Int64"
+    assert df.adv_steps.isna().tolist() == [False, True, False]
+    assert df.adv_steps[2] == 2**60 + 1
+    assert df.board_size.tolist() == [19, 19, 19]
+
+
+def test_str_or_int_columns_from_several_chunks():
+    table = chunked_table([game(1, 19)], [game(2, "19:13"), game(3, None)])
+    df = tables.table_to_dataframe(table)
+    assert df.board_size[0] == 19
+    assert df.board_size[1] == "19:13"
+    assert df.board_size[2] is None
+
+
+def test_empty_table():
+    table = tables.table_schema(False, COLUMNS).empty_table()
+    assert tables.table_to_dataframe(table).empty
+
+
+def test_batches_to_dataframe():
+    batches = chunked_table([game(1, 19)], [game(2, 19)]).to_batches()
+    df = tables.batches_to_dataframe(batches)
+    assert df.adv_steps.tolist() == [1, 2]
+    assert isinstance(pa.Table.from_batches(batches), pa.Table)
@@ -3,13 +3,13 @@
 import os
 import pathlib
 import re
-from typing import Dict, Iterable, List, Tuple, TypeVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker
 import pandas as pd
 
-from sgf_parser import game_info
+from sgf_parser import game_info, tables
 
 T = TypeVar("T")
 
@@ -44,6 +44,10 @@ def import_plt_sty(sty_file: str) -> None:
 
 def parse_for_match(df: pd.DataFrame, adv_name_regex: str = "adv") -> None:
     """Adds additional useful info to a dataframe of match SGFs."""
+    # These are categoricals, which can't be assigned values outside their
+    # categories.
+    for col in ["adv_name", "adv_color", "victim_name", "victim_color"]:
+        df[col] = df[col].astype(object)
     adv_is_black = df.b_name.str.contains(adv_name_regex, regex=True)
     adv_is_white = df.w_name.str.contains(adv_name_regex, regex=True)
     victim_is_black = ~adv_is_black
@@ -69,20 +73,23 @@ def parse_for_match(df: pd.DataFrame, adv_name_regex: str = "adv") -> None:
 def parse_sgfs(
     paths: Iterable[str],
     no_victim_okay: bool = True,
+    columns: Optional[Sequence[str]] = None,
 ) -> pd.DataFrame:
-    """Parses a list of paths into a dataframe of SGFs."""
-    game_infos = flatten_2d_list(
-        [
-            game_info.read_and_parse_all_files(
+    """Parses a list of paths into a dataframe of SGFs.
+
+    If `columns` is given, only those fields are parsed.
+    """
+    batches = []
+    for path in paths:
+        batches.extend(
+            tables.iter_parsed_batches(
                 game_info.find_sgf_files(pathlib.Path(path)),
                 fast_parse=True,
                 no_victim_okay=no_victim_okay,
+                columns=columns,
             )
-            for path in paths
-        ]
-    )
-    df = pd.DataFrame(game_infos)
-    return df
+        )
+    return tables.batches_to_dataframe(batches, fast_parse=True)
 
 
 def get_victim_active_ranges(df: pd.DataFrame) -> Dict[str, Tuple[int, int]]:
@@ -12,6 +12,18 @@ Run:
 - `python prepare_data/prepare_data.py`, from KataGoVisualizer/sgf-viewer directory, to run the script.
 """
 
+# Fields used below and by the game list in the viewer (see GameList.svelte).
+GAME_INFO_COLUMNS = [
+    "victim_color",
+    "win_color",
+    "adv_win",
+    "adv_minus_victim_score",
+    "num_moves",
+    "is_resignation",
+    "sgf_path",
+    "sgf_line",
+]
+
 
 def run_cmd(cmd, shell=False, dry_run=False):
     print(
@@ -97,6 +109,7 @@ if __name__ == "__main__":
                 fast_parse=True,
                 adversary_substrings=adversary_substrings,
                 victim_substrings=victim_substrings,
+                columns=GAME_INFO_COLUMNS,
             )
             if len(parsed_games) != games_count:
                 print(
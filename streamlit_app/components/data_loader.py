@@ -1,17 +1,20 @@
 import streamlit as st
 import pandas as pd
 import tbparse
+import pyarrow as pa
 from components.dtale_table import delete_dtale_instance
 from pathlib import Path
 import os
 from multiprocessing.connection import Client
 from components.subcomponents.directory_picker import st_directory_picker
 from tensorboard import manager as tb_manager
+from sgf_parser import tables
 
-FAST_PARSE_STATE = "fast_parse"
 DATA_LOAD_ARGS_STATE = "data_load_args"
 TBPARSE_EVENT_TYPES_STATE = "tbparse_event_types_state"
 TBPARSE_ARGS_STATE = "tbparse_args"
+# Games shown while the rest of a reply is still arriving.
+PREVIEW_ROWS = 10
 TBPARSE_EVENT_TYPES = [
     "scalars",
     "tensors",
@@ -27,44 +30,114 @@ MOUNT_DIR, READ_DIR = Path(os.environ["MOUNT_DIR"]), Path(os.environ["READ_DIR"]
 state = st.session_state
 
 
-@st.experimental_memo(max_entries=10)
-def load_and_parse_data(data_source, fast_parse):
+def receive_reply(conn, on_batch=None):
+    """Receive a reply from the parsing-server.
+
+    Args:
+        conn: Connection the request was sent on.
+        on_batch: If set, called with each record batch of games as it arrives.
+            Batches are not kept otherwise, so the memory the reply takes is
+            whatever `on_batch` holds on to.
+
+    Returns:
+        The result sent after the games (the number of games, or a query's
+        DataFrame). Raises the error sent by the server instead, if any.
+    """
+    while True:
+        message = conn.recv_bytes()
+        if not message:
+            break
+        if on_batch:
+            for batch in pa.ipc.open_stream(message):
+                on_batch(batch)
+    error, result = conn.recv()
+    if error:
+        raise error
+    return result
+
+
+def send_request(request, on_batch=None):
     """
     Send a request across the Docker netork to the parsing-server.
     Errors in the parsing-server will be sent in the response and displayed in the UI.
     """
-    delete_dtale_instance()  # Each DataFrame has a new Dtale instance
     address = ("localhost", 6536)
-    conn = Client(address, authkey=b"secret password")
-    conn.send((data_source, fast_parse))
-    print(f"Sent request: data_source={data_source}, fast_parse={fast_parse}")
-    error, df = conn.recv()
-    conn.close()
-    if error:
-        raise error
-    else:
-        print(f"Received reply with {len(df.index)} rows")
+    # The server cancels the request if the connection is closed before the
+    # reply arrives, unless another client is waiting for the same data.
+    with Client(address, authkey=b"secret password") as conn:
+        conn.send(request)
+        print(f"Sent request: {request}")
+        return receive_reply(conn, on_batch=on_batch)
+
+
+@st.experimental_memo(max_entries=10, suppress_st_warning=True)
+def load_and_parse_data(data_source, _on_progress=None):
+    """
+    Load every game in `data_source`. The reply is streamed in batches, and
+    `_on_progress` is called with the number of games received so far and the
+    first batch after each one arrives.
+    """
+    delete_dtale_instance()  # Each DataFrame has a new Dtale instance
+    # The dashboard needs every game in one DataFrame, so the whole reply is
+    # kept, as compact Arrow batches until the single conversion at the end.
+    batches = []
+    num_received = 0
+
+    def on_batch(batch):
+        nonlocal num_received
+        batches.append(batch)
+        num_received += batch.num_rows
+        if _on_progress:
+            _on_progress(num_received, batches[0])
+
+    # Always the full parse, which costs little more than a fast one.
+    num_rows = send_request((data_source, False), on_batch=on_batch)
+    df = tables.batches_to_dataframe(batches)
+    assert len(df.index) == num_rows, f"Received {len(df.index)} of {num_rows} rows"
+    print(f"Received reply with {len(df.index)} rows")
     return df
 
 
+@st.experimental_memo(max_entries=50)
+def query_data(data_source, query):
+    """
+    Run an `sgf_parser.query.Query` on the games in `data_source` in the
+    parsing-server, which sends back only the aggregated DataFrame.
+    """
+    result = send_request((data_source, False, query))
+    print(f"Received query result with {len(result.index)} groups")
+    return result
+
+
+def show_progress(placeholder):
+    """An `_on_progress` callback that shows the games received so far in `placeholder`."""
+
+    def on_progress(num_rows, first_batch):
+        with placeholder.container():
+            st.markdown(f"Received {num_rows} games so far...")
+            st.dataframe(first_batch.slice(0, PREVIEW_ROWS).to_pandas())
+
+    return on_progress
+
+
 def data_loader():
     data_source = st_directory_picker(label="Data source")
 
-    data_load_col_1, data_load_col_2, data_load_col_3, _ = st.columns([1, 1, 1, 2])
-    data_load_col_2.checkbox("Fast parse", value=True, key=FAST_PARSE_STATE)
-    if state[FAST_PARSE_STATE]:
-        st.info(
-            "Fast parse does not include the columns 'num_b_pass', 'num_w_pass', 'num_adv_pass', 'num_victim_pass', 'b_name' and 'w_name'."
-        )
+    data_load_col_1, data_load_col_2, _ = st.columns([1, 1, 3])
 
     df = pd.DataFrame()
-    data_load_args = {"data_source": data_source, "fast_parse": state[FAST_PARSE_STATE]}
+    data_load_args = {"data_source": data_source}
     if data_load_col_1.button("Load data"):
         state[DATA_LOAD_ARGS_STATE] = data_load_args
     if state.get(DATA_LOAD_ARGS_STATE):
-        df = load_and_parse_data(**state.data_load_args)
-    if data_load_col_3.button("Clear cache"):
+        progress = st.empty()
+        df = load_and_parse_data(
+            **state.data_load_args, _on_progress=show_progress(progress)
+        )
+        progress.empty()
+    if data_load_col_2.button("Clear cache"):
         load_and_parse_data.clear()
+        query_data.clear()
 
     tb_col_1, tb_col_2 = st.columns([1, 3])
     state[TBPARSE_EVENT_TYPES_STATE] = (
@@ -7,6 +7,7 @@ from dtale.query import build_query, handle_predefined, run_query
 import streamlit.components.v1 as components
 from streamlit.scriptrunner import get_script_run_ctx
 from components.subcomponents.go_board import go_board
+from sgf_parser import parse_cache
 import hashlib
 
 SGF_ROW_STATE = "sgf_row"
@@ -85,14 +86,18 @@ def dtale_table_and_go_board(df, lower_step, upper_step):
         global_state.set_settings(dtale_data_id, state[DTALE_SETTINGS_STATE])
         kill_dtale_session_on_session_end()
 
-    # Apply adv_steps filter (set by user on graph slider)
+    # Apply adv_steps filter (set by user on graph slider, None if there was
+    # nothing to plot)
     state[DTALE_SETTINGS_STATE] = global_state.get_settings(dtale_data_id)
-    state[DTALE_SETTINGS_STATE]["columnFilters"]["adv_steps"] = {
-        "operand": "[]",
-        "min": lower_step,
-        "max": upper_step,
-        "query": f"`adv_steps` >= {lower_step} and `adv_steps` <= {upper_step}",
-    }
+    if lower_step is None:
+        state[DTALE_SETTINGS_STATE]["columnFilters"].pop("adv_steps", None)
+    else:
+        state[DTALE_SETTINGS_STATE]["columnFilters"]["adv_steps"] = {
+            "operand": "[]",
+            "min": lower_step,
+            "max": upper_step,
+            "query": f"`adv_steps` >= {lower_step} and `adv_steps` <= {upper_step}",
+        }
     global_state.set_settings(dtale_data_id, state[DTALE_SETTINGS_STATE])
 
     df = dtale_instance.data
@@ -118,12 +123,10 @@ def dtale_table_and_go_board(df, lower_step, upper_step):
         if state[SGF_ROW_STATE] <= len(df.index):
             game_to_view_path = df.iloc[state[SGF_ROW_STATE] - 1]["sgf_path"]
             game_to_view_line = df.iloc[state[SGF_ROW_STATE] - 1]["sgf_line"]
-            game_to_view_str = ""
-            with open(game_to_view_path, "r") as f:
-                for i, line in enumerate(f):
-                    if i + 1 == game_to_view_line:
-                        game_to_view_str = line
-                        break
+            game_to_view_str = (
+                parse_cache.get_game_str(game_to_view_path, int(game_to_view_line))
+                or ""
+            )
 
             st.subheader(f"Viewing game on row {int(state[SGF_ROW_STATE]) - 1}")
             go_board(game_to_view_str)
@@ -1,7 +1,6 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from itertools import product
+from sgf_parser.query import Query, run_query
 
 MAX_LINES_ON_GRAPH = 100
 
@@ -11,7 +10,6 @@ PLOT_SEPERATE_ATTRIBUTES_STATE = "plot_seperate_attributes"
 
 def win_rate_by_adv_steps_graph_filter(df):
     df19 = df[df.board_size == 19]
-    win_rate_df = pd.DataFrame(index=sorted(df19.adv_steps.unique()))
 
     st.markdown("#")
     st.subheader("Filter by adversary training steps")
@@ -24,32 +22,38 @@ def win_rate_by_adv_steps_graph_filter(df):
         format_func=lambda x: x.replace("_", " ").title(),
         key=PLOT_SEPERATE_ATTRIBUTES_STATE,
     )
+    # Plotting separately by adv_steps, the x axis, would give one point per line.
+    cols = [c for c in cols if c != "adv_steps"]
+    # Group by all the attributes at once rather than filtering the games once
+    # per combination of values. Missing values get their own line.
+    win_rate_query = Query(
+        filters={"board_size": [19]},
+        ranges={"adv_steps": (None, None)},
+        group_by=[*cols, "adv_steps"],
+        aggregates=[("adv_win", "mean")],
+    )
+    # The games are already loaded, so grouping them here is quicker than a
+    # round trip to the parsing server.
+    result = run_query([df], win_rate_query)
+    if result.empty:
+        st.warning("No 19x19 games with adversary training steps to plot.")
+        return None, None
+    win_rates = result.adv_win_mean * 100
+    if cols:
+        win_rate_df = win_rates.unstack(list(range(len(cols))))
+    else:
+        win_rate_df = win_rates.to_frame()
     try:
-        cartesian_product = list(sorted(product(*[df19[c].unique() for c in cols])))
+        win_rate_df = win_rate_df[sorted(win_rate_df.columns)]
     except TypeError:
-        cartesian_product = list(product(*[df19[c].unique() for c in cols]))
-    line_count = 0
-    for i in cartesian_product:
-        # Surround only string values with quotes
-        query = " & ".join(
-            [
-                (c + " == " + str([v]).strip("[]")) if v or v == 0 else f"{c}.isnull()"
-                for c, v in zip(cols, i)
-            ]
+        pass
+    win_rate_df = win_rate_df.iloc[:, :MAX_LINES_ON_GRAPH]
+    win_rate_df.columns = [
+        ", ".join(
+            f"{c}: {v}" for c, v in zip(cols, key if isinstance(key, tuple) else (key,))
         )
-        if line_count < MAX_LINES_ON_GRAPH:
-            df19_filtered = df19.query(query)
-            if len(df19_filtered) > 0:
-                line_count += 1
-                win_rate_df = win_rate_df.join(
-                    df19_filtered.groupby("adv_steps")
-                    .mean(True)[["adv_win"]]
-                    .rename(
-                        {"adv_win": ", ".join([f"{c}: {v}" for c, v in zip(cols, i)])},
-                        axis=1,
-                    )
-                    * 100,
-                )
+        for key in win_rate_df.columns
+    ]
 
     # Define plotly graph
     px_fig = px.line(
@@ -65,7 +69,7 @@ def win_rate_by_adv_steps_graph_filter(df):
         yaxis_title="Win rate %",
     )
 
-    min_step, max_step = win_rate_df.index.min().item(), win_rate_df.index.max().item()
+    min_step, max_step = int(win_rate_df.index.min()), int(win_rate_df.index.max())
     if min_step < max_step:
         min_step, max_step = st.slider(
             label="",
@@ -7,8 +7,8 @@ df19["victim_name_v2"] = (
     + df19.victim_visits.astype("str")
 )
 
-min_dict = df19[["victim_name_v2", "adv_steps"]].groupby("victim_name_v2").min().adv_steps
-max_dict = df19[["victim_name_v2", "adv_steps"]].groupby("victim_name_v2").max().adv_steps
+min_dict = df19.groupby("victim_name_v2").adv_steps.min()
+max_dict = df19.groupby("victim_name_v2").adv_steps.max()
 
 victim_ranges = {{}}
 for v in df19.victim_name_v2.unique():
@@ -29,24 +29,18 @@ WIN_RATE_VICTIM_RANGES = """
 plt.subplot({nrows}, {ncols}, {next_plot_idx})
 ALPHA = 0.05
 df19['adv_win_perc'] = df.adv_win * 100
-for i, v in enumerate(sorted(df19.victim_steps.unique())):
+for i, v in enumerate(sorted(df19.victim_steps.dropna().unique())):
+    victim_df = df19[df19.victim_steps == v]
     ax = (
-        df19[df19.victim_steps == v]
+        victim_df
         .groupby("adv_steps")
-        .mean(True)
-        .adv_win_perc
+        .adv_win_perc.mean()
         .plot(label='%.1f' % (v / 1e9))
     )
-    victim_df = df19[df19.victim_steps == v]
-    df_confint = victim_df.groupby("adv_steps").mean(True)
-    conf_df = df_confint.apply(
-        lambda x: proportion_confint(
-            len(victim_df[(victim_df.adv_steps == x.name) & (victim_df.adv_win)]),
-            len(victim_df[victim_df.adv_steps == int(x.name)]),
-            alpha=ALPHA),
-        axis=1, result_type='expand')
-    plt.fill_between(df_confint.index, conf_df[0] * 100, conf_df[1] * 100, alpha=0.3)
-    plt.axvline(x=df_confint.index[0], ls=':', lw=1)
+    win_counts = victim_df.groupby("adv_steps").adv_win.agg(["sum", "count"])
+    lo, hi = proportion_confint(win_counts["sum"], win_counts["count"], alpha=ALPHA)
+    plt.fill_between(win_counts.index, lo * 100, hi * 100, alpha=0.3)
+    plt.axvline(x=win_counts.index[0], ls=':', lw=1)
 
 plt.ylabel(r"Adversary win rate \%")
 plt.xlabel("Adversary training steps")
@@ -59,12 +53,12 @@ for i, v in enumerate(sorted(df19.victim_name_v2.unique())):
     ax = (
         df19[(df19.adv_color == "b") & (df19.victim_name_v2 == v)]
         .groupby("adv_steps")
-        .mean(True)
-        .adv_win.plot(label="adv = black" if i == 0 else "_")
+        .adv_win.mean()
+        .plot(label="adv = black" if i == 0 else "_")
     )
     df19[(df19.adv_color == "w") & (df19.victim_name_v2 == v)].groupby(
         "adv_steps"
-    ).mean(True).adv_win.plot(
+    ).adv_win.mean().plot(
         linestyle="--",
         color=ax.lines[-1].get_color(),
         label="adv = white" if i == 0 else "_",
@@ -76,10 +70,10 @@ plt.legend()
 
 WIN_RATE = """
 plt.subplot({nrows}, {ncols}, {next_plot_idx})
-df19[df19.adv_color == "b"].groupby("adv_steps").mean(True).adv_win.plot(
+df19[df19.adv_color == "b"].groupby("adv_steps").adv_win.mean().plot(
     label="adv = black"
 )
-df19[df19.adv_color == "w"].groupby("adv_steps").mean(True).adv_win.plot(
+df19[df19.adv_color == "w"].groupby("adv_steps").adv_win.mean().plot(
     label="adv = white"
 )
 plt.ylabel("Win rate")
@@ -89,10 +83,10 @@ plt.legend()
 
 GAME_COUNT = """
 plt.subplot({nrows}, {ncols}, {next_plot_idx})
-df19[df19.adv_color == "b"].groupby("adv_steps").count().adv_win.plot(
+df19[df19.adv_color == "b"].groupby("adv_steps").adv_win.count().plot(
     label="adv = black"
 )
-df19[df19.adv_color == "w"].groupby("adv_steps").count().adv_win.plot(
+df19[df19.adv_color == "w"].groupby("adv_steps").adv_win.count().plot(
     label="adv = white"
 )
 plt.ylabel(r"\# of games")
@@ -102,10 +96,10 @@ plt.legend()
 
 SCORE_EVOLUTION_MEDIAN = """
 plt.subplot({nrows}, {ncols}, {next_plot_idx})
-df19[df19.adv_color == "b"].groupby("adv_steps").median().adv_minus_victim_score.plot(
+df19[df19.adv_color == "b"].groupby("adv_steps").adv_minus_victim_score.median().plot(
     label="adv = black"
 )
-df19[df19.adv_color == "w"].groupby("adv_steps").median().adv_minus_victim_score.plot(
+df19[df19.adv_color == "w"].groupby("adv_steps").adv_minus_victim_score.median().plot(
     label="adv = white"
 )
 plt.ylabel("adv_minus_victim_score")
@@ -115,10 +109,10 @@ plt.legend()
 
 NUM_MOVES_EVOLUTION_MEDIAN = """
 plt.subplot({nrows}, {ncols}, {next_plot_idx})
-df19[df19.adv_color == "b"].groupby("adv_steps").median().num_moves.plot(
+df19[df19.adv_color == "b"].groupby("adv_steps").num_moves.median().plot(
     label="adv = black"
 )
-df19[df19.adv_color == "w"].groupby("adv_steps").median().num_moves.plot(
+df19[df19.adv_color == "w"].groupby("adv_steps").num_moves.median().plot(
     label="adv = white"
 )
 plt.ylabel("num_moves")
@@ -130,7 +124,7 @@ SCORE_EVOLUTION = """
 ax = plt.subplot({nrows}, {ncols}, {next_plot_idx}, projection="3d")
 hist_3d(
     df19,
-    ts=np.sort(df19.adv_steps.unique())[:-2],
+    ts=np.sort(df19.adv_steps.dropna().unique())[:-2],
     t_key="adv_steps",
     v_key="adv_minus_victim_score",
     ax=ax,
@@ -143,7 +137,7 @@ NUM_MOVES_EVOLUTION = """
 ax = plt.subplot({nrows}, {ncols}, {next_plot_idx}, projection="3d")
 hist_3d(
     df19,
-    ts=np.sort(df19.adv_steps.unique())[:-2],
+    ts=np.sort(df19.adv_steps.dropna().unique())[:-2],
     t_key="adv_steps",
     v_key="num_moves",
     ax=ax,
@@ -181,7 +175,7 @@ def hist_3d(
     # calculate now the histogram and plot it for each column
     for i, t in enumerate(ts):
         # extract the current column from your df by its number
-        col = df[df[t_key] == t][v_key]
+        col = df[df[t_key] == t][v_key].dropna().astype(float)
 
         # determine the histogram values, here you have to adapt it to your needs
         histvals, edges = np.histogram(col, bins=bins, density=True)
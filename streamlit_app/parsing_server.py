@@ -1,32 +1,423 @@
-from sgf_parser import game_info
+from sgf_parser import parse_cache, tables, watcher
+from sgf_parser import query as sgf_query
+import result_cache
 
 import os
+import collections
+import logging
+import threading
 import traceback
 import atexit
+import concurrent.futures
+import multiprocessing
 from timeit import default_timer as timer
 from multiprocessing.connection import Listener
-import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 
 MOUNT_DIR, READ_DIR = Path(os.environ["MOUNT_DIR"]), Path(os.environ["READ_DIR"])
+ADDRESS = ("localhost", 6536)
+# Worker processes shared by all requests. See
+# go_attack_utils/benchmarks/pool_overhead_benchmark.py for what keeping them
+# around saves per request.
+PARSING_PROCESSES = min(128, os.cpu_count() or 1)
+# Requests handled at the same time. Others wait for a free slot.
+MAX_CONCURRENT_REQUESTS = 8
+# Seconds between checks for whether a waiting client has disconnected.
+DISCONNECT_POLL_INTERVAL = 0.5
+# Games per message of a reply.
+BATCH_SIZE = 65536
+# Bytes of replies kept in RAM to answer repeat requests at once, and where to
+# spill replies evicted from RAM (unset to drop them) with its own budget. See
+# result_cache.py.
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 4 * 2**30))
+RESULT_CACHE_SPILL_DIR = os.environ.get("RESULT_CACHE_SPILL_DIR")
+RESULT_CACHE_SPILL_BYTES = int(os.environ.get("RESULT_CACHE_SPILL_BYTES", 32 * 2**30))
 
+# One watcher per directory that has been requested, so that repeat requests
+# get the current list of SGF files without rescanning the tree.
+sgf_watchers = {}
+# Futures of the watchers still doing their first scan, which can take minutes
+# on a large tree. Requests for other directories don't wait for it.
+starting_sgf_watchers = {}
+sgf_watchers_lock = threading.Lock()
+# Number of batches of changes each watcher has seen, to key cached replies.
+sgf_generations = collections.Counter()
 
-def load_and_parse_games(path: str, fast_parse: bool = False):
+
+def log_changes(changes):
+    new_files = sum(change.kind == watcher.CREATED for change in changes)
+    print(f"{len(changes)} SGF files changed ({new_files} new)")
+
+
+def count_changes(container_path: Path):
+    def callback(changes):
+        # Only the watcher's own thread calls this.
+        sgf_generations[container_path] += 1
+
+    return callback
+
+
+def get_sgf_watcher(container_path: Path) -> watcher.SgfWatcher:
+    with sgf_watchers_lock:
+        if container_path in sgf_watchers:
+            return sgf_watchers[container_path]
+        future = starting_sgf_watchers.get(container_path)
+        if future is None:
+            future = concurrent.futures.Future()
+            starting_sgf_watchers[container_path] = future
+            starting = True
+        else:
+            starting = False
+    if not starting:
+        # Raises if starting the watcher failed.
+        return future.result()
+
+    try:
+        sgf_watcher = watcher.SgfWatcher(container_path)
+        # Before starting, so that no change goes uncounted.
+        sgf_watcher.subscribe(count_changes(container_path))
+        sgf_watcher.start()
+        sgf_watcher.subscribe(log_changes)
+    except BaseException as e:
+        # The next request for the directory tries again.
+        with sgf_watchers_lock:
+            del starting_sgf_watchers[container_path]
+        future.set_exception(e)
+        raise
+    with sgf_watchers_lock:
+        sgf_watchers[container_path] = sgf_watcher
+        del starting_sgf_watchers[container_path]
+    future.set_result(sgf_watcher)
+    return sgf_watcher
+
+
+def get_container_path(path: str) -> Path:
+    return MOUNT_DIR / Path(path).relative_to(READ_DIR)
+
+
+def reply_cache_key(data_source: str, fast_parse: bool, query):
+    """Key of the reply to a request in the result cache.
+
+    Includes the number of changes seen to the directory's SGF files, so that a
+    reply is reused only until a file in the directory changes. The count is
+    read before the job lists the files, so a reply can only be newer than its
+    key.
+    """
+    container_path = get_container_path(data_source)
+    get_sgf_watcher(container_path)
+    return (
+        str(container_path.resolve()),
+        fast_parse,
+        sgf_generations[container_path],
+        None if query is None else repr(query),
+    )
+
+
+def update_games_cache(
+    job: "ParseJob", path: str, fast_parse: bool = False, pool=None
+) -> None:
     if not path:
-        return pd.DataFrame()
-    container_path = MOUNT_DIR / Path(path).relative_to(READ_DIR)
-    sgf_paths = game_info.find_sgf_files(container_path)
+        job.set_sgf_paths([])
+        return
+    container_path = get_container_path(path)
+    sgf_paths = get_sgf_watcher(container_path).paths()
     print(f"Found {len(sgf_paths)} SGF files in {container_path}")
-    parsed_dicts = game_info.read_and_parse_all_files(
-        sgf_paths, fast_parse=fast_parse, processes=min(128, len(sgf_paths) // 2)
+    job.set_sgf_paths(sgf_paths)
+    parse_cache.update_cache(
+        sgf_paths,
+        fast_parse=fast_parse,
+        processes=PARSING_PROCESSES,
+        pool=pool,
+        cancel_event=job.cancel_event,
+        on_updated=job.mark_updated,
     )
-    return pd.DataFrame(parsed_dicts)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its reply was sent."""
+
+
+class ParseJob:
+    """Brings the parse cache up to date for a request.
+
+    Shared by all clients that sent the request. Each client streams its reply
+    from the cache, file by file, as soon as the job has updated each file.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.cancel_event = threading.Event()
+        self.num_clients = 0
+        self.future = None
+        self.sgf_paths = None
+        self.updated_paths = set()
+        self.condition = threading.Condition()
+
+    def set_sgf_paths(self, sgf_paths) -> None:
+        with self.condition:
+            self.sgf_paths = sgf_paths
+            self.condition.notify_all()
+
+    def mark_updated(self, sgf_path: Path) -> None:
+        with self.condition:
+            self.updated_paths.add(sgf_path)
+            self.condition.notify_all()
+
+    def notify_done(self) -> None:
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self, predicate, conn) -> None:
+        """Wait until `predicate()` holds.
+
+        Raises the job's error if it fails first, or `ClientDisconnected` if the
+        client on `conn` disconnects first (clients send nothing after the
+        request, so any data or EOF on `conn` counts as a disconnect).
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: predicate() or self.future.done(),
+                    timeout=DISCONNECT_POLL_INTERVAL,
+                )
+                if predicate():
+                    return
+                if self.future.done():
+                    # Raises the job's error. A job that succeeded has
+                    # satisfied every predicate clients wait for.
+                    self.future.result()
+                    return
+            if conn.poll():
+                raise ClientDisconnected()
+
+
+class RequestDispatcher:
+    """Runs parse jobs on a thread pool, sharing one process pool between them.
+
+    Identical requests that arrive while a job is in flight share it instead of
+    parsing again. A job is cancelled once every client waiting for it has
+    disconnected.
+    """
+
+    def __init__(self, parsing_processes: int, max_concurrent_requests: int):
+        # Started once, with the parser already imported, and reused by every
+        # request.
+        self.pool = parse_cache.new_worker_pool(parsing_processes)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_requests, thread_name_prefix="request"
+        )
+        self.in_flight = {}
+        # Reentrant, because a job that finishes immediately runs its done
+        # callback while `join` holds the lock.
+        self.lock = threading.RLock()
+
+    def join(self, data_source, fast_parse) -> ParseJob:
+        """Start a job for the request, or attach to an identical one in flight."""
+        key = (data_source, fast_parse)
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is None:
+                job = ParseJob(key)
+                job.future = self.executor.submit(
+                    update_games_cache,
+                    job,
+                    data_source,
+                    fast_parse=fast_parse,
+                    pool=self.pool,
+                )
+                self.in_flight[key] = job
+                job.future.add_done_callback(lambda _: self._finish(job))
+            else:
+                print(f"Joined in-flight request: {data_source}")
+            job.num_clients += 1
+            return job
+
+    def leave(self, job: ParseJob) -> None:
+        """Called when a client stops waiting; cancels unwanted jobs."""
+        with self.lock:
+            job.num_clients -= 1
+            if job.num_clients == 0 and not job.future.done():
+                print(f"Cancelling request: {job.key[0]}")
+                job.cancel_event.set()
+                # Identical requests from now on start afresh.
+                if self.in_flight.get(job.key) is job:
+                    del self.in_flight[job.key]
+
+    def _finish(self, job: ParseJob) -> None:
+        with self.lock:
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+        job.notify_done()
+
+    def close(self) -> None:
+        with self.lock:
+            for job in self.in_flight.values():
+                job.cancel_event.set()
+        self.executor.shutdown(wait=False)
+        self.pool.terminate()
+
+
+def batch_message(batch) -> pa.Buffer:
+    """`batch` as an Arrow IPC stream of its own.
+
+    Each message carries its own schema and dictionaries, so the client can
+    decode it without state from earlier messages.
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def wait_for_file(conn, job: ParseJob):
+    """A `wait_for` for `parse_cache.iter_cached_batches` that waits for `job`."""
+    return lambda path: job.wait(lambda: path in job.updated_paths, conn)
+
+
+def stream_reply(conn, job: ParseJob, fast_parse: bool, recorder=None) -> int:
+    """Send the games of `job`'s files to `conn`. Returns the number sent.
+
+    Batches are read from the cache in file order, each file as soon as `job`
+    has updated it, so the client gets the first games while later files are
+    still being parsed, and neither side holds more than a batch in flight
+    (apart from what `recorder`, a `result_cache.ReplyRecorder`, keeps).
+    """
+    job.wait(lambda: job.sgf_paths is not None, conn)
+    num_rows = 0
+    for batch in parse_cache.iter_cached_batches(
+        job.sgf_paths,
+        fast_parse=fast_parse,
+        batch_size=BATCH_SIZE,
+        wait_for=wait_for_file(conn, job),
+    ):
+        message = batch_message(batch)
+        conn.send_bytes(message)
+        if recorder is not None:
+            recorder.add(message)
+        num_rows += batch.num_rows
+    return num_rows
+
+
+def run_query(conn, job: ParseJob, fast_parse: bool, query: sgf_query.Query):
+    """Run `query` over the games of `job`'s files, reading only the columns it
+    needs from the cache, file by file as `job` updates them."""
+    job.wait(lambda: job.sgf_paths is not None, conn)
+    return sgf_query.run_query(
+        parse_cache.iter_cached_batches(
+            job.sgf_paths,
+            fast_parse=fast_parse,
+            columns=query.columns(),
+            batch_size=BATCH_SIZE,
+            wait_for=wait_for_file(conn, job),
+        ),
+        query,
+    )
+
+
+def send_cached_reply(conn, reply: result_cache.CachedReply) -> None:
+    for message in reply.messages():
+        conn.send_bytes(message)
+    send_end(conn, None, reply.result)
+
+
+def handle_connection(
+    conn, dispatcher: RequestDispatcher, reply_cache: result_cache.ResultCache
+):
+    """Serve one request.
+
+    The client sends `(data_source, fast_parse)`, or `(data_source, fast_parse,
+    query)` with an `sgf_parser.query.Query`. The reply is any number of byte
+    messages, each an Arrow IPC stream holding one record batch of games, then
+    an empty byte message, then `(error, result)`. `error` is None on success.
+    Without a query, the games are streamed and `result` is their number. With
+    a query, no games are sent and `result` is the query's (small) DataFrame.
+
+    Replies are cached in `reply_cache`, and repeat requests are answered from
+    it while the directory's SGF files stay the same.
+    """
+    recorder = None
+    try:
+        data_source, fast_parse, *query = conn.recv()
+        query = query[0] if query else None
+        print("Received request: %s" % data_source)
+        start = timer()
+        if query is not None:
+            # Fail before parsing anything if the columns can't exist.
+            query.check(tables.table_schema(fast_parse).names)
+        if data_source:
+            key = reply_cache_key(data_source, fast_parse, query)
+            cached_reply = reply_cache.get(key)
+            if cached_reply is not None:
+                send_cached_reply(conn, cached_reply)
+                print(f"Sent cached reply. Took {timer()-start} seconds")
+                return
+            # None if another client's identical reply is being recorded.
+            recorder = reply_cache.recorder(key)
+        job = dispatcher.join(data_source, fast_parse)
+        try:
+            if query is None:
+                result = stream_reply(conn, job, fast_parse, recorder)
+            else:
+                result = run_query(conn, job, fast_parse, query)
+        finally:
+            dispatcher.leave(job)
+        send_end(conn, None, result)
+        if recorder is not None:
+            recorder.commit(result)
+        end = timer()
+        if query is None:
+            print(f"Sent reply with {result} rows. Took {end-start} seconds")
+        else:
+            print(
+                f"Sent query result with {len(result)} groups. Took {end-start} seconds"
+            )
+    except (ClientDisconnected, BrokenPipeError, ConnectionResetError):
+        print("Client disconnected, dropped request")
+    except (AssertionError, EOFError) as e:
+        print("Failed to parse:", e)
+        print(traceback.format_exc())
+        send_end(conn, e)
+    except parse_cache.ParseCancelled as e:
+        print("Request was cancelled")
+        send_end(conn, e)
+    except Exception as e:
+        print("Unknown error:", e)
+        print(traceback.format_exc())
+        send_end(conn, e)
+    finally:
+        if recorder is not None:
+            # Does nothing if the reply was committed.
+            recorder.discard()
+        print(f"Result cache: {reply_cache.metrics()}")
+        conn.close()
+
+
+def send_end(conn, error, result=None):
+    try:
+        conn.send_bytes(b"")
+        conn.send((error, result))
+    except OSError:
+        # The client has gone away.
+        pass
 
 
 if __name__ == "__main__":
-    listener = Listener(("localhost", 6536), authkey=b"secret password")
+    # For the progress the parser logs.
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    listener = Listener(ADDRESS, authkey=b"secret password")
+    dispatcher = RequestDispatcher(PARSING_PROCESSES, MAX_CONCURRENT_REQUESTS)
+    reply_cache = result_cache.ResultCache(
+        RESULT_CACHE_BYTES, RESULT_CACHE_SPILL_DIR, RESULT_CACHE_SPILL_BYTES
+    )
 
     def exit_handler():
+        with sgf_watchers_lock:
+            started = list(sgf_watchers.values())
+        for sgf_watcher in started:
+            sgf_watcher.stop()
+        dispatcher.close()
+        reply_cache.clear()
         listener.close()
         print("Parsing server is terminating")
 
@@ -35,22 +426,11 @@ if __name__ == "__main__":
     print("Parsing server is running")
 
     while True:
-        conn = listener.accept()  # wait for a connection
         try:
-            data_source, fast_parse = conn.recv()
-            print("Received request: %s" % data_source)
-            start = timer()
-            df = load_and_parse_games(data_source, fast_parse=fast_parse)
-            conn.send((None, df))
-            end = timer()
-            print(f"Sent reply with {len(df.index)} rows. Took {end-start} seconds")
-        except (AssertionError, EOFError) as e:
-            print("Failed to parse:", e)
-            print(traceback.format_exc())
-            conn.send((e, None))
-        except Exception as e:
-            print("Unknown error:", e)
-            print(traceback.format_exc())
-            conn.send((e, None))
-        finally:
-            conn.close()
+            conn = listener.accept()  # wait for a connection
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            print("Failed to accept connection:", e)
+            continue
+        threading.Thread(
+            target=handle_connection, args=(conn, dispatcher, reply_cache), daemon=True
+        ).start()
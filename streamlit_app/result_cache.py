@@ -0,0 +1,354 @@
+"""Cache of parsing server replies, so that repeat requests are answered at once.
+
+A reply is the list of byte messages sent for a request (Arrow IPC record
+batches) together with the result sent after them (see
+`parsing_server.handle_connection`). Replies are kept in RAM up to a byte budget,
+least recently used first out. With a spill directory, evicted replies are
+written there instead of dropped, up to a second budget, and are sent straight
+from a memory map of the file when requested again.
+"""
+
+import collections
+import mmap
+import os
+import sys
+import tempfile
+import threading
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import pandas as pd
+
+SPILL_PREFIX = "reply_"
+SPILL_SUFFIX = ".arrows"
+
+
+class CachedReply(NamedTuple):
+    """A reply in the cache. Iterate over `messages()` to send it."""
+
+    result: Any
+    num_bytes: int
+    # Exactly one of these is set.
+    buffers: Optional[List[Any]] = None
+    spill_path: Optional[str] = None
+    # Where each message starts in the spill file, then where the last ends.
+    offsets: Optional[List[int]] = None
+    # The spill file, opened by `ResultCache.get` so that the reply can still
+    # be read if it is evicted (and the file deleted) before it is sent.
+    spill_file: Optional[BinaryIO] = None
+
+    def messages(self) -> Iterator[memoryview]:
+        """The byte messages of the reply, in order.
+
+        Each message is only valid until the next one is taken.
+        """
+        if self.buffers is not None:
+            yield from map(memoryview, self.buffers)
+            return
+        if self.spill_file is None:
+            return
+        with self.spill_file, mmap.mmap(
+            self.spill_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            # Every view of the mapping must be released before it is closed,
+            # so a message can't be used once the next one is asked for.
+            with memoryview(mapped) as view:
+                for start, stop in zip(self.offsets, self.offsets[1:]):
+                    with view[start:stop] as message:
+                        yield message
+
+
+def _size_of(result: Any) -> int:
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    return sys.getsizeof(result)
+
+
+class ReplyRecorder:
+    """Collects the messages of a reply as they are sent, to cache it at the end.
+
+    Messages are kept in RAM while they fit in the cache's RAM budget, which
+    they count against as they arrive. Past that they go to a spill file if the
+    cache has a spill directory, and otherwise the reply is not cached.
+    """
+
+    def __init__(self, cache: "ResultCache", key: Hashable):
+        self.cache = cache
+        self.key = key
+        self.buffers: Optional[List[Any]] = []
+        self.offsets = [0]
+        self.spill_file = None
+        # Bytes of `buffers` reserved in the cache's RAM budget.
+        self.reserved = 0
+
+    def add(self, message) -> None:
+        if self.buffers is None and self.spill_file is None:
+            return
+        num_bytes = memoryview(message).nbytes
+        self.offsets.append(self.offsets[-1] + num_bytes)
+        if self.spill_file is None:
+            if self.cache.reserve(num_bytes):
+                self.reserved += num_bytes
+                self.buffers.append(message)
+                return
+            if self.cache.spill_dir is None:
+                self.discard()
+                return
+            self.spill_file = self.cache.new_spill_file()
+            for buffer in self.buffers:
+                self.spill_file.write(buffer)
+            self.spill_file.write(message)
+            self.buffers = None
+            self._release()
+        else:
+            self.spill_file.write(message)
+        if self.offsets[-1] > self.cache.max_spill_bytes:
+            self.discard()
+
+    def commit(self, result: Any) -> None:
+        """Cache the reply, which ended with `result`."""
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.cache.put_spilled(self.key, result, self.spill_file.name, self.offsets)
+        elif self.buffers is not None:
+            self._release()
+            self.cache.put(self.key, result, self.buffers)
+        # The cache owns them now, so `discard` must leave them be.
+        self.buffers = None
+        self.spill_file = None
+        self.cache.end_recording(self.key)
+
+    def discard(self) -> None:
+        """Give up on caching the reply, e.g. because it failed."""
+        self.buffers = None
+        self._release()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            os.unlink(self.spill_file.name)
+            self.spill_file = None
+        self.cache.end_recording(self.key)
+
+    def _release(self) -> None:
+        self.cache.release(self.reserved)
+        self.reserved = 0
+
+
+class ResultCache:
+    """LRU cache of replies with a RAM budget and optional spill to disk.
+
+    Thread-safe. `metrics()` reports hits, misses and usage.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        spill_dir: Optional[str] = None,
+        max_spill_bytes: int = 0,
+    ):
+        """
+        Args:
+            max_bytes: Total size of the replies kept in RAM.
+            spill_dir: Directory to write replies evicted from RAM to. None
+                drops them instead.
+            max_spill_bytes: Total size of the replies kept in `spill_dir`.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes if spill_dir else 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Left behind by an earlier server, which took its index with it.
+            for name in os.listdir(spill_dir):
+                if name.startswith(SPILL_PREFIX) and name.endswith(SPILL_SUFFIX):
+                    os.unlink(os.path.join(spill_dir, name))
+        self.lock = threading.Lock()
+        # Most recently used last.
+        self.in_memory: Dict[Hashable, CachedReply] = collections.OrderedDict()
+        self.spilled: Dict[Hashable, CachedReply] = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        # Keys of the replies being recorded, and the RAM their messages hold.
+        self.recording: Set[Hashable] = set()
+        self.recording_bytes = 0
+        self.counts = collections.Counter()
+
+    def recorder(self, key: Hashable) -> Optional[ReplyRecorder]:
+        """A recorder for the reply to `key`, or None if one is already being
+        recorded (e.g. for another client of the same request)."""
+        with self.lock:
+            if key in self.recording:
+                return None
+            self.recording.add(key)
+        return ReplyRecorder(self, key)
+
+    def end_recording(self, key: Hashable) -> None:
+        with self.lock:
+            self.recording.discard(key)
+
+    def reserve(self, num_bytes: int) -> bool:
+        """Count `num_bytes` of a reply being recorded against the RAM budget,
+        evicting cached replies to make room. Returns False if they don't fit
+        alongside the other replies being recorded."""
+        with self.lock:
+            if self.recording_bytes + num_bytes > self.max_bytes:
+                return False
+            self.recording_bytes += num_bytes
+            evicted = self._evict_in_memory()
+        for old_key, old_reply in evicted:
+            self._spill(old_key, old_reply)
+        return True
+
+    def release(self, num_bytes: int) -> None:
+        with self.lock:
+            self.recording_bytes -= num_bytes
+
+    def new_spill_file(self):
+        return tempfile.NamedTemporaryFile(
+            dir=self.spill_dir, prefix=SPILL_PREFIX, suffix=SPILL_SUFFIX, delete=False
+        )
+
+    def get(self, key: Hashable) -> Optional[CachedReply]:
+        with self.lock:
+            if key in self.in_memory:
+                self.in_memory.move_to_end(key)
+                self.counts["memory_hits"] += 1
+                return self.in_memory[key]
+            if key in self.spilled:
+                self.spilled.move_to_end(key)
+                self.counts["spill_hits"] += 1
+                reply = self.spilled[key]
+                if reply.num_bytes == 0:
+                    # Nothing to map.
+                    return reply
+                return reply._replace(spill_file=open(reply.spill_path, "rb"))
+            self.counts["misses"] += 1
+            return None
+
+    def put(self, key: Hashable, result: Any, buffers: List[Any]) -> None:
+        """Cache a reply made of `buffers`, evicting others to make room."""
+        num_bytes = sum(memoryview(buffer).nbytes for buffer in buffers) + _size_of(
+            result
+        )
+        if num_bytes > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.in_memory[key] = CachedReply(result, num_bytes, buffers=buffers)
+            self.memory_bytes += num_bytes
+            evicted = self._evict_in_memory()
+        # Spilling writes to disk, so it happens outside the lock; requests for
+        # these replies miss until it is done.
+        for old_key, old_reply in evicted:
+            self._spill(old_key, old_reply)
+
+    def put_spilled(
+        self,
+        key: Hashable,
+        result: Any,
+        spill_path: str,
+        offsets: List[int],
+        replace: bool = True,
+    ) -> None:
+        """Cache a reply that is already in a spill file, taking over the file.
+
+        The file is deleted instead if it is over the spill budget, or with
+        `replace=False` if `key` is already cached.
+        """
+        reply = CachedReply(
+            result, offsets[-1], spill_path=spill_path, offsets=list(offsets)
+        )
+        with self.lock:
+            if reply.num_bytes > self.max_spill_bytes or (
+                not replace and (key in self.in_memory or key in self.spilled)
+            ):
+                os.unlink(spill_path)
+                return
+            self._remove(key)
+            self.spilled[key] = reply
+            self.spill_bytes += reply.num_bytes
+            self.counts["spills"] += 1
+            deleted = self._evict_spilled()
+        for path in deleted:
+            os.unlink(path)
+
+    def _spill(self, key: Hashable, reply: CachedReply) -> None:
+        if self.spill_dir is None or reply.num_bytes > self.max_spill_bytes:
+            return
+        offsets = [0]
+        with self.new_spill_file() as f:
+            for buffer in reply.buffers:
+                f.write(buffer)
+                offsets.append(offsets[-1] + memoryview(buffer).nbytes)
+        # The reply may have been cached again while it was being written.
+        self.put_spilled(key, reply.result, f.name, offsets, replace=False)
+
+    def _evict_in_memory(self) -> List[Tuple[Hashable, CachedReply]]:
+        """Drop replies from RAM while over budget, counting the replies being
+        recorded. Returns them to spill. Call with the lock held."""
+        evicted = []
+        while (
+            self.in_memory and self.memory_bytes + self.recording_bytes > self.max_bytes
+        ):
+            old_key, old_reply = self.in_memory.popitem(last=False)
+            self.memory_bytes -= old_reply.num_bytes
+            self.counts["evictions"] += 1
+            evicted.append((old_key, old_reply))
+        return evicted
+
+    def _evict_spilled(self) -> List[str]:
+        """Drop spilled replies over budget. Returns the files to delete."""
+        deleted = []
+        while self.spill_bytes > self.max_spill_bytes:
+            _, old_reply = self.spilled.popitem(last=False)
+            self.spill_bytes -= old_reply.num_bytes
+            self.counts["spill_evictions"] += 1
+            deleted.append(old_reply.spill_path)
+        return deleted
+
+    def _remove(self, key: Hashable) -> None:
+        """Forget any cached reply for `key`. Call with the lock held."""
+        reply = self.in_memory.pop(key, None)
+        if reply is not None:
+            self.memory_bytes -= reply.num_bytes
+        reply = self.spilled.pop(key, None)
+        if reply is not None:
+            self.spill_bytes -= reply.num_bytes
+            os.unlink(reply.spill_path)
+
+    def clear(self) -> None:
+        with self.lock:
+            for reply in self.spilled.values():
+                os.unlink(reply.spill_path)
+            self.in_memory.clear()
+            self.spilled.clear()
+            self.memory_bytes = 0
+            self.spill_bytes = 0
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            hits = self.counts["memory_hits"] + self.counts["spill_hits"]
+            lookups = hits + self.counts["misses"]
+            return {
+                "memory_hits": self.counts["memory_hits"],
+                "spill_hits": self.counts["spill_hits"],
+                "misses": self.counts["misses"],
+                "hit_rate": hits / lookups if lookups else None,
+                "evictions": self.counts["evictions"],
+                "spills": self.counts["spills"],
+                "spill_evictions": self.counts["spill_evictions"],
+                "memory_entries": len(self.in_memory),
+                "memory_bytes": self.memory_bytes,
+                "recording_bytes": self.recording_bytes,
+                "spill_entries": len(self.spilled),
+                "spill_bytes": self.spill_bytes,
+            }